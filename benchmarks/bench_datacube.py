@@ -0,0 +1,49 @@
+import argparse, os, tempfile, time
+import numpy as np
+from daily_binaries import CYGNSS_SHAPE
+from datacube import DataCube, export_cube
+from benchmarks.synthetic import write_synthetic_days
+
+# Benchmark: pixel time series latency from the HDF5 cube vs reading every daily binary with np.fromfile
+# run from the repository root with `python -m benchmarks.bench_datacube`
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--pixels', type=int, default=20, help="random pixels whose time series are read")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    pixels = [(rng.uniform(-44, 44), rng.uniform(0, 360)) for _ in range(args.pixels)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_days(directory, args.days, CYGNSS_SHAPE)
+        files = sorted(f for f in os.listdir(directory) if f.endswith('.dat'))
+
+        cube_path = os.path.join(directory, 'cube.h5')
+        start = time.perf_counter()
+        export_cube(directory, cube_path, 'CYGNSS')
+        export_time = time.perf_counter() - start
+        dat_bytes = sum(os.path.getsize(os.path.join(directory, f)) for f in files)
+
+        # current approach: load every day in full and pick out one pixel
+        start = time.perf_counter()
+        for lat, lon in pixels[:3]:
+            row, col = int((lat + 45) / 0.05), int(lon / 0.05)
+            series = [np.fromfile(os.path.join(directory, f), dtype=np.float32).reshape(CYGNSS_SHAPE)[row, col] for f in files]
+        fromfile_time = (time.perf_counter() - start) / 3
+
+        with DataCube(cube_path) as cube:
+            start = time.perf_counter()
+            for lat, lon in pixels:
+                cube.pixel_series(lat, lon)
+            cube_time = (time.perf_counter() - start) / len(pixels)
+
+            start = time.perf_counter()
+            cube.region(-45, -10, 100, 160)
+            region_time = time.perf_counter() - start
+
+        print(f"daily binaries: {dat_bytes / 1e6:.1f} MB, cube: {os.path.getsize(cube_path) / 1e6:.1f} MB (export {export_time:.1f}s)")
+        print(f"pixel series via np.fromfile: {fromfile_time * 1000:.1f} ms")
+        print(f"pixel series via cube:        {cube_time * 1000:.1f} ms ({fromfile_time / cube_time:.0f}x)")
+        print(f"Australia box via cube:       {region_time * 1000:.1f} ms")
@@ -0,0 +1,52 @@
+import argparse, os, tempfile, time
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+from sm_retrieval_dataset import SoilMoistureRetrievalDataset, seed_worker
+from benchmarks.synthetic import write_synthetic_days
+
+# Benchmark: samples/sec of SoilMoistureRetrievalDataset full-grid and patch modes vs the old np.fromfile + torch.tensor path
+# run from the repository root with `python -m benchmarks.bench_dataset`
+
+class OldDataset(Dataset):
+    def __init__(self, paths):
+        self.cygnss_paths = paths
+
+    def __len__(self):
+        return len(self.cygnss_paths)
+
+    def __getitem__(self, idx):
+        cygnss_data = np.fromfile(self.cygnss_paths[idx], dtype=np.float32).reshape(1800, 7200)
+        return torch.tensor(cygnss_data)
+
+def samples_per_second(dataset, batch_size, workers, max_batches):
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=workers, worker_init_fn=seed_worker)
+    samples = 0
+    start = time.perf_counter()
+    for i, batch in enumerate(loader):
+        samples += batch.shape[0]
+        if i + 1 >= max_batches:
+            break
+    return samples / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--patch-size', type=int, default=256)
+    parser.add_argument('--batches', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.makedirs(os.path.join(directory, '2018'))
+        write_synthetic_days(os.path.join(directory, '2018'), args.days, (1800, 7200), fraction_filled=0.3)
+
+        full = SoilMoistureRetrievalDataset(directory, ['2018'])
+        old = OldDataset(full.cygnss_paths)
+        random_patches = SoilMoistureRetrievalDataset(directory, ['2018'], patch_size=args.patch_size, random_patches=True)
+        strided = SoilMoistureRetrievalDataset(directory, ['2018'], patch_size=args.patch_size, min_valid_fraction=0.2)
+
+        print(f"old full grids:       {samples_per_second(old, 4, args.workers, args.batches):8.1f} samples/sec")
+        print(f"mmap full grids:      {samples_per_second(full, 4, args.workers, args.batches):8.1f} samples/sec")
+        print(f"random {args.patch_size} patches:  {samples_per_second(random_patches, 64, args.workers, args.batches):8.1f} samples/sec")
+        print(f"strided {args.patch_size} patches: {samples_per_second(strided, 64, args.workers, args.batches):8.1f} samples/sec")
@@ -0,0 +1,60 @@
+import argparse, os, tempfile, time, tracemalloc
+import numpy as np
+import netCDF4
+from gridding import CYGNSS_GRID, cell_indices, valid_values, bin_partial
+from ingest import SPECS, read_granule
+from benchmarks.synthetic import write_cygnss_granule
+
+# Benchmark: peak memory and wall time per granule of the chunked, selective reader in granules.py
+# (ingest.read_granule with the CYGNSS_QC spec) vs the old read-everything read_file of make_grid_CYGNSS.py,
+# on synthetic CYGNSS granules
+# run from the repository root with `python -m benchmarks.bench_granules`
+
+def old_read_file(file):
+    nc_file = netCDF4.Dataset(file, "r", format="NETCDF4")
+
+    refl = nc_file.variables['reflectivity_peak'][:]
+    snr = nc_file.variables['ddm_snr'][:]
+    lon = nc_file.variables['sp_lon'][:]
+    lat = nc_file.variables['sp_lat'][:]
+    quality = nc_file.variables['quality_flags'][:]
+    quality_2 = nc_file.variables['quality_flags_2'][:]
+
+    cells, in_grid = cell_indices(lat, lon, CYGNSS_GRID)
+    valid_quality = ((quality & 1) == 0) | ((quality_2 & 2048) == 0)
+    snr_partial = bin_partial(cells, snr, valid_values(snr, in_grid, np.ma.getdata(valid_quality)))
+    refl_partial = bin_partial(cells, refl, valid_values(refl, in_grid, np.ma.getdata(valid_quality & (snr <= 2))))
+
+    nc_file.close()
+    return snr_partial, refl_partial
+
+def measure(func, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=170000, help="samples per granule (a real day is ~170k)")
+    parser.add_argument('--granules', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(args.granules):
+            path = os.path.join(directory, f"cyg0{i + 1}.ddmi.s20240201-000000-e20240201-235959.l1.power-brcs.a32.d33.nc")
+            write_cygnss_granule(path, args.samples, seed=i)
+            paths.append(path)
+
+        old = [measure(old_read_file, path) for path in paths]
+        new = [measure(read_granule, path, SPECS["CYGNSS_QC"]) for path in paths]
+        box = [measure(read_granule, path, SPECS["CYGNSS_QC"], (-45, -10, 100, 160)) for path in paths]
+
+        for name, results in [('old full read', old), ('chunked reader', new), ('chunked + Australia box', box)]:
+            elapsed = np.mean([r[0] for r in results])
+            peak = np.max([r[1] for r in results])
+            print(f"{name:24s} {elapsed * 1000:8.1f} ms/granule  peak {peak / 2**20:7.1f} MiB")
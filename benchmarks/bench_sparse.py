@@ -0,0 +1,46 @@
+import argparse, os, tempfile, time
+import numpy as np
+from gridding import CYGNSS_GRID
+from daily_binaries import CYGNSS_SHAPE, write_daily, open_daily
+from sparse_daily import SparseGrid
+from benchmarks.synthetic import synthetic_accumulator
+
+# Benchmark: bytes on disk, write time and read time of sparse .sdat days vs dense .dat days at several fill fractions
+# run from the repository root with `python -m benchmarks.bench_sparse`
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--fractions', type=float, nargs='+', default=[0.001, 0.01, 0.05, 0.2, 0.5])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'filled':>8} {'dense MB':>9} {'sparse MB':>10} {'dense write':>12} {'sparse write':>13} "
+          f"{'dense read':>11} {'sparse read':>12} {'sparse rows':>12}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for fraction in args.fractions:
+            accumulator = synthetic_accumulator(CYGNSS_GRID, fraction)
+            dense_dir, sparse_dir = os.path.join(directory, 'dense'), os.path.join(directory, 'sparse')
+
+            dense_write, outputs = timed(lambda: write_daily(accumulator, dense_dir, 'SNR', '2024-02-01'), args.repeat)
+            sparse_write, _ = timed(lambda: write_daily(accumulator, sparse_dir, 'SNR', '2024-02-01', sparse=True),
+                                    args.repeat)
+            dense_path = os.path.join(dense_dir, 'SNR', '2024', '2024-02-01.dat')
+            sparse_path = os.path.join(sparse_dir, 'SNR', '2024', '2024-02-01.sdat')
+            dense_bytes = sum(os.path.getsize(path) for path, _ in outputs.values())
+            sparse_bytes = os.path.getsize(sparse_path)
+
+            # a full dense grid read, and the 100 row band a patch or a composite chunk would read
+            dense_read, dense = timed(lambda: np.array(open_daily(dense_path, CYGNSS_SHAPE)), args.repeat)
+            sparse_read, sparse = timed(lambda: np.asarray(SparseGrid(sparse_path)), args.repeat)
+            band_read, _ = timed(lambda: np.asarray(SparseGrid(sparse_path)[800:900]), args.repeat)
+            assert np.array_equal(dense, sparse)
+
+            print(f"{fraction:8.3f} {dense_bytes / 1e6:9.1f} {sparse_bytes / 1e6:10.2f} {dense_write:11.3f}s "
+                  f"{sparse_write:12.3f}s {dense_read:10.3f}s {sparse_read:11.3f}s {band_read:11.4f}s")
@@ -0,0 +1,187 @@
+import argparse, json, os, platform, subprocess, tempfile, time
+from datetime import datetime, timezone
+import numpy as np
+from benchmarks.synthetic import write_granule_tree, write_daily_stack
+
+# Benchmark: the whole pipeline on synthetic data at a chosen scale, with results kept per commit
+# gridding, daily binaries, regression, comparison statistics, dataset loading and map rendering are each timed on
+# the same synthetic granules and daily stacks (benchmarks/synthetic.py); every run appends one JSON line with the
+# commit, scale and timings to --results, and --compare prints the change against the last run of another commit
+# run from the repository root with `python -m benchmarks.bench_suite --scale small`
+
+# days:      days of raw granules and of daily binaries
+# granules:  granules per day and mission
+# samples:   samples per granule (a real CYGNSS day is ~170k x 4 ddm)
+# fraction:  filled fraction of the synthetic daily grids
+# level:     pyramid level the regression runs on
+# batches:   dataset batches read
+SCALES = {
+    'tiny': dict(days=2, granules=2, samples=20000, fraction=0.05, level='1deg', batches=4),
+    'small': dict(days=4, granules=4, samples=60000, fraction=0.1, level='25km', batches=10),
+    'medium': dict(days=8, granules=8, samples=170000, fraction=0.2, level='10km', batches=20),
+    'large': dict(days=30, granules=8, samples=170000, fraction=0.3, level='5km', batches=50),
+}
+
+BENCHMARKS = ['gridding', 'daily', 'regression', 'comparison', 'dataset', 'render']
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results.jsonl')
+
+def git_commit():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def bench_gridding(data, scale, workers):
+    from ingest import SPECS, LAYOUTS, grid_files
+
+    results = {}
+    for name, spec_name in [('cygnss', 'CYGNSS_QC'), ('spire', 'SPIRE')]:
+        spec = SPECS[spec_name]
+        files = [file for files in LAYOUTS[spec.layout](data[name]).values() for file in files]
+        seconds, _ = timed(grid_files, spec, files)
+        results[f'{name}_seconds'] = seconds
+        results[f'{name}_granules_per_s'] = len(files) / seconds
+    results['seconds'] = results['cygnss_seconds'] + results['spire_seconds']
+    return results
+
+def bench_daily(data, scale, workers):
+    from ingest import SPECS, build_daily
+    from instrument import RunMetrics
+    from quarantine import Quarantine
+
+    output = os.path.join(data['root'], 'daily_bench')
+    seconds, _ = timed(build_daily, SPECS['CYGNSS'], data['cygnss'], output, workers=workers, force=True,
+                       levels=['10km', '25km', '1deg'], quarantine=Quarantine(os.path.join(output, 'quarantine.json')),
+                       metrics=RunMetrics(None, 'cygnss'))
+    return {'seconds': seconds, 'days_per_s': scale['days'] / seconds}
+
+def bench_regression(data, scale, workers):
+    from regression_SPIRE_CYGNSS import grab_data, fit_stack
+
+    seconds, (spire, cygnss) = timed(grab_data, data['spire_daily'], data['cygnss_daily'], None, None, scale['level'])
+    fit_seconds, grids = timed(fit_stack, spire, cygnss)
+    return {'seconds': seconds + fit_seconds, 'fit_seconds': fit_seconds, 'fitted_pixels': int((grids['count'] > 0).sum())}
+
+def bench_comparison(data, scale, workers):
+    from comparison_stats import REGIONS, daily_statistics
+
+    regions = {name: box for name, box in REGIONS.items() if not isinstance(box, str)}
+    seconds, table = timed(daily_statistics, data['spire_daily'], data['cygnss_daily'], regions=regions)
+    return {'seconds': seconds, 'rows': len(table)}
+
+def bench_dataset(data, scale, workers):
+    from torch.utils.data import DataLoader
+    from sm_retrieval_dataset import SoilMoistureRetrievalDataset
+
+    results = {}
+    for name, kwargs, batch_size in [('full', {}, 2), ('patches', dict(patch_size=256, random_patches=True), 64)]:
+        dataset = SoilMoistureRetrievalDataset(os.path.dirname(data['cygnss_daily']), ['2024'], **kwargs)
+        loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=0)
+        samples, start = 0, time.perf_counter()
+        for i, batch in enumerate(loader):
+            samples += batch.shape[0]
+            if i + 1 >= scale['batches']:
+                break
+        seconds = time.perf_counter() - start
+        results[f'{name}_seconds'] = seconds
+        results[f'{name}_samples_per_s'] = samples / seconds
+    results['seconds'] = results['full_seconds'] + results['patches_seconds']
+    return results
+
+def bench_render(data, scale, workers):
+    from daily_binaries import CYGNSS_SHAPE, daily_paths, open_daily
+    from map_renderer import MapRenderer
+
+    renderer = MapRenderer(figsize=(12, 8), dpi=100)
+    paths = list(daily_paths(data['cygnss_daily']).values())
+    maps = [dict(grid=open_daily(path, CYGNSS_SHAPE), title=f"map {i}", label='reflectivity',
+                 file_name=os.path.join(data['root'], f'map_{i}.png'), vmin=0, vmax=0.05,
+                 extent=(0, 360, -45, 45)) for i, path in enumerate(paths)]
+    seconds, _ = timed(renderer.render_batch, maps)
+    renderer.close()
+    return {'seconds': seconds, 'maps_per_s': len(maps) / seconds}
+
+# the synthetic granule trees and daily stacks every benchmark reads
+def write_inputs(root, scale):
+    data = {'root': root, 'cygnss': os.path.join(root, 'cygnss_raw'), 'spire': os.path.join(root, 'spire_raw')}
+    write_granule_tree('CYGNSS', data['cygnss'], scale['days'], scale['granules'], scale['samples'], mss_every=4)
+    write_granule_tree('SPIRE', data['spire'], scale['days'], scale['granules'], scale['samples'] * 4, seed=1000)
+
+    levels = ['10km', '25km', '1deg']
+    write_daily_stack(os.path.join(root, 'spire_daily'), 'SPIRE', 'reflectivity', scale['days'], scale['fraction'], levels)
+    write_daily_stack(os.path.join(root, 'cygnss_daily'), 'CYGNSS', 'reflectivity', scale['days'], scale['fraction'],
+                      levels, seed=500)
+    data['spire_daily'] = os.path.join(root, 'spire_daily', 'reflectivity', '2024')
+    data['cygnss_daily'] = os.path.join(root, 'cygnss_daily', 'reflectivity', '2024')
+    return data
+
+# the last result of the same scale from another commit
+def previous_result(path, record):
+    if not os.path.exists(path):
+        return None
+
+    previous = None
+    with open(path, 'r') as f:
+        for line in f:
+            entry = json.loads(line)
+            if entry['scale'] == record['scale'] and entry['commit'] != record['commit']:
+                previous = entry
+    return previous
+
+def print_comparison(record, previous):
+    print(f"\n{'benchmark':12s} {'seconds':>9s} {previous['commit'] if previous else '':>9s} {'change':>8s}")
+    for name, result in record['results'].items():
+        line = f"{name:12s} {result['seconds']:9.3f}"
+        if previous and name in previous['results']:
+            before = previous['results'][name]['seconds']
+            line += f" {before:9.3f} {100 * (result['seconds'] - before) / before:+7.1f}%"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', default='small', choices=SCALES.keys())
+    parser.add_argument('--only', nargs='+', default=BENCHMARKS, choices=BENCHMARKS)
+    parser.add_argument('--days', type=int, default=None, help="override the scale's days")
+    parser.add_argument('--samples', type=int, default=None, help="override the scale's samples per granule")
+    parser.add_argument('--workers', type=int, default=1, help="processes for the daily binary build")
+    parser.add_argument('--results', default=RESULTS, help="JSON lines file the results are appended to")
+    parser.add_argument('--no-save', action='store_true', help="only print the results")
+    parser.add_argument('--compare', action='store_true', help="compare with the last run of another commit")
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    scale.update({key: value for key, value in [('days', args.days), ('samples', args.samples)] if value is not None})
+
+    commit, dirty = git_commit()
+    record = {
+        'commit': commit, 'dirty': dirty, 'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'scale': args.scale, 'params': scale, 'workers': args.workers,
+        'host': platform.node(), 'python': platform.python_version(), 'numpy': np.__version__, 'results': {},
+    }
+
+    with tempfile.TemporaryDirectory() as root:
+        seconds, data = timed(write_inputs, root, scale)
+        print(f"Synthetic inputs written in {seconds:.1f}s")
+
+        for name in args.only:
+            print(f"Running {name}")
+            record['results'][name] = globals()[f'bench_{name}'](data, scale, args.workers)
+
+    previous = previous_result(args.results, record) if args.compare else None
+    print_comparison(record, previous)
+
+    if not args.no_save:
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+        print(f"Results appended to {args.results}")
@@ -0,0 +1,151 @@
+import os
+from datetime import date as Date, timedelta
+import numpy as np
+import netCDF4
+from gridding import SPIRE_GRID, CYGNSS_GRID, GridAccumulator, Partial
+from daily_binaries import write_pyramid
+
+# Synthetic inputs for the benchmarks, so they run without /data01
+# granules follow the variable layout of ncdump.out: (sample, ddm) float32 variables with a -9999 _FillValue, int32
+# quality flags, time_coverage_start/end attributes and zlib compressed HDF5 chunks; old mss_matchup CYGNSS granules
+# have no reflectivity_peak and cover [-90, 90], SPIRE granules are one (sample,) track per file
+
+FILL = -9999.0
+
+# specular points move along tracks, so consecutive readings often land in the same 5km cell
+def synthetic_specular_points(n_samples, n_tracks, seed=0, lat_range=(-60, 60)):
+    rng = np.random.default_rng(seed)
+    track = rng.integers(0, n_tracks, n_samples)
+    start_lat = rng.uniform(lat_range[0], lat_range[1], n_tracks)
+    start_lon = rng.uniform(0, 360, n_tracks)
+    step = np.arange(n_samples) % 1000
+
+    lat = np.clip(start_lat[track] + step * 0.001, -90, 90).astype(np.float32)
+    lon = ((start_lon[track] + step * 0.003) % 360).astype(np.float32)
+    values = rng.gamma(2.0, 0.5, n_samples).astype(np.float32)
+    values[rng.random(n_samples) < 0.05] = np.nan
+
+    return lat, lon, values
+
+def _create(nc_file, name, dtype, dimensions, values, fill, chunk_samples):
+    chunks = (min(values.shape[0], chunk_samples),) + values.shape[1:]
+    variable = nc_file.createVariable(name, dtype, dimensions, fill_value=fill, zlib=True, chunksizes=chunks)
+    variable[:] = values
+
+def _coverage(nc_file, day):
+    nc_file.time_coverage_start = f"{day}T00:00:00.499261625Z"
+    nc_file.time_coverage_end = f"{day}T23:59:59.999261587Z"
+
+# day is YYYY-MM-DD; missing positions and readings are written as the -9999 fill, about 10% of the samples have
+# bit 1 of quality_flags and bit 2048 of quality_flags_2 set
+def write_cygnss_granule(path, n_samples, n_extra=20, seed=0, day='2024-02-01', mss_matchup=False, chunk_samples=8192):
+    rng = np.random.default_rng(seed)
+    lat_range = (-90, 90) if mss_matchup else (-40, 40)
+    lat = rng.uniform(*lat_range, (n_samples, 4)).astype(np.float32)
+    lon = rng.uniform(0, 360, (n_samples, 4)).astype(np.float32)
+    missing = rng.random((n_samples, 4)) < 0.02
+    lat[missing], lon[missing] = FILL, FILL
+
+    snr = rng.normal(3, 2, (n_samples, 4)).astype(np.float32)
+    snr[rng.random((n_samples, 4)) < 0.01] = FILL
+
+    with netCDF4.Dataset(path, 'w') as nc_file:
+        nc_file.createDimension('sample', n_samples)
+        nc_file.createDimension('ddm', 4)
+        _coverage(nc_file, day)
+
+        dimensions = ('sample', 'ddm')
+        _create(nc_file, 'sp_lat', 'f4', dimensions, lat, FILL, chunk_samples)
+        _create(nc_file, 'sp_lon', 'f4', dimensions, lon, FILL, chunk_samples)
+        _create(nc_file, 'ddm_snr', 'f4', dimensions, snr, FILL, chunk_samples)
+        if not mss_matchup:
+            _create(nc_file, 'reflectivity_peak', 'f4', dimensions,
+                    rng.gamma(2, 0.005, (n_samples, 4)).astype(np.float32), FILL, chunk_samples)
+
+        quality = np.where(rng.random((n_samples, 4)) < 0.1, 1, 0) | (rng.integers(0, 1024, (n_samples, 4)) & ~1)
+        quality_2 = np.where(rng.random((n_samples, 4)) < 0.1, 2048, 0) | rng.integers(0, 2048, (n_samples, 4))
+        _create(nc_file, 'quality_flags', 'i4', dimensions, quality.astype(np.int32), -9999, chunk_samples)
+        _create(nc_file, 'quality_flags_2', 'i4', dimensions, quality_2.astype(np.int32), -9999, chunk_samples)
+
+        # real granules carry many more per-sample variables that gridding never needs
+        for i in range(n_extra):
+            _create(nc_file, f'extra_{i}', 'f4', dimensions, rng.random((n_samples, 4)).astype(np.float32), FILL,
+                    chunk_samples)
+
+def write_spire_granule(path, n_samples, seed=0, day='2024-02-01', chunk_samples=8192):
+    lat, lon, reflectivity = synthetic_specular_points(n_samples, max(1, n_samples // 1000), seed, (-90, 90))
+    rng = np.random.default_rng(seed)
+    snr = rng.normal(5, 3, n_samples).astype(np.float32)
+
+    with netCDF4.Dataset(path, 'w') as nc_file:
+        nc_file.createDimension('sample', n_samples)
+        _coverage(nc_file, day)
+        _create(nc_file, 'sp_lat', 'f4', ('sample',), lat, FILL, chunk_samples)
+        _create(nc_file, 'sp_lon', 'f4', ('sample',), lon, FILL, chunk_samples)
+        _create(nc_file, 'reflect_snr_at_sp', 'f4', ('sample',), snr, FILL, chunk_samples)
+        _create(nc_file, 'reflectivity_at_sp', 'f4', ('sample',), np.nan_to_num(reflectivity * 0.01, nan=FILL), FILL,
+                chunk_samples)
+
+def synthetic_dates(n_days, start='2024-02-01'):
+    first = Date.fromisoformat(start)
+    return [(first + timedelta(days=day)).isoformat() for day in range(n_days)]
+
+# a raw granule tree laid out like the real one, so the ingest layouts find it:
+#   CYGNSS: <root>/<year>/<day of year>/cygNN.ddmi.sYYYYMMDD-000000-eYYYYMMDD-235959.l1...nc
+#   SPIRE:  <root>/YYYYMMDD/spire_gnss-r_..._YYYYMMDDTHHMMSS_FMNNN.nc
+# mss_every > 0 makes every mss_every-th CYGNSS granule an mss_matchup one; returns the written paths
+def write_granule_tree(mission, root, n_days, granules_per_day, n_samples, start='2024-02-01', mss_every=0, seed=0):
+    paths = []
+    for d, day in enumerate(synthetic_dates(n_days, start)):
+        compact = day.replace('-', '')
+        for g in range(granules_per_day):
+            granule_seed = seed + d * granules_per_day + g
+            if mission == 'SPIRE':
+                folder = os.path.join(root, compact)
+                path = os.path.join(folder, f"spire_gnss-r_L1B_grzRfl_v06.01_{compact}T{g:02d}0000_FM{100 + g}.nc")
+                os.makedirs(folder, exist_ok=True)
+                write_spire_granule(path, n_samples, granule_seed, day)
+            else:
+                folder = os.path.join(root, day[:4], f"{Date.fromisoformat(day).timetuple().tm_yday:03d}")
+                mss = mss_every > 0 and (d * granules_per_day + g) % mss_every == mss_every - 1
+                kind = 'mss_matchup.a21.d21' if mss else 'power-brcs.a32.d33'
+                path = os.path.join(folder, f"cyg{g + 1:02d}.ddmi.s{compact}-000000-e{compact}-235959.l1.{kind}.nc")
+                os.makedirs(folder, exist_ok=True)
+                write_cygnss_granule(path, n_samples, n_extra=4, seed=granule_seed, day=day, mss_matchup=mss)
+            paths.append(path)
+    return paths
+
+# plain <directory>/<date>.dat float32 grids with about fraction_filled of the cells holding a value
+def write_synthetic_days(directory, n_days, shape, fraction_filled=0.1, seed=0, start='2024-01-01'):
+    rng = np.random.default_rng(seed)
+    paths = []
+    for day in synthetic_dates(n_days, start):
+        grid = np.full(shape, -9999, dtype=np.float32)
+        filled = rng.random(shape) < fraction_filled
+        grid[filled] = rng.gamma(2.0, 0.005, int(filled.sum()))
+        path = os.path.join(directory, f"{day}.dat")
+        grid.tofile(path)
+        paths.append(path)
+    return paths
+
+# a GridAccumulator with about fraction of the grid's cells filled by 1-4 readings each
+def synthetic_accumulator(spec, fraction, seed=0, scale=0.005):
+    rng = np.random.default_rng(seed)
+    n_cells = spec.n_rows * spec.n_cols
+    cells = np.flatnonzero(rng.random(n_cells) < fraction).astype(np.int32)
+    counts = rng.integers(1, 5, cells.size).astype(np.int32)
+    sums = rng.gamma(2.0, scale, cells.size) * counts
+
+    accumulator = GridAccumulator(spec)
+    accumulator.add(Partial(cells, sums, counts))
+    return accumulator
+
+# daily binaries of one mission and product in the <output_dir>/<product>/<year>/<date>.dat layout ingest.py writes,
+# with counts and the requested pyramid levels, returns the dates
+def write_daily_stack(output_dir, mission, product, n_days, fraction=0.1, levels=(), start='2024-02-01', seed=0,
+                      sparse=False):
+    spec = SPIRE_GRID if mission == 'SPIRE' else CYGNSS_GRID
+    dates = synthetic_dates(n_days, start)
+    for d, day in enumerate(dates):
+        write_pyramid(synthetic_accumulator(spec, fraction, seed + d), output_dir, product, day, levels, sparse)
+    return dates
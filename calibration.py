@@ -0,0 +1,230 @@
+import argparse, json, os
+from functools import partial
+from pathlib import Path
+import numpy as np
+from manifest import Manifest, atomic_write, atomic_tofile
+from gridding import FILL_VALUE, CYGNSS_GRID, PYRAMID_LEVELS, GridAccumulator, level_spec, file_pool, map_files
+from daily_binaries import SPIRE_SHAPE, SPIRE_CYGNSS_ROWS, open_daily, open_daily_with_count, find_daily, daily_path, \
+    daily_paths, count_product, level_shape, level_rows, level_product, write_daily
+from comparison_stats import REGIONS, grid_coordinates
+from grid_io import open_grid
+
+# Task: turn the per-pixel SPIRE -> CYGNSS regression (regression_SPIRE_CYGNSS.py fits cygnss = intercept + slope *
+# spire) into harmonized data: CYGNSS-equivalent SPIRE daily grids and a merged CYGNSS + SPIRE product
+# the coefficients are resolved once into slope/intercept grids on the daily grid, every pixel taking the first
+# reliable fit of: the pixel fit at each coefficient level (finest first), its region, the whole grid; the apply
+# stage then memmaps them and streams the dates through worker processes
+#
+#   python calibration.py resolve --coefficient-levels 5km 1deg
+#   python calibration.py apply --start 2024-01-25 --end 2024-06-02 --workers 8
+#
+# outputs follow the daily layout of ingest.py (<output_dir>/<product>/<year>/<date>.dat plus _count):
+#   spire_<product>   SPIRE on the CYGNSS grid ([-45, 45]) mapped to CYGNSS values
+#   merged_<product>  count-weighted mean of CYGNSS and calibrated SPIRE
+
+COEFFICIENTS = '/data01/lpu/calibration/coefficients'
+CALIBRATED = '/data01/lpu/CALIBRATED'
+FALLBACK_REGIONS = ['tropics', 'north_subtropics', 'south_subtropics']
+
+# cells of the regression grids (any level) with a fit good enough to use
+def reliable_fits(grids, min_count=10, max_mse=None):
+    reliable = (grids['slope'] != FILL_VALUE) & (grids['count'] >= min_count)
+    if max_mse is not None:
+        reliable &= (grids['mse'] != FILL_VALUE) & (grids['mse'] <= max_mse)
+    return reliable
+
+# count-weighted mean slope and intercept of the reliable fits where mask is set, None if there are none
+# (an average of the pixel fits, not a pooled refit, which would need the daily stacks again)
+def pooled_coefficients(grids, reliable, mask=None):
+    use = reliable if mask is None else reliable & mask
+    weights = grids['count'][use].astype(np.float64)
+    if weights.sum() == 0:
+        return None
+    return float(np.average(grids['slope'][use], weights=weights)), float(np.average(grids['intercept'][use], weights=weights))
+
+def load_regression(regression_dir, level):
+    suffix = '' if level == '5km' else f'_{level}'
+    return {name: open_grid(f"{regression_dir}/{name}_grid{suffix}.npy") for name in ['slope', 'intercept', 'mse', 'count']}
+
+def upsample(grid, factor):
+    return grid if factor == 1 else np.repeat(np.repeat(grid, factor, axis=0), factor, axis=1)
+
+# slope, intercept and source (index into the returned sources list, 255 where nothing applies) on the CYGNSS grid at
+# `level`, from the regression grids of coefficient_levels (each no finer than level)
+def resolve_coefficients(regression_dir, level='5km', coefficient_levels=('5km',), regions=FALLBACK_REGIONS,
+                         min_count=10, max_mse=None):
+    shape = level_shape((CYGNSS_GRID.n_rows, CYGNSS_GRID.n_cols), level)
+    slope = np.full(shape, np.nan, dtype=np.float32)
+    intercept = np.full(shape, np.nan, dtype=np.float32)
+    source = np.full(shape, 255, dtype=np.uint8)
+    sources = []
+
+    finest = None
+    for coefficient_level in coefficient_levels:
+        factor = PYRAMID_LEVELS[coefficient_level] // PYRAMID_LEVELS[level]
+        if factor < 1:
+            raise ValueError(f"coefficients at {coefficient_level} are finer than the {level} grids they calibrate")
+
+        grids = load_regression(regression_dir, coefficient_level)
+        reliable = reliable_fits(grids, min_count, max_mse)
+        finest = finest or (grids, reliable)
+
+        use = upsample(reliable, factor) & (source == 255)
+        slope[use] = upsample(grids['slope'], factor)[use]
+        intercept[use] = upsample(grids['intercept'], factor)[use]
+        source[use] = len(sources)
+        sources.append(f"pixel:{coefficient_level}")
+
+    grids, reliable = finest
+    coarse_lat, coarse_lon = grid_coordinates(grids['slope'].shape)
+    lat, lon = grid_coordinates(shape)
+    for name in regions:
+        latmin, latmax, lonmin, lonmax = REGIONS[name]
+        in_region = lambda lat, lon: ((lat >= latmin) & (lat <= latmax))[:, None] & ((lon >= lonmin) & (lon <= lonmax))[None, :]
+        coefficients = pooled_coefficients(grids, reliable, in_region(coarse_lat, coarse_lon))
+        if coefficients is None:
+            continue
+
+        use = in_region(lat, lon) & (source == 255)
+        slope[use], intercept[use] = coefficients
+        source[use] = len(sources)
+        sources.append(f"region:{name}")
+
+    coefficients = pooled_coefficients(grids, reliable)
+    if coefficients is not None:
+        use = source == 255
+        slope[use], intercept[use] = coefficients
+        source[use] = len(sources)
+        sources.append('global')
+
+    return slope, intercept, source, sources
+
+def write_coefficients(coefficient_dir, level, slope, intercept, source, sources, **params):
+    os.makedirs(coefficient_dir, exist_ok=True)
+    for name, grid in [('slope', slope), ('intercept', intercept), ('source', source)]:
+        atomic_tofile(grid, os.path.join(coefficient_dir, f"{name}.dat"))
+
+    counts = np.bincount(source.ravel(), minlength=256)
+    metadata = {'level': level, 'shape': list(slope.shape), 'sources': sources, 'params': params,
+                'pixels_per_source': {name: int(counts[i]) for i, name in enumerate(sources)}}
+    atomic_write(os.path.join(coefficient_dir, 'coefficients.json'), json.dumps(metadata, indent=1).encode())
+    return metadata
+
+def open_coefficients(coefficient_dir):
+    with open(os.path.join(coefficient_dir, 'coefficients.json'), 'r') as f:
+        metadata = json.load(f)
+    shape = tuple(metadata['shape'])
+    slope = open_daily(os.path.join(coefficient_dir, 'slope.dat'), shape)
+    intercept = open_daily(os.path.join(coefficient_dir, 'intercept.dat'), shape)
+    return metadata, slope, intercept
+
+def coefficient_files(coefficient_dir):
+    return [os.path.join(coefficient_dir, name) for name in ['coefficients.json', 'slope.dat', 'intercept.dat']]
+
+# the mean and (if written) count binaries of a date, what a calibrated date depends on besides the coefficients
+def daily_inputs(root, product, date):
+    path = find_daily(root, product, date)
+    if path is None:
+        return []
+    count_path = daily_path(root, count_product(product), date)
+    return [path] + ([count_path] if os.path.exists(count_path) else [])
+
+# calibrates one date (in a worker) and writes spire_<product> and merged_<product>, returns their Manifest entries
+def calibrate_date(date, spire_root, cygnss_root, product, coefficient_dir, output_dir, level='5km', sparse=False):
+    _, slope, intercept = open_coefficients(coefficient_dir)
+    spec = level_spec(CYGNSS_GRID, level)
+    name = level_product(product, level)
+
+    spire_mean, spire_count = open_daily_with_count(spire_root, name, date, level_shape(SPIRE_SHAPE, level))
+    rows = level_rows(SPIRE_CYGNSS_ROWS, level)
+    spire_mean, spire_count = np.asarray(spire_mean[rows]), np.asarray(spire_count[rows])
+
+    valid = spire_mean != FILL_VALUE
+    # pixels without a fit or fallback (source 255) have NaN coefficients, they are left empty (fill value, count 0)
+    unresolved = valid & ~(np.isfinite(slope) & np.isfinite(intercept))
+    if unresolved.any():
+        print(f"- {date}: dropped {np.count_nonzero(unresolved)} SPIRE pixels without coefficients")
+    valid &= ~unresolved
+    calibrated = intercept[valid] + slope[valid] * spire_mean[valid].astype(np.float64)
+    spire = GridAccumulator(spec)
+    spire.count[valid] = spire_count[valid]
+    spire.sum[valid] = calibrated * spire_count[valid]
+
+    merged = GridAccumulator(spec)
+    merged.sum[:], merged.count[:] = spire.sum, spire.count
+    if find_daily(cygnss_root, name, date) is not None:
+        merged.add_grid(*open_daily_with_count(cygnss_root, name, date, (spec.n_rows, spec.n_cols)))
+
+    outputs = write_daily(spire, output_dir, level_product(f"spire_{product}", level), date, sparse)
+    outputs.update(write_daily(merged, output_dir, level_product(f"merged_{product}", level), date, sparse))
+    return outputs
+
+# every SPIRE date in [start, end], skipping the ones whose inputs and coefficients are unchanged since the last run
+def apply_calibration(spire_root, cygnss_root, product, coefficient_dir, output_dir, start=None, end=None, level='5km',
+                      workers=1, force=False, sparse=False):
+    metadata, _, _ = open_coefficients(coefficient_dir)
+    if metadata['level'] != level:
+        raise ValueError(f"coefficients in {coefficient_dir} were resolved for {metadata['level']}, not {level}")
+
+    name = level_product(product, level)
+    dates = []
+    for year_dir in sorted(Path(spire_root, name).iterdir()):
+        dates.extend(daily_paths(year_dir, start, end))
+
+    manifest = Manifest(f"{output_dir}/manifest_CALIBRATION_{name}.json")
+    inputs = lambda date: (daily_inputs(spire_root, name, date) + daily_inputs(cygnss_root, name, date)
+                           + coefficient_files(coefficient_dir))
+
+    # a date calibrated into the other format is redone, write_daily then removes its old files
+    params = {'sparse': bool(sparse)}
+    todo = [date for date in sorted(dates) if force or not manifest.is_current(date, inputs(date), params=params)]
+    print(f"Calibrating {len(todo)} of {len(dates)} SPIRE dates with the coefficients in {coefficient_dir}")
+
+    calibrate = partial(calibrate_date, spire_root=spire_root, cygnss_root=cygnss_root, product=product,
+                        coefficient_dir=coefficient_dir, output_dir=output_dir, level=level, sparse=sparse)
+    try:
+        with file_pool(workers) as executor:
+            for date, (outputs, error) in map_files(calibrate, todo, executor):
+                if error is not None:
+                    print(f"- Failed to calibrate {date}: {error!r}")
+                    continue
+                print(f"- Calibrated {date}")
+                manifest.record(date, inputs(date), outputs, params)
+    finally:
+        manifest.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['resolve', 'apply'])
+    parser.add_argument('--regression-dir', default='/data01/lpu', help="where regression_SPIRE_CYGNSS.py wrote its grids")
+    parser.add_argument('--coefficient-dir', default=COEFFICIENTS)
+    parser.add_argument('--level', default='5km', choices=PYRAMID_LEVELS.keys(), help="level of the grids calibrated")
+    parser.add_argument('--coefficient-levels', nargs='+', default=['5km'], choices=PYRAMID_LEVELS.keys(),
+                        help="regression levels tried in order, e.g. 5km 1deg falls back to the 1deg fit")
+    parser.add_argument('--regions', nargs='*', default=FALLBACK_REGIONS,
+                        choices=[name for name, box in REGIONS.items() if not isinstance(box, str)],
+                        help="regions whose pooled fit is used where no pixel fit is reliable (before the global one)")
+    parser.add_argument('--min-count', type=int, default=10, help="fewest paired days of a reliable pixel fit")
+    parser.add_argument('--max-mse', type=float, default=None, help="largest test MSE of a reliable pixel fit")
+    parser.add_argument('--spire-root', default='/data01/lpu/SPIRE')
+    parser.add_argument('--cygnss-root', default='/data01/lpu/CYGNSS')
+    parser.add_argument('--product', default='reflectivity')
+    parser.add_argument('--output-dir', default=CALIBRATED)
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--force', action='store_true', help="recalibrate dates that are up to date")
+    parser.add_argument('--sparse', action='store_true', help="write sparse .sdat days (see sparse_daily.py)")
+    args = parser.parse_args()
+
+    if args.action == 'resolve':
+        slope, intercept, source, sources = resolve_coefficients(args.regression_dir, args.level, args.coefficient_levels,
+                                                                 args.regions, args.min_count, args.max_mse)
+        metadata = write_coefficients(args.coefficient_dir, args.level, slope, intercept, source, sources,
+                                      coefficient_levels=args.coefficient_levels, regions=args.regions,
+                                      min_count=args.min_count, max_mse=args.max_mse)
+        for name, pixels in metadata['pixels_per_source'].items():
+            print(f"{name:24s} {pixels} pixels")
+    else:
+        apply_calibration(args.spire_root, args.cygnss_root, args.product, args.coefficient_dir, args.output_dir,
+                          args.start, args.end, args.level, args.workers, args.force, args.sparse)
@@ -0,0 +1,190 @@
+import argparse, json, math, os
+from datetime import date as Date
+from functools import partial
+from pathlib import Path
+import numpy as np
+from manifest import atomic_write
+from gridding import FILL_VALUE, MISSION_GRIDS, PYRAMID_LEVELS, level_spec, file_pool, map_files
+from daily_binaries import open_daily, daily_paths, level_directory, rows_for_memory
+
+# Task: per-pixel temporal statistics of years of daily binaries without ever holding the time stack
+# every latitude band passes over the dates in order keeping O(band) running accumulators: Welford mean/M2, counts,
+# min and max, plus the sums and counts of each day-of-year bin for the climatology; bands are independent, so they
+# run in worker processes and write their rows straight into the memmapped outputs
+#
+#   python climatology.py CYGNSS reflectivity --years 2019 2020 2021 2022 2023 2024 --workers 8 --anomalies
+#
+# <output-dir>/climatology.json   shape, level, dates, bin_days and the files below
+# <output-dir>/mean.dat, std.dat, min.dat, max.dat (float32, -9999 where empty) and count.dat (int32)
+# <output-dir>/doy/<bin>.dat       mean of day-of-year bin <bin> (days bin * bin_days + 1 ..), -9999 where empty
+# <output-dir>/anomaly/<year>/<date>.dat  the day minus the climatology of its bin, -9999 where either is missing
+
+STATISTICS = ['mean', 'std', 'min', 'max']
+
+# rough bytes per pixel of a band: Welford moments, extrema, the day-of-year sums and counts and one day's values
+def band_bytes_per_pixel(n_bins, dtype):
+    itemsize = np.dtype(dtype).itemsize
+    return 2 * itemsize + 4 + 8 + n_bins * (itemsize + 4) + 16
+
+def doy_bin(date, bin_days):
+    # day 366 of leap years joins the last bin instead of making a bin of its own
+    return min(Date.fromisoformat(date).timetuple().tm_yday - 1, 364) // bin_days
+
+def n_doy_bins(bin_days):
+    return math.ceil(365 / bin_days)
+
+# {date: path} over the <input_dir>/<product>/<year> folders of the given years (or every year folder)
+def dated_inputs(input_dir, product, years=None, level='5km'):
+    product_dir = Path(input_dir) / product
+    years = years or sorted(folder.name for folder in product_dir.iterdir() if folder.is_dir())
+    paths = {}
+    for year in years:
+        paths.update(daily_paths(level_directory(product_dir / str(year), level)))
+    return dict(sorted(paths.items()))
+
+def output_path(output_dir, name):
+    return os.path.join(output_dir, f"{name}.dat")
+
+def anomaly_path(output_dir, date):
+    return os.path.join(output_dir, 'anomaly', date[:4], f"{date}.dat")
+
+# creates every output at full size so the bands can memmap them and fill in their rows
+def allocate(path, shape, dtype):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(shape[0] * shape[1] * np.dtype(dtype).itemsize)
+
+def write_rows(path, shape, dtype, rows, values):
+    grid = np.memmap(path, dtype=dtype, mode='r+', shape=shape)
+    grid[rows] = values
+    grid.flush()
+    del grid
+
+# one pass over the dates for rows [start, stop) of the grid, then (with anomalies) a second pass over the same rows
+# dtype is the accumulator precision of the mean, M2 and day-of-year sums; returns the number of pixel-days read
+def reduce_band(band, paths, shape, output_dir, bin_days=8, dtype=np.float64, anomalies=False):
+    start, stop = band
+    rows = slice(start, stop)
+    band_shape = (stop - start, shape[1])
+
+    count = np.zeros(band_shape, dtype=np.int32)
+    mean = np.zeros(band_shape, dtype=dtype)
+    m2 = np.zeros(band_shape, dtype=dtype)
+    low = np.full(band_shape, np.inf, dtype=np.float32)
+    high = np.full(band_shape, -np.inf, dtype=np.float32)
+    doy_sums = np.zeros((n_doy_bins(bin_days),) + band_shape, dtype=dtype)
+    doy_counts = np.zeros((n_doy_bins(bin_days),) + band_shape, dtype=np.int32)
+
+    for date, path in paths.items():
+        values = np.asarray(open_daily(path, shape)[rows])
+        valid = values != FILL_VALUE
+        x = values[valid].astype(dtype)
+
+        # Welford: the mean moves by delta / n and M2 grows by delta * (x - new mean)
+        count[valid] += 1
+        delta = x - mean[valid]
+        mean[valid] += delta / count[valid]
+        m2[valid] += delta * (x - mean[valid])
+        np.minimum(low, values, out=low, where=valid)
+        np.maximum(high, values, out=high, where=valid)
+
+        doy = doy_bin(date, bin_days)
+        doy_sums[doy][valid] += x
+        doy_counts[doy][valid] += 1
+
+    empty = count == 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(m2 / (count - 1))
+        climatology = np.where(doy_counts > 0, doy_sums / doy_counts, FILL_VALUE).astype(np.float32)
+
+    grids = {
+        'mean': np.where(empty, FILL_VALUE, mean),
+        'std': np.where(count > 1, std, FILL_VALUE),
+        'min': np.where(empty, FILL_VALUE, low),
+        'max': np.where(empty, FILL_VALUE, high),
+    }
+    for name, grid in grids.items():
+        write_rows(output_path(output_dir, name), shape, np.float32, rows, grid.astype(np.float32))
+    write_rows(output_path(output_dir, 'count'), shape, np.int32, rows, count)
+    for doy in range(n_doy_bins(bin_days)):
+        write_rows(output_path(output_dir, f"doy/{doy}"), shape, np.float32, rows, climatology[doy])
+
+    if anomalies:
+        for date, path in paths.items():
+            values = np.asarray(open_daily(path, shape)[rows])
+            reference = climatology[doy_bin(date, bin_days)]
+            anomaly = np.where((values != FILL_VALUE) & (reference != FILL_VALUE), values - reference, FILL_VALUE)
+            write_rows(anomaly_path(output_dir, date), shape, np.float32, rows, anomaly.astype(np.float32))
+
+    return int(count.sum())
+
+# band_rows defaults to the most rows whose accumulators fit in memory_limit bytes
+def build_climatology(mission, product, input_dir, output_dir, years=None, level='5km', bin_days=8, dtype=np.float64,
+                      anomalies=False, workers=1, band_rows=None, memory_limit=1 << 30):
+    spec = level_spec(MISSION_GRIDS[mission], level)
+    shape = (spec.n_rows, spec.n_cols)
+    paths = dated_inputs(input_dir, product, years, level)
+    if not paths:
+        raise ValueError(f"no daily binaries of {product} under {input_dir}")
+    print(f"Reducing {len(paths)} dates from {min(paths)} to {max(paths)} on a {shape[0]} x {shape[1]} grid")
+
+    band_rows = band_rows or rows_for_memory(1, shape[1], memory_limit, band_bytes_per_pixel(n_doy_bins(bin_days), dtype))
+    bands = [(start, min(start + band_rows, shape[0])) for start in range(0, shape[0], band_rows)]
+
+    outputs = {name: np.float32 for name in STATISTICS}
+    outputs['count'] = np.int32
+    outputs.update({f"doy/{doy}": np.float32 for doy in range(n_doy_bins(bin_days))})
+    for name, output_dtype in outputs.items():
+        allocate(output_path(output_dir, name), shape, output_dtype)
+    if anomalies:
+        for date in paths:
+            allocate(anomaly_path(output_dir, date), shape, np.float32)
+
+    reduce = partial(reduce_band, paths=paths, shape=shape, output_dir=output_dir, bin_days=bin_days, dtype=dtype,
+                     anomalies=anomalies)
+    pixel_days = 0
+    with file_pool(workers) as executor:
+        for (start, stop), (result, error) in map_files(reduce, bands, executor):
+            if error is not None:
+                raise RuntimeError(f"band of rows {start}-{stop} failed") from error
+            print(f"- Rows {start}-{stop} done")
+            pixel_days += result
+
+    metadata = {
+        'mission': mission, 'product': product, 'level': level, 'shape': list(shape), 'lat_min': spec.lat_min,
+        'resolution': spec.resolution, 'dates': list(paths), 'bin_days': bin_days, 'n_bins': n_doy_bins(bin_days),
+        'accumulator_dtype': np.dtype(dtype).name, 'pixel_days': pixel_days, 'fill_value': FILL_VALUE,
+        'outputs': {name: f"{name}.dat" for name in outputs}, 'anomalies': anomalies,
+    }
+    atomic_write(os.path.join(output_dir, 'climatology.json'), json.dumps(metadata, indent=1).encode())
+    return metadata
+
+# (metadata, {name: memmap}) of a climatology folder, for feature engineering
+def open_climatology(output_dir):
+    with open(os.path.join(output_dir, 'climatology.json'), 'r') as f:
+        metadata = json.load(f)
+    shape = tuple(metadata['shape'])
+    grids = {name: open_daily(os.path.join(output_dir, file), shape, np.int32 if name == 'count' else np.float32)
+             for name, file in metadata['outputs'].items()}
+    return metadata, grids
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mission', choices=MISSION_GRIDS.keys())
+    parser.add_argument('product', help="e.g. reflectivity or SNR")
+    parser.add_argument('--input-dir', default=None, help="defaults to /data01/lpu/<mission>")
+    parser.add_argument('--output-dir', default=None, help="defaults to /data01/lpu/climatology/<mission>_<product>")
+    parser.add_argument('--years', nargs='*', default=None, help="year folders to use (default all)")
+    parser.add_argument('--level', default='5km', choices=PYRAMID_LEVELS.keys(), help="pyramid level of the daily binaries")
+    parser.add_argument('--bin-days', type=int, default=8, help="days of year per climatology bin (8 = 46 bins)")
+    parser.add_argument('--dtype', default='float64', choices=['float32', 'float64'], help="accumulator precision")
+    parser.add_argument('--anomalies', action='store_true', help="also write every day minus its climatology")
+    parser.add_argument('--workers', type=int, default=1, help="processes reducing latitude bands in parallel")
+    parser.add_argument('--band-rows', type=int, default=None, help="rows per band (default from --memory-limit)")
+    parser.add_argument('--memory-limit', type=float, default=1024, help="MB of accumulators per band")
+    args = parser.parse_args()
+
+    build_climatology(args.mission, args.product, args.input_dir or f"/data01/lpu/{args.mission}",
+                      args.output_dir or f"/data01/lpu/climatology/{args.mission}_{args.product}", args.years,
+                      args.level, args.bin_days, np.dtype(args.dtype), args.anomalies, args.workers, args.band_rows,
+                      args.memory_limit * 2**20)
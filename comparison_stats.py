@@ -0,0 +1,206 @@
+import argparse, csv, os
+import numpy as np
+from gridding import FILL_VALUE, CYGNSS_GRID
+from daily_binaries import SPIRE_SHAPE, CYGNSS_SHAPE, SPIRE_CYGNSS_ROWS, pair_dates, open_daily
+
+# Task: SPIRE vs CYGNSS comparison statistics (bias, RMSD, Pearson r, counts) for every day of a date range and
+# every region, in one pass over row chunks of the daily binaries
+# each (day, region) keeps running means, sums of squares and the co-moment (Welford / Chan et al. updates), so
+# memory stays at one chunk of rows whatever the grid size, and days merge exactly into the period statistics
+
+SPIRE_BINARIES = '/data01/lpu/SPIRE/reflectivity/2024'
+CYGNSS_BINARIES = '/data01/lpu/CYGNSS/reflectivity/2024'
+LAND_MASK = '/data01/lpu/land_mask_CYGNSS.dat'
+
+# (latmin, latmax, lonmin, lonmax) boxes on the [0, 360) longitudes of the grids; land and ocean need a land mask
+REGIONS = {
+    'global': (-90, 90, 0, 360),
+    'australia': (-45, -10, 100, 160),
+    'north_america': (10, 45, 220, 300),
+    'tropics': (-23.5, 23.5, 0, 360),
+    'north_subtropics': (23.5, 45, 0, 360),
+    'south_subtropics': (-45, -23.5, 0, 360),
+    'land': 'land',
+    'ocean': 'ocean',
+}
+
+STAT_COLUMNS = ['date', 'region', 'count', 'bias', 'rmsd', 'r', 'mean_spire', 'mean_cygnss']
+
+# (n, mean_x, mean_y, m2_x, m2_y, c_xy) of two equally long value arrays, None if they are empty
+def sample_moments(x, y):
+    if x.size == 0:
+        return None
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    mean_x, mean_y = x.mean(), y.mean()
+    dx, dy = x - mean_x, y - mean_y
+    return x.size, mean_x, mean_y, np.dot(dx, dx), np.dot(dy, dy), np.dot(dx, dy)
+
+class Moments:
+    # x is SPIRE and y is CYGNSS, bias and RMSD are of x - y like the old calculate_statistics
+    def __init__(self):
+        self.n = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+
+    def add(self, x, y):
+        self.add_moments(sample_moments(x, y))
+
+    # the sample_moments of a chunk, e.g. computed in another process (None adds nothing)
+    def add_moments(self, moments):
+        if moments is not None:
+            self._combine(*moments)
+
+    def merge(self, other):
+        if other.n:
+            self._combine(other.n, other.mean_x, other.mean_y, other.m2_x, other.m2_y, other.c_xy)
+
+    # pairwise update of the means and (co-)moments of two disjoint sets of samples
+    def _combine(self, n, mean_x, mean_y, m2_x, m2_y, c_xy):
+        total = self.n + n
+        delta_x, delta_y = mean_x - self.mean_x, mean_y - self.mean_y
+        weight = self.n * n / total
+
+        self.m2_x += m2_x + delta_x * delta_x * weight
+        self.m2_y += m2_y + delta_y * delta_y * weight
+        self.c_xy += c_xy + delta_x * delta_y * weight
+        self.mean_x += delta_x * n / total
+        self.mean_y += delta_y * n / total
+        self.n = total
+
+    def stats(self):
+        if self.n == 0:
+            return {'count': 0, 'bias': np.nan, 'rmsd': np.nan, 'r': np.nan, 'mean_spire': np.nan, 'mean_cygnss': np.nan}
+
+        bias = self.mean_x - self.mean_y
+        # mean((x - y)^2) = var(x - y) + bias^2, with var(x - y) from the two variances and the co-moment
+        msd = max((self.m2_x + self.m2_y - 2 * self.c_xy) / self.n, 0.0) + bias * bias
+        denominator = np.sqrt(self.m2_x * self.m2_y)
+        r = self.c_xy / denominator if denominator > 0 else np.nan
+
+        return {'count': self.n, 'bias': bias, 'rmsd': np.sqrt(msd), 'r': r,
+                'mean_spire': self.mean_x, 'mean_cygnss': self.mean_y}
+
+# lat of every row and lon of every column (cell centers) of a grid over the CYGNSS latitudes, at any resolution
+def grid_coordinates(shape=CYGNSS_SHAPE, lat_min=CYGNSS_GRID.lat_min):
+    resolution = 360 / shape[1]
+    lat = lat_min + (np.arange(shape[0]) + 0.5) * resolution
+    lon = (np.arange(shape[1]) + 0.5) * resolution
+    return lat, lon
+
+# uint8 land (1) / ocean (0) mask on the CYGNSS grid from Basemap's land-sea mask, built in row chunks once and
+# kept next to the binaries so later runs only memmap it
+def land_mask(path=LAND_MASK, chunk_rows=100):
+    if not os.path.exists(path):
+        from mpl_toolkits.basemap import maskoceans
+        from manifest import atomic_tofile
+
+        lat, lon = grid_coordinates()
+        mask = np.zeros(CYGNSS_SHAPE, dtype=np.uint8)
+        lon_180 = np.where(lon > 180, lon - 360, lon)
+        for start in range(0, CYGNSS_SHAPE[0], chunk_rows):
+            rows = slice(start, start + chunk_rows)
+            lon_grid, lat_grid = np.meshgrid(lon_180, lat[rows])
+            masked = maskoceans(lon_grid, lat_grid, np.ones(lon_grid.shape), inlands=False, resolution='l', grid=5)
+            mask[rows] = ~np.ma.getmaskarray(masked)
+        atomic_tofile(mask, path)
+
+    return open_daily(path, CYGNSS_SHAPE, dtype=np.uint8)
+
+# which cells of a chunk (rows of lat, all of lon) belong to a region
+def region_mask(region, lat, lon, land=None):
+    if region in ('land', 'ocean'):
+        return land.astype(bool) if region == 'land' else ~land.astype(bool)
+
+    latmin, latmax, lonmin, lonmax = region
+    return ((lat >= latmin) & (lat <= latmax))[:, None] & ((lon >= lonmin) & (lon <= lonmax))[None, :]
+
+# folds one pair of (rows, cols) grids into {region name: Moments}, chunk_rows rows at a time
+# diff_grid, if given, receives |x - y| on valid cells (-9999 elsewhere) while the chunks go by
+def accumulate(x_grid, y_grid, regions, moments=None, chunk_rows=64, land=None, diff_grid=None):
+    moments = moments if moments is not None else {name: Moments() for name in regions}
+    lat, lon = grid_coordinates(x_grid.shape)
+
+    for start in range(0, x_grid.shape[0], chunk_rows):
+        rows = slice(start, min(start + chunk_rows, x_grid.shape[0]))
+        x = np.asarray(x_grid[rows])
+        y = np.asarray(y_grid[rows])
+        valid = (x != FILL_VALUE) & (y != FILL_VALUE)
+
+        if diff_grid is not None:
+            diff_grid[rows] = np.where(valid, np.abs(x - y), FILL_VALUE)
+
+        for name, region in regions.items():
+            mask = valid & region_mask(region, lat[rows], lon, None if land is None else land[rows])
+            moments[name].add(x[mask], y[mask])
+
+    return moments
+
+def date_moments(date, spire_path, cygnss_path, regions, chunk_rows=64, land=None):
+    print(f"Comparing date {date}")
+    spire = open_daily(spire_path, SPIRE_SHAPE)[SPIRE_CYGNSS_ROWS]
+    cygnss = open_daily(cygnss_path, CYGNSS_SHAPE)
+    return accumulate(spire, cygnss, regions, chunk_rows=chunk_rows, land=land)
+
+# one row per (date, region) plus the merged 'all' rows of the whole period
+# backend='dask' spreads the (date, row chunk) pieces over a local dask scheduler (see dask_backend.py), same numbers
+def daily_statistics(spire_dir, cygnss_dir, start=None, end=None, regions=REGIONS, chunk_rows=64, land=None,
+                     backend='numpy', scheduler='threads', workers=None):
+    dates, pairs, missing_spire, missing_cygnss = pair_dates(spire_dir, cygnss_dir, start, end)
+    if missing_spire or missing_cygnss:
+        print(f"Skipping {len(missing_spire) + len(missing_cygnss)} dates missing from one of the missions")
+
+    if backend == 'dask':
+        from dask_backend import daily_statistics as dask_daily_statistics
+        per_date = dask_daily_statistics(dates, pairs, regions, chunk_rows, land, scheduler, workers)
+    else:
+        per_date = (date_moments(date, spire_path, cygnss_path, regions, chunk_rows, land)
+                    for date, (spire_path, cygnss_path) in zip(dates, pairs))
+
+    totals = {name: Moments() for name in regions}
+    table = []
+    for date, moments in zip(dates, per_date):
+        for name in regions:
+            table.append({'date': date, 'region': name, **moments[name].stats()})
+            totals[name].merge(moments[name])
+
+    for name in regions:
+        table.append({'date': 'all', 'region': name, **totals[name].stats()})
+    return table
+
+# .parquet goes through pandas (needs pyarrow or fastparquet), anything else is written as CSV
+def write_table(table, path):
+    if str(path).endswith('.parquet'):
+        import pandas as pd
+        pd.DataFrame(table, columns=STAT_COLUMNS).to_parquet(path, index=False)
+        return
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=STAT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(table)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spire-dir', default=SPIRE_BINARIES)
+    parser.add_argument('--cygnss-dir', default=CYGNSS_BINARIES)
+    parser.add_argument('--start', default='2024-01-25')
+    parser.add_argument('--end', default='2024-06-02')
+    parser.add_argument('--regions', nargs='+', default=list(REGIONS), choices=REGIONS.keys())
+    parser.add_argument('--land-mask', default=LAND_MASK, help="built from Basemap's land-sea mask if missing")
+    parser.add_argument('--chunk-rows', type=int, default=64)
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'dask'], help="dask runs the chunks in parallel")
+    parser.add_argument('--scheduler', default='threads', choices=['threads', 'processes'], help="dask scheduler")
+    parser.add_argument('--workers', type=int, default=None, help="dask workers (default every core)")
+    parser.add_argument('--output', default='/data01/lpu/comparison_stats.csv', help=".csv or .parquet")
+    args = parser.parse_args()
+
+    regions = {name: REGIONS[name] for name in args.regions}
+    land = land_mask(args.land_mask) if {'land', 'ocean'} & set(regions) else None
+
+    table = daily_statistics(args.spire_dir, args.cygnss_dir, args.start, args.end, regions, args.chunk_rows, land,
+                             args.backend, args.scheduler, args.workers)
+    write_table(table, args.output)
@@ -0,0 +1,103 @@
+import argparse, os
+from datetime import datetime, timedelta
+from collections import deque
+from gridding import MISSION_GRIDS, PYRAMID_LEVELS, GridAccumulator, level_spec
+from daily_binaries import daily_path, find_daily, open_daily_with_count, level_product
+from sparse_daily import SparseGrid
+from manifest import atomic_tofile
+from grid_io import PRODUCT_UNITS, write_grid
+
+# Task: build multi-date composites (mean grids) from the daily binaries of make_binaries_*.py instead of
+# re-reading every raw granule like make_grid.py / make_grid_CYGNSS.py
+# each day is weighted by its per-cell counts, so the composite is the exact mean of the readings and not a mean of means
+
+def date_range(start, end):
+    day = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d")
+    while day <= last:
+        yield day.strftime("%Y-%m-%d")
+        day += timedelta(days=1)
+
+def has_day(data_dir, product, date):
+    return find_daily(data_dir, product, date) is not None
+
+# sparse days are added straight from their filled cells, dense ones through their mean and count grids
+def add_day(composite, data_dir, product, date, shape, sign=1):
+    mean, count = open_daily_with_count(data_dir, product, date, shape)
+    if isinstance(mean, SparseGrid):
+        composite.add(count.to_partial(), sign)
+    else:
+        composite.add_grid(mean, count, sign)
+
+# streams one day at a time into a GridAccumulator, dates without a binary are skipped
+# level reads the daily binaries of that pyramid level (e.g. 25km), which are exact aggregates of the 5km days
+def build_composite(data_dir, product, mission, start, end, level='5km'):
+    spec = level_spec(MISSION_GRIDS[mission], level)
+    product = level_product(product, level)
+    composite = GridAccumulator(spec)
+
+    for date in date_range(start, end):
+        if not has_day(data_dir, product, date):
+            continue
+        print(f"Adding date {date}")
+        add_day(composite, data_dir, product, date, (spec.n_rows, spec.n_cols))
+
+    return composite.mean()
+
+# yields (end date, composite mean) of a moving window of `window` days, e.g. a 7-day moving composite
+# every step adds the new day and subtracts the day that drops out instead of re-summing the window
+def rolling_composites(data_dir, product, mission, start, end, window, level='5km'):
+    spec = level_spec(MISSION_GRIDS[mission], level)
+    product = level_product(product, level)
+    shape = (spec.n_rows, spec.n_cols)
+    composite = GridAccumulator(spec)
+    in_window = deque()
+
+    first = (datetime.strptime(start, "%Y-%m-%d") - timedelta(days=window - 1)).strftime("%Y-%m-%d")
+    for date in date_range(first, end):
+        if has_day(data_dir, product, date):
+            add_day(composite, data_dir, product, date, shape)
+        in_window.append(date)
+
+        if len(in_window) > window:
+            dropped = in_window.popleft()
+            if has_day(data_dir, product, dropped):
+                add_day(composite, data_dir, product, dropped, shape, sign=-1)
+
+        if date >= start:
+            yield date, composite.mean()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mission', choices=MISSION_GRIDS.keys())
+    parser.add_argument('product', help="daily binary product, e.g. SNR or reflectivity")
+    parser.add_argument('--start', default='2024-01-25')
+    parser.add_argument('--end', default='2024-06-02')
+    parser.add_argument('--data-dir', default=None, help="defaults to /data01/lpu/<mission>")
+    parser.add_argument('--window', type=int, default=None, help="write a moving composite of this many days per date")
+    parser.add_argument('--level', default='5km', choices=PYRAMID_LEVELS.keys(), help="pyramid level of the daily binaries")
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'dask'],
+                        help="dask averages latitude bands in parallel (single composites only)")
+    parser.add_argument('--scheduler', default='threads', choices=['threads', 'processes'], help="dask scheduler")
+    parser.add_argument('--workers', type=int, default=None, help="dask workers (default every core)")
+    parser.add_argument('--memory-limit', type=float, default=1024, help="MB of daily binaries the dask workers hold")
+    parser.add_argument('--output', required=True, help="grid (.npy, see grid_io.py) for a single composite, folder for --window")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or f"/data01/lpu/{args.mission}"
+
+    if args.window is None:
+        if args.backend == 'dask':
+            from dask_backend import build_composite as dask_build_composite
+            grid = dask_build_composite(data_dir, args.product, args.mission, args.start, args.end, args.level,
+                                        args.scheduler, args.workers, args.memory_limit * 2**20)
+        else:
+            grid = build_composite(data_dir, args.product, args.mission, args.start, args.end, args.level)
+        write_grid(args.output, grid, PRODUCT_UNITS.get(args.product.lower()), lat_min=MISSION_GRIDS[args.mission].lat_min,
+                   provenance={'mission': args.mission, 'product': args.product, 'data_dir': data_dir,
+                               'start': args.start, 'end': args.end, 'level': args.level})
+    else:
+        rolling = rolling_composites(data_dir, args.product, args.mission, args.start, args.end, args.window, args.level)
+        for date, grid in rolling:
+            print(f"Writing {args.window}-day composite ending {date}")
+            atomic_tofile(grid, daily_path(args.output, level_product(args.product, args.level), date))
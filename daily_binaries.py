@@ -0,0 +1,163 @@
+from pathlib import Path
+import os
+import numpy as np
+from manifest import atomic_tofile
+from gridding import PYRAMID_LEVELS
+from sparse_daily import SparseGrid, write_sparse
+
+# Task: open the daily .dat binaries written by make_binaries_*.py without reading them into memory
+# every day is np.memmap'ed, so slicing (e.g. SPIRE rows 900:2700 to match CYGNSS) is a view and not a copy
+
+SPIRE_SHAPE = (3600, 7200)
+CYGNSS_SHAPE = (1800, 7200)
+
+# rows of the SPIRE grid ([-90, 90]) that cover the CYGNSS latitudes ([-45, 45])
+SPIRE_CYGNSS_ROWS = slice(900, 2700)
+
+# shape and SPIRE/CYGNSS overlap rows of a pyramid level (see gridding.PYRAMID_LEVELS)
+def level_shape(shape, level):
+    factor = PYRAMID_LEVELS[level]
+    return (shape[0] // factor, shape[1] // factor)
+
+def level_rows(rows, level):
+    factor = PYRAMID_LEVELS[level]
+    return slice(rows.start // factor, rows.stop // factor)
+
+# sparse .sdat days (see sparse_daily.py) open as a lazy SparseGrid that slices like the dense memmap
+def open_daily(path, shape, dtype=np.float32):
+    if str(path).endswith('.sdat'):
+        return SparseGrid(path, 'counts' if np.dtype(dtype).kind == 'i' else 'means')
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+# daily binaries live in <output_dir>/<product>/<year>/<date>.dat, e.g. /data01/lpu/CYGNSS/SNR/2024/2024-02-01.dat
+# the int32 number of readings behind each mean is stored under <product>_count with the same layout
+# sparse days are <date>.sdat and hold the sums, counts and means of the filled cells in the one file
+def daily_path(output_dir, product, date, sparse=False):
+    return f"{output_dir}/{product}/{date[:4]}/{date}.{'sdat' if sparse else 'dat'}"
+
+# the dense or sparse binary of a date, None if there is neither
+# write_daily removes the other format, so both only exist when a day was written before that and the sparse one wins
+def find_daily(output_dir, product, date):
+    paths = [path for path in (daily_path(output_dir, product, date, sparse) for sparse in (True, False))
+             if os.path.exists(path)]
+    if len(paths) == 2:
+        print(f"- {product} {date} has both a sparse and a dense binary, using {paths[0]}")
+    return paths[0] if paths else None
+
+def count_product(product):
+    return f"{product}_count"
+
+# coarser pyramid levels are stored as their own products, e.g. /data01/lpu/CYGNSS/SNR_25km/2024/2024-02-01.dat
+# and SNR_25km_count, the 5km base keeps the plain product name
+def level_product(product, level):
+    return product if PYRAMID_LEVELS[level] == 1 else f"{product}_{level}"
+
+# the same <root>/<product>/<year> folder at another level, e.g. /data01/lpu/SPIRE/reflectivity_1deg/2024
+def level_directory(year_dir, level):
+    year_dir = Path(year_dir)
+    return year_dir.parent.parent / level_product(year_dir.parent.name, level) / year_dir.name
+
+# the files of a day in the other format than the one being written, which would otherwise go stale next to it
+def other_format_paths(output_dir, product, date, sparse):
+    if sparse:
+        return [daily_path(output_dir, product, date), daily_path(output_dir, count_product(product), date)]
+    return [daily_path(output_dir, product, date, sparse=True)]
+
+# writes the float32 daily mean and the int32 counts of an accumulator, returns the entries for Manifest.record
+# a day written before in the other format loses those files
+def write_daily(accumulator, output_dir, product, date, sparse=False):
+    if sparse:
+        path = daily_path(output_dir, product, date, sparse=True)
+        outputs = {product: (path, write_sparse(accumulator, path))}
+    else:
+        mean_path = daily_path(output_dir, product, date)
+        count_path = daily_path(output_dir, count_product(product), date)
+        outputs = {
+            product: (mean_path, atomic_tofile(accumulator.mean(), mean_path)),
+            count_product(product): (count_path, atomic_tofile(accumulator.count, count_path)),
+        }
+
+    for path in other_format_paths(output_dir, product, date, sparse):
+        if os.path.exists(path):
+            os.unlink(path)
+    return outputs
+
+# writes the base grid and every requested pyramid level of the accumulator, all from the same sums and counts
+# levels of the date left from an earlier run that are not requested now are removed, so they can't go stale
+def write_pyramid(accumulator, output_dir, product, date, levels=(), sparse=False):
+    levels = [level for level in levels if PYRAMID_LEVELS[level] > 1]
+    outputs = write_daily(accumulator, output_dir, product, date, sparse)
+    for level, coarse in accumulator.pyramid(levels).items():
+        outputs.update(write_daily(coarse, output_dir, level_product(product, level), date, sparse))
+
+    for level in PYRAMID_LEVELS:
+        if PYRAMID_LEVELS[level] > 1 and level not in levels:
+            name = level_product(product, level)
+            stale = [daily_path(output_dir, name, date), daily_path(output_dir, count_product(name), date),
+                     daily_path(output_dir, name, date, sparse=True)]
+            for path in stale:
+                if os.path.exists(path):
+                    os.unlink(path)
+    return outputs
+
+# (mean, count) memmaps of one day, falling back to one reading per filled cell for old days without counts
+def open_daily_with_count(output_dir, product, date, shape):
+    path = find_daily(output_dir, product, date)
+    if path.endswith('.sdat'):
+        return SparseGrid(path, 'means'), SparseGrid(path, 'counts')
+
+    mean = open_daily(path, shape)
+    count_path = daily_path(output_dir, count_product(product), date)
+
+    if os.path.exists(count_path):
+        count = open_daily(count_path, shape, dtype=np.int32)
+    else:
+        print(f"- No counts for {product} {date}, weighting its filled cells equally")
+        count = (mean != -9999).astype(np.int32)
+
+    return mean, count
+
+# maps YYYY-MM-DD to the binary of that date, optionally only within [start, end]
+# a date with both a sparse and a dense binary uses the sparse one, it is the smaller read
+def daily_paths(directory, start=None, end=None):
+    paths = {}
+    for file in sorted(Path(directory).glob('*.dat')) + sorted(Path(directory).glob('*.sdat')):
+        date = file.stem
+        if (start is None or date >= start) and (end is None or date <= end):
+            paths[date] = file
+    # in date order even when a folder mixes dense and sparse days
+    return dict(sorted(paths.items()))
+
+# pairs the two missions by date name instead of iterdir() order
+# returns the dates present on both sides and the dates missing from either one
+def pair_dates(spire_dir, cygnss_dir, start=None, end=None):
+    spire_paths = daily_paths(spire_dir, start, end)
+    cygnss_paths = daily_paths(cygnss_dir, start, end)
+
+    dates = sorted(spire_paths.keys() & cygnss_paths.keys())
+    missing_cygnss = sorted(spire_paths.keys() - cygnss_paths.keys())
+    missing_spire = sorted(cygnss_paths.keys() - spire_paths.keys())
+
+    pairs = [(spire_paths[date], cygnss_paths[date]) for date in dates]
+    return dates, pairs, missing_spire, missing_cygnss
+
+# one memmap view per date, cropped to `rows` if given
+def open_stack(paths, shape, rows=None):
+    stack = [open_daily(path, shape) for path in paths]
+    if rows is not None:
+        stack = [grid[rows] for grid in stack]
+    return stack
+
+# number of latitude rows per tile so that a (dates, rows, cols) tile costs at most max_bytes
+# bytes_per_value covers the stacked float32 tiles plus whatever temporaries the consumer makes per value
+def rows_for_memory(n_dates, n_cols, max_bytes, bytes_per_value):
+    return max(1, int(max_bytes // (n_dates * n_cols * bytes_per_value)))
+
+# yields (row slice, [tile of each stack]) with tiles of shape (dates, rows, cols)
+# a stack is either a list of per-date 2D grids (e.g. open_stack) or a (dates, lat, lon) array
+def iter_tiles(stacks, tile_rows):
+    n_rows = stacks[0][0].shape[0]
+
+    for start in range(0, n_rows, tile_rows):
+        rows = slice(start, min(start + tile_rows, n_rows))
+        yield rows, [np.stack([grid[rows] for grid in stack]) for stack in stacks]
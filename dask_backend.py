@@ -0,0 +1,194 @@
+import os
+from functools import partial
+import numpy as np
+import dask
+import dask.array as da
+from tqdm import tqdm
+from dask.diagnostics import ProgressBar
+from gridding import FILL_VALUE, MISSION_GRIDS, level_spec
+from daily_binaries import SPIRE_SHAPE, CYGNSS_SHAPE, SPIRE_CYGNSS_ROWS, open_daily, open_daily_with_count, \
+    level_shape, level_rows, level_product, rows_for_memory
+from sparse_daily import SparseGrid
+from comparison_stats import Moments, grid_coordinates, region_mask, sample_moments
+
+# Task: multi-core, out-of-core composites, comparison statistics and per-pixel regression on the daily binaries
+# the stacks of daily binaries become (dates, rows, cols) dask arrays whose blocks are latitude bands of every date,
+# read straight from the .dat/.sdat files when a task needs them; the local threaded or process scheduler runs the
+# bands in parallel and the band height comes from the memory limit, so only workers x one band is ever in memory
+# every band runs the same numpy code, in the same order, as the single-threaded path, so the results are identical
+# the entry points opt in with --backend dask (needs `pip install dask`):
+#
+#   python composite.py CYGNSS reflectivity --output /data01/lpu/cygnss_reflectivity_grid.npy --backend dask --workers 16
+#   python comparison_stats.py --backend dask --workers 16
+#   python regression_SPIRE_CYGNSS.py --backend dask --workers 16 --memory-limit 16384
+
+# rough bytes per (date, pixel) of a band: composites hold the float64 sums and int32 counts of every date
+COMPOSITE_BYTES_PER_VALUE = 16
+
+class LazyStack:
+    # a (dates, rows, cols) array over per-date grids that da.from_array cuts into blocks, a block only reads its
+    # rows of its dates; read(item, start, stop) returns rows [start, stop) of one date
+    def __init__(self, items, read, shape, dtype):
+        self.items = list(items)
+        self.read = read
+        self.shape = (len(self.items),) + tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.ndim = 3
+
+    def __getitem__(self, key):
+        dates, rows, cols = key
+        start, stop, _ = rows.indices(self.shape[1])
+        block = np.empty((len(self.items[dates]), stop - start, self.shape[2]), dtype=self.dtype)
+        for i, item in enumerate(self.items[dates]):
+            block[i] = self.read(item, start, stop)
+        return block[:, :, cols]
+
+    # the same files give the same task names, so dask can share blocks between graphs
+    def __dask_tokenize__(self):
+        return (self.items, self.read, self.shape, self.dtype.str)
+
+def stack(items, read, shape, dtype, band_rows, dates_per_block=None):
+    lazy = LazyStack(items, read, shape, dtype)
+    chunks = (dates_per_block or max(len(lazy.items), 1), band_rows, -1)
+    return da.from_array(lazy, chunks=chunks, meta=np.empty((0, 0, 0), dtype=lazy.dtype))
+
+def n_workers(workers):
+    return workers or os.cpu_count()
+
+# rows per band so that the bands of all workers together stay within memory_limit bytes
+def band_rows(n_dates, n_cols, memory_limit, workers, bytes_per_value):
+    return rows_for_memory(max(n_dates, 1), n_cols, memory_limit / n_workers(workers), bytes_per_value)
+
+# threads share the memmaps and numpy releases the GIL, processes also parallelize the python in between
+def compute(*collections, scheduler='threads', workers=None):
+    with ProgressBar():
+        return dask.compute(*collections, scheduler=scheduler, num_workers=n_workers(workers))
+
+# rows [start, stop) of a daily binary, offset skips rows first (SPIRE cropped to the CYGNSS latitudes)
+def read_rows(path, start, stop, shape, offset=0):
+    return np.asarray(open_daily(path, shape)[offset + start:offset + stop])
+
+# rows [start, stop) of a day as GridAccumulator adds them: the float64 sums (mean x count of a dense day, the stored
+# sums of a sparse one, 0 where empty) or the int32 counts
+def read_day(day, start, stop, shape, field):
+    data_dir, product, date = day
+    mean, count = open_daily_with_count(data_dir, product, date, shape)
+    count = np.asarray(count[start:stop])
+    if field == 'counts':
+        return count
+
+    if isinstance(mean, SparseGrid):
+        return np.asarray(SparseGrid(mean.path, 'sums')[start:stop], dtype=np.float64)
+    mean = np.asarray(mean[start:stop])
+    sums = np.zeros(mean.shape, dtype=np.float64)
+    filled = count > 0
+    sums[filled] = mean[filled].astype(np.float64) * count[filled]
+    return sums
+
+# one band of the composite: the days are added in date order like GridAccumulator.add_grid, then averaged like
+# GridAccumulator.mean
+def composite_band(sums, counts):
+    total = np.zeros(sums.shape[1:], dtype=np.float64)
+    count = np.zeros(sums.shape[1:], dtype=np.int32)
+    for day_sums, day_counts in zip(sums, counts):
+        filled = day_counts > 0
+        total[filled] += day_sums[filled]
+        count += day_counts
+
+    mask = count > 0
+    grid = np.full(total.shape, FILL_VALUE, dtype=np.float64)
+    grid[mask] = total[mask] / count[mask]
+    return grid.astype(np.float32)
+
+# composite.build_composite on dask, memory_limit is in bytes
+def build_composite(data_dir, product, mission, start, end, level='5km', scheduler='threads', workers=None,
+                    memory_limit=2**30):
+    from composite import date_range, has_day
+
+    spec = level_spec(MISSION_GRIDS[mission], level)
+    product = level_product(product, level)
+    shape = (spec.n_rows, spec.n_cols)
+
+    days = [(data_dir, product, date) for date in date_range(start, end) if has_day(data_dir, product, date)]
+    if not days:
+        return np.full(shape, FILL_VALUE, dtype=np.float32)
+    print(f"Adding {len(days)} dates from {days[0][2]} to {days[-1][2]}")
+
+    rows = band_rows(len(days), shape[1], memory_limit, workers, COMPOSITE_BYTES_PER_VALUE)
+    sums = stack(days, partial(read_day, shape=shape, field='sums'), shape, np.float64, rows)
+    counts = stack(days, partial(read_day, shape=shape, field='counts'), shape, np.int32, rows)
+    mean = da.map_blocks(composite_band, sums, counts, drop_axis=0, dtype=np.float32)
+    return compute(mean, scheduler=scheduler, workers=workers)[0]
+
+# {region: sample_moments} of one band of one date, like one chunk of comparison_stats.accumulate
+def band_moments(x, y, start, regions, land=None):
+    x, y = x[0], y[0]
+    lat, lon = grid_coordinates(CYGNSS_SHAPE)
+    valid = (x != FILL_VALUE) & (y != FILL_VALUE)
+
+    moments = {}
+    for name, region in regions.items():
+        mask = valid & region_mask(region, lat[start:start + x.shape[0]], lon, land)
+        moments[name] = sample_moments(x[mask], y[mask])
+    return moments
+
+# comparison_stats.daily_statistics on dask: every (date, band of chunk_rows rows) is a task, and the parent folds
+# their moments in date and row order, which is the order accumulate adds them in
+def daily_statistics(dates, pairs, regions, chunk_rows=64, land=None, scheduler='threads', workers=None):
+    read_spire = partial(read_rows, shape=SPIRE_SHAPE, offset=SPIRE_CYGNSS_ROWS.start)
+    spire = stack([spire for spire, _ in pairs], read_spire, CYGNSS_SHAPE, np.float32, chunk_rows, 1).to_delayed()
+    cygnss = stack([cygnss for _, cygnss in pairs], partial(read_rows, shape=CYGNSS_SHAPE), CYGNSS_SHAPE, np.float32,
+                   chunk_rows, 1).to_delayed()
+    land = None if land is None else da.from_array(land, chunks=(chunk_rows, -1)).to_delayed()
+
+    starts = range(0, CYGNSS_SHAPE[0], chunk_rows)
+    tasks = [[dask.delayed(band_moments)(spire[d, b, 0], cygnss[d, b, 0], start, regions,
+                                         None if land is None else land[b, 0])
+              for b, start in enumerate(starts)] for d in range(len(dates))]
+    results = compute(tasks, scheduler=scheduler, workers=workers)[0]
+
+    per_date = []
+    for bands in results:
+        moments = {name: Moments() for name in regions}
+        for band in bands:
+            for name in regions:
+                moments[name].add_moments(band[name])
+        per_date.append(moments)
+    return per_date
+
+# fit_tile of one band, the grids stacked as float64 (exact for the float32 and int32 grids) in `names` order
+def fit_band(spire, cygnss, train_table, test_table, names):
+    from regression_SPIRE_CYGNSS import fit_tile
+
+    grids = fit_tile(spire, cygnss, train_table, test_table)
+    return np.stack([grids[name].astype(np.float64) for name in names])
+
+# regression_SPIRE_CYGNSS.fit_stack on dask from the (SPIRE, CYGNSS) paths of paired_paths
+# the bands are computed a few per worker at a time and copied into the output grids here, in the parent, as worker
+# processes can't write into the parent's arrays (da.store would fill copies of them)
+def fit_stack(pairs, level='5km', scheduler='threads', workers=None, memory_limit=2**32):
+    from regression_SPIRE_CYGNSS import REGRESSION_GRIDS, FIT_BYTES_PER_VALUE, holdout_tables
+
+    shape = level_shape(CYGNSS_SHAPE, level)
+    rows = band_rows(len(pairs), shape[1], memory_limit, workers, FIT_BYTES_PER_VALUE)
+    read_spire = partial(read_rows, shape=level_shape(SPIRE_SHAPE, level), offset=level_rows(SPIRE_CYGNSS_ROWS, level).start)
+    spire = stack([spire for spire, _ in pairs], read_spire, shape, np.float32, rows)
+    cygnss = stack([cygnss for _, cygnss in pairs], partial(read_rows, shape=shape), shape, np.float32, rows)
+
+    names = REGRESSION_GRIDS + ['count']
+    train_table, test_table = holdout_tables(len(pairs))
+    fitted = da.map_blocks(fit_band, spire, cygnss, train_table=train_table, test_table=test_table, names=names,
+                           chunks=((len(names),),) + spire.chunks[1:], dtype=np.float64)
+
+    grids = {name: np.full(shape, -9999, dtype=np.float32) for name in REGRESSION_GRIDS}
+    grids['count'] = np.zeros(shape, dtype=np.int32)
+
+    bands = fitted.to_delayed().ravel()
+    starts = np.cumsum((0,) + spire.chunks[1])
+    batch = 2 * n_workers(workers)
+    for first in tqdm(range(0, len(bands), batch), desc="Fitting bands"):
+        results = dask.compute(*bands[first:first + batch], scheduler=scheduler, num_workers=n_workers(workers))
+        for b, result in enumerate(results, first):
+            for i, name in enumerate(names):
+                grids[name][starts[b]:starts[b + 1]] = result[i]
+    return grids
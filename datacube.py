@@ -0,0 +1,93 @@
+import argparse
+import numpy as np
+import h5py
+from gridding import FILL_VALUE, MISSION_GRIDS
+from daily_binaries import daily_paths, open_stack
+
+# Task: pack the loose daily .dat binaries into one compressed, chunked (time, lat, lon) HDF5 cube
+# a pixel time series or a regional box then only touches the few chunks that cover it instead of every file
+
+def export_cube(directory, cube_path, mission, start=None, end=None, chunks=(32, 64, 64), units=''):
+    spec = MISSION_GRIDS[mission]
+    shape = (spec.n_rows, spec.n_cols)
+    paths = daily_paths(directory, start, end)
+    dates = list(paths.keys())
+    chunks = (max(1, min(chunks[0], len(dates))),) + tuple(chunks[1:])
+    chunk_time, chunk_rows, _ = chunks
+
+    with h5py.File(cube_path, 'w') as f:
+        data = f.create_dataset('data', shape=(len(dates),) + shape, dtype=np.float32, chunks=chunks,
+                                compression='gzip', compression_opts=4, shuffle=True, fillvalue=FILL_VALUE)
+        data.attrs['_FillValue'] = np.float32(FILL_VALUE)
+        data.attrs['units'] = units
+        data.attrs['mission'] = mission
+
+        f.create_dataset('time', data=np.array(dates, dtype='S10'))
+        # cell centres
+        f.create_dataset('lat', data=(spec.lat_min + (np.arange(shape[0]) + 0.5) * spec.resolution).astype(np.float32))
+        f.create_dataset('lon', data=((np.arange(shape[1]) + 0.5) * spec.resolution).astype(np.float32))
+        f.attrs['resolution'] = spec.resolution
+        f.attrs['lat_min'] = spec.lat_min
+        f.attrs['source'] = str(directory)
+
+        # writes whole chunks at a time (chunk_time days x a band of rows) so HDF5 never re-reads a partial chunk
+        for t0 in range(0, len(dates), chunk_time):
+            t1 = min(t0 + chunk_time, len(dates))
+            stack = open_stack([paths[date] for date in dates[t0:t1]], shape)
+            print(f"Packing {dates[t0]} - {dates[t1 - 1]}")
+
+            for r0 in range(0, shape[0], chunk_rows * 8):
+                r1 = min(r0 + chunk_rows * 8, shape[0])
+                data[t0:t1, r0:r1] = np.stack([grid[r0:r1] for grid in stack])
+
+class DataCube:
+    def __init__(self, cube_path, cache_bytes=64 * 2**20):
+        self.file = h5py.File(cube_path, 'r', rdcc_nbytes=cache_bytes)
+        self.data = self.file['data']
+        self.dates = [date.decode() for date in self.file['time'][:]]
+        self.lat_min = self.file.attrs['lat_min']
+        self.resolution = self.file.attrs['resolution']
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _row(self, lat):
+        return int(np.clip((lat - self.lat_min) / self.resolution, 0, self.data.shape[1] - 1))
+
+    def _col(self, lon):
+        return int(np.clip((lon % 360) / self.resolution, 0, self.data.shape[2] - 1))
+
+    def _times(self, start, end):
+        t0 = next((i for i, date in enumerate(self.dates) if start is None or date >= start), len(self.dates))
+        t1 = next((i for i, date in enumerate(self.dates) if end is not None and date > end), len(self.dates))
+        return slice(t0, t1)
+
+    # (dates, values) of the pixel containing (lat, lon), lon in [0, 360)
+    def pixel_series(self, lat, lon, start=None, end=None):
+        times = self._times(start, end)
+        return self.dates[times], self.data[times, self._row(lat), self._col(lon)]
+
+    # (dates, lat, lon) block of a bounding box, e.g. Australia is region(-45, -10, 100, 160)
+    def region(self, latmin, latmax, lonmin, lonmax, start=None, end=None):
+        times = self._times(start, end)
+        rows = slice(self._row(latmin), self._row(latmax) + 1)
+        cols = slice(self._col(lonmin), self._col(lonmax) + 1)
+        return self.dates[times], self.data[times, rows, cols]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mission', choices=MISSION_GRIDS.keys())
+    parser.add_argument('directory', help="folder of YYYY-MM-DD.dat daily binaries")
+    parser.add_argument('cube_path')
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--units', default='')
+    args = parser.parse_args()
+
+    export_cube(args.directory, args.cube_path, args.mission, args.start, args.end, units=args.units)
@@ -0,0 +1,189 @@
+import argparse, os, sqlite3
+from pathlib import Path
+import netCDF4
+import numpy as np
+from granules import read_chunks
+from gridding import file_pool, map_files
+
+# Task: a spatial-temporal index of the raw NetCDF granules, so runs that only want a region or a few days open
+# only the granules that can contribute instead of walking and opening the whole tree
+# a scan lists the granule tree once through the spec's layout and opens only granules that are new or whose
+# mtime/size changed since the last scan; granules that disappeared are dropped
+#
+#   python granule_index.py CYGNSS scan --workers 16
+#   python granule_index.py CYGNSS query --region australia --start 2024-02-01 --end 2024-02-29
+#   python ingest.py CYGNSS_QC composite --index /data01/lpu/granule_index.sqlite --bbox -45 -10 100 160
+
+GRANULE_INDEX = '/data01/lpu/granule_index.sqlite'
+
+# date is the date the spec's layout gives the granule (what the builders group by), time_start/time_end come from
+# the granule's time coverage; the box is over the samples with a position, in the granule's [0, 360) longitudes
+# and is NULL for granules without any
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS granules (
+    path TEXT PRIMARY KEY,
+    mission TEXT NOT NULL,
+    date TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    time_start TEXT,
+    time_end TEXT,
+    lat_min REAL, lat_max REAL, lon_min REAL, lon_max REAL,
+    n_samples INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS granules_date ON granules (mission, date);
+CREATE TABLE IF NOT EXISTS granule_variables (
+    path TEXT NOT NULL REFERENCES granules (path) ON DELETE CASCADE,
+    variable TEXT NOT NULL,
+    PRIMARY KEY (path, variable)
+);
+"""
+
+# (time_start, time_end, (lat_min, lat_max, lon_min, lon_max) or None, samples with a position, variables)
+def scan_granule(file):
+    with netCDF4.Dataset(file, "r") as nc_file:
+        attributes = nc_file.ncattrs()
+        time_start = nc_file.getncattr('time_coverage_start') if 'time_coverage_start' in attributes else None
+        time_end = nc_file.getncattr('time_coverage_end') if 'time_coverage_end' in attributes else time_start
+        variables = sorted(nc_file.variables)
+
+    box, n_samples = None, 0
+    for chunk, keep in read_chunks(file, []):
+        lat, lon = chunk['sp_lat'][keep], chunk['sp_lon'][keep]
+        chunk_box = (lat.min(), lat.max(), lon.min(), lon.max())
+        box = chunk_box if box is None else (min(box[0], chunk_box[0]), max(box[1], chunk_box[1]),
+                                             min(box[2], chunk_box[2]), max(box[3], chunk_box[3]))
+        n_samples += int(np.count_nonzero(keep.any(axis=tuple(range(1, keep.ndim)))))
+
+    box = None if box is None else tuple(float(value) for value in box)
+    return time_start, time_end, box, n_samples, variables
+
+class GranuleIndex:
+    def __init__(self, path=GRANULE_INDEX):
+        self.path = str(path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    # brings the index up to date with the granule tree of a spec, returns (scanned, removed, failed) counts
+    # granules is the {date: [files]} of the spec's layout, the walk itself is only a directory listing
+    def update(self, spec, granules, executor=None):
+        known = {path: (mtime_ns, size) for path, mtime_ns, size in self.connection.execute(
+            "SELECT path, mtime_ns, size FROM granules WHERE mission = ?", (spec.mission,))}
+
+        dated = {str(file): date for date, files in granules.items() for file in files}
+        stale = []
+        for path, date in sorted(dated.items()):
+            stat = os.stat(path)
+            if known.get(path) != (stat.st_mtime_ns, stat.st_size):
+                stale.append(path)
+
+        # a dated window only sees part of the tree, so granules are only dropped when they are really gone
+        removed = [path for path in known if path not in dated and not os.path.exists(path)]
+        with self.connection:
+            self.connection.executemany("DELETE FROM granules WHERE path = ?", [(path,) for path in removed])
+
+        failed = 0
+        for j, (path, (scan, error)) in enumerate(map_files(scan_granule, stale, executor)):
+            if (j % 250 == 0):
+                print(f"- Scanning file #{j} of {len(stale)}")
+
+            if error is not None:
+                print(f"- Failed to scan {Path(path).as_posix()}: {error!r}")
+                failed += 1
+                continue
+
+            self.record(spec.mission, dated[path], path, *scan)
+
+        return len(stale) - failed, len(removed), failed
+
+    def record(self, mission, date, path, time_start, time_end, box, n_samples, variables):
+        stat = os.stat(path)
+        box = box or (None, None, None, None)
+        with self.connection:
+            self.connection.execute("DELETE FROM granules WHERE path = ?", (path,))
+            self.connection.execute("INSERT INTO granules VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (path, mission, date, stat.st_mtime_ns, stat.st_size, time_start, time_end,
+                                     *box, n_samples))
+            self.connection.executemany("INSERT INTO granule_variables VALUES (?, ?)",
+                                        [(path, variable) for variable in variables])
+
+    # {date: [paths]} of the granules of a mission in [start, end] whose box intersects bbox and that carry every
+    # one of variables, in the same form as the ingest layouts so builders can use either
+    # bbox is (latmin, latmax, lonmin, lonmax) like ingest --bbox, granules without samples never intersect one
+    # root limits the result to the granules under one input folder
+    def query(self, mission, start=None, end=None, bbox=None, variables=(), root=None):
+        sql, parameters = "SELECT date, path FROM granules WHERE mission = ?", [mission]
+        if root:
+            prefix = os.path.join(str(root), '')
+            sql += " AND substr(path, 1, ?) = ?"
+            parameters += [len(prefix), prefix]
+        if start:
+            sql += " AND date >= ?"
+            parameters.append(start)
+        if end:
+            sql += " AND date <= ?"
+            parameters.append(end)
+        if bbox is not None:
+            latmin, latmax, lonmin, lonmax = bbox
+            sql += " AND lat_max >= ? AND lat_min <= ? AND lon_max >= ? AND lon_min <= ?"
+            parameters += [latmin, latmax, lonmin, lonmax]
+        for variable in variables:
+            sql += " AND path IN (SELECT path FROM granule_variables WHERE variable = ?)"
+            parameters.append(variable)
+
+        granules = {}
+        for date, path in self.connection.execute(sql + " ORDER BY date, path", parameters):
+            granules.setdefault(date, []).append(Path(path))
+        return granules
+
+    # granules, samples and the earliest and latest dates of a mission, for a quick look at what is indexed
+    def summary(self, mission):
+        return self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(n_samples), 0), MIN(date), MAX(date) FROM granules WHERE mission = ?",
+            (mission,)).fetchone()
+
+def main(argv=None):
+    from ingest import SPECS, LAYOUTS
+    from comparison_stats import REGIONS
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spec', choices=SPECS.keys())
+    parser.add_argument('action', choices=['scan', 'query'])
+    parser.add_argument('--index', default=GRANULE_INDEX)
+    parser.add_argument('--input-dir', default=None, help="defaults to the spec's raw data folder")
+    parser.add_argument('--workers', type=int, default=1, help="processes opening granules in parallel (1 = serial)")
+    parser.add_argument('--start', default=None, help="first date (YYYY-MM-DD)")
+    parser.add_argument('--end', default=None, help="last date (YYYY-MM-DD)")
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('LATMIN', 'LATMAX', 'LONMIN', 'LONMAX'))
+    parser.add_argument('--region', default=None, choices=[name for name, box in REGIONS.items() if not isinstance(box, str)],
+                        help="a box of comparison_stats.REGIONS instead of --bbox")
+    parser.add_argument('--variables', nargs='*', default=[], help="only granules carrying all of these variables")
+    args = parser.parse_args(argv)
+
+    spec = SPECS[args.spec]
+    index = GranuleIndex(args.index)
+
+    if args.action == 'scan':
+        granules = LAYOUTS[spec.layout](args.input_dir or spec.input_dir, args.start, args.end)
+        with file_pool(args.workers) as executor:
+            scanned, removed, failed = index.update(spec, granules, executor)
+        n_granules, n_samples, first, last = index.summary(spec.mission)
+        print(f"Scanned {scanned} granules ({failed} failed), removed {removed}; "
+              f"{n_granules} {spec.mission} granules with {n_samples} samples from {first} to {last}")
+    else:
+        bbox = REGIONS[args.region] if args.region else args.bbox
+        granules = index.query(spec.mission, args.start, args.end, bbox, args.variables, args.input_dir)
+        for date, files in granules.items():
+            print(f"{date}: {len(files)} granules")
+            for file in files:
+                print(f"  {Path(file).as_posix()}")
+
+    index.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os, re
+import netCDF4
+import numpy as np
+from instrument import stage
+
+# Task: read only what a gridding run needs from a granule
+# variables are read in hyperslabs of `chunk_samples` along the sample dimension and the quality and bounding box
+# filters are applied per chunk, so a granule is never fully decoded into masked arrays
+# granules outside the requested dates never get here, ingest.find_granules drops them from their folder or file name
+
+# CYGNSS names granules like cyg08.ddmi.s20230531-000000-e20230531-235959.l1.power-brcs.a03.d63.nc
+# returns (start, end) as YYYY-MM-DD, or None when the name doesn't carry dates (e.g. SPIRE, which is foldered by date)
+def filename_dates(name):
+    start = re.search(r'\.s(\d{4})(\d{2})(\d{2})', name)
+    end = re.search(r'-e(\d{4})(\d{2})(\d{2})', name)
+    if not end:
+        return None
+
+    end = f"{end.group(1)}-{end.group(2)}-{end.group(3)}"
+    start = f"{start.group(1)}-{start.group(2)}-{start.group(3)}" if start else end
+    return start, end
+
+def _fill_value(variable):
+    if '_FillValue' in variable.ncattrs():
+        return variable.getncattr('_FillValue')
+    return netCDF4.default_fillvals.get(variable.dtype.str[1:])
+
+# bbox is (latmin, latmax, lonmin, lonmax) in the granule's own lon convention ([0, 360) for CYGNSS)
+def in_bbox(lat, lon, bbox):
+    latmin, latmax, lonmin, lonmax = bbox
+    return (lat >= latmin) & (lat <= latmax) & (lon >= lonmin) & (lon <= lonmax)
+
+# yields (chunk, keep) per hyperslab, chunk maps sp_lat, sp_lon and every requested variable present in the granule
+# to its (samples, ddm) block (missing variables such as reflectivity_peak in mss_matchup files are simply absent)
+# float fill values come back as NaN, keep marks the samples with a position that pass `quality` (a function of
+# the chunk, evaluated once per chunk) and the bounding box; chunks without any such sample are not yielded
+# timer (an instrument.StageTimer) gets the decode and mask seconds, the samples kept, the bytes of the variables
+# actually sliced out of the granule (bytes_decoded) and the size of the granule opened (file_bytes)
+def read_chunks(file, variables, quality=None, bbox=None, chunk_samples=1 << 16, timer=None):
+    if timer is not None:
+        timer.count('file_bytes', os.path.getsize(file))
+
+    with netCDF4.Dataset(file, "r") as nc_file:
+        names = ['sp_lat', 'sp_lon'] + [name for name in variables if name in nc_file.variables and name not in ('sp_lat', 'sp_lon')]
+        nc_variables = {name: nc_file.variables[name] for name in names}
+        for variable in nc_variables.values():
+            variable.set_auto_mask(False)
+
+        n_samples = nc_variables['sp_lat'].shape[0]
+
+        # hyperslabs are rounded up to whole HDF5 chunks so no storage chunk is decompressed twice
+        storage = nc_variables['sp_lat'].chunking()
+        if storage != 'contiguous' and storage:
+            chunk_samples = -(-chunk_samples // storage[0]) * storage[0]
+
+        for start in range(0, n_samples, chunk_samples):
+            chunk = {}
+            with stage(timer, 'decode'):
+                for name, variable in nc_variables.items():
+                    values = variable[start:start + chunk_samples]
+                    if values.dtype.kind == 'f':
+                        fill = _fill_value(variable)
+                        if fill is not None:
+                            values[values == fill] = np.nan
+                    chunk[name] = values
+
+            with stage(timer, 'mask'):
+                keep = ~np.isnan(chunk['sp_lat']) & ~np.isnan(chunk['sp_lon'])
+                if quality is not None:
+                    keep &= quality(chunk)
+                if bbox is not None:
+                    keep &= in_bbox(chunk['sp_lat'], chunk['sp_lon'], bbox)
+
+            if timer is not None:
+                timer.count('bytes_decoded', sum(values.nbytes for values in chunk.values()))
+                timer.count('samples', np.count_nonzero(keep))
+
+            if not keep.any():
+                continue
+
+            yield chunk, keep
@@ -0,0 +1,120 @@
+import argparse, io, json, os, pickle, sys
+from datetime import datetime, timezone
+import numpy as np
+from manifest import atomic_write
+from gridding import FILL_VALUE
+from daily_binaries import open_daily
+
+# Task: composite and regression grids as self-describing files that open in O(1) instead of 100-200 MB pickles
+# <name>.npy holds the array, np.load(mmap_mode='r') maps it and only the rows that get touched are read from disk
+# <name>.json next to it holds the extent, resolution, fill value, units and provenance
+# readers go through open_grid, which takes .npy or the old .pkl names (preferring the .npy when both exist) and the
+# .dat/.sdat daily binaries, so old pickles keep working until `python grid_io.py convert` replaces them
+#
+#   python grid_io.py convert /data01/lpu/*.pkl
+#   python grid_io.py info /data01/lpu/slope_grid.npy
+
+# CF style units of the gridded products, reflectivity is a linear power ratio
+PRODUCT_UNITS = {'snr': 'dB', 'reflectivity': '1'}
+
+def npy_path(path):
+    return os.path.splitext(str(path))[0] + '.npy'
+
+def sidecar_path(path):
+    return os.path.splitext(str(path))[0] + '.json'
+
+# the file behind a grid name: the .npy if it exists, else the legacy .pkl, else the path as given
+def resolve_grid(path):
+    path = str(path)
+    root, ext = os.path.splitext(path)
+    if ext in ('.npy', '.pkl', ''):
+        for candidate in (root + '.npy', root + '.pkl'):
+            if os.path.exists(candidate):
+                return candidate
+    return path
+
+def grid_exists(path):
+    return os.path.exists(resolve_grid(path))
+
+# (lat_min, lat_max, resolution) of a global-longitude grid, every grid here spans 360 degrees and is centered on the
+# equator (SPIRE [-90, 90], CYGNSS [-45, 45]) unless lat_min says otherwise
+def grid_extent(shape, lat_min=None):
+    resolution = 360 / shape[1]
+    lat_min = -shape[0] * resolution / 2 if lat_min is None else lat_min
+    return lat_min, lat_min + shape[0] * resolution, resolution
+
+# writes <path without extension>.npy and its .json sidecar atomically, returns (npy path, sha256) like write_daily
+# provenance is whatever the writer knows about its inputs (mission, dates, source folders, ...)
+def write_grid(path, grid, units=None, fill_value=FILL_VALUE, lat_min=None, provenance=None, **attributes):
+    path = npy_path(path)
+    grid = np.ascontiguousarray(grid)
+
+    buffer = io.BytesIO()
+    np.lib.format.write_array(buffer, grid, allow_pickle=False)
+    sha256 = atomic_write(path, buffer.getbuffer())
+
+    lat_min, lat_max, resolution = grid_extent(grid.shape, lat_min)
+    metadata = {
+        'shape': list(grid.shape), 'dtype': grid.dtype.name,
+        'lat_min': lat_min, 'lat_max': lat_max, 'lon_min': 0, 'lon_max': 360, 'resolution': resolution,
+        'fill_value': fill_value, 'units': units, 'sha256': sha256,
+        'provenance': {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                       'command': ' '.join([os.path.basename(sys.argv[0])] + sys.argv[1:]), **(provenance or {})},
+        **attributes,
+    }
+    atomic_write(sidecar_path(path), json.dumps(metadata, indent=1, default=str).encode())
+    return path, sha256
+
+# a read-only view of the grid: .npy and .dat are memory-mapped, .sdat opens as a SparseGrid and legacy pickles are
+# read whole; shape is only needed for raw .dat files
+def open_grid(path, shape=None):
+    path = resolve_grid(path)
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    if path.endswith('.pkl'):
+        print(f"- Reading legacy pickle {path}, `python grid_io.py convert` makes it a memory-mappable .npy")
+        with open(path, 'rb') as f:
+            return np.asarray(pickle.load(f))
+    if shape is None and path.endswith('.dat'):
+        raise ValueError(f"{path} is a raw binary, its shape has to be given")
+    return open_daily(path, shape)
+
+# the sidecar of a grid, or what can be inferred from its shape for grids written before there were sidecars
+def grid_metadata(path, shape=None):
+    path = resolve_grid(path)
+    if path.endswith('.npy') and os.path.exists(sidecar_path(path)):
+        with open(sidecar_path(path), 'r') as f:
+            return json.load(f)
+
+    grid = open_grid(path, shape)
+    lat_min, lat_max, resolution = grid_extent(grid.shape)
+    return {'shape': list(grid.shape), 'dtype': np.dtype(grid.dtype).name, 'lat_min': lat_min, 'lat_max': lat_max,
+            'lon_min': 0, 'lon_max': 360, 'resolution': resolution, 'fill_value': FILL_VALUE, 'units': None}
+
+# the units of a <mission>_<product>_grid name, None if the product isn't known
+def product_units(path):
+    name = os.path.basename(str(path)).lower()
+    return next((units for product, units in PRODUCT_UNITS.items() if f"_{product}_" in name), None)
+
+# rewrites a legacy pickle as .npy plus sidecar, keeping the pickle unless remove is set
+def convert_pickle(path, remove=False):
+    with open(path, 'rb') as f:
+        grid = np.asarray(pickle.load(f))
+    fill_value = 0 if os.path.basename(path).startswith('count_') else FILL_VALUE
+    output, _ = write_grid(path, grid, product_units(path), fill_value, provenance={'converted_from': str(path)})
+    if remove:
+        os.unlink(path)
+    return output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['convert', 'info'])
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--remove', action='store_true', help="delete each pickle once its .npy is written")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        if args.action == 'convert':
+            print(f"{path} -> {convert_pickle(path, args.remove)}")
+        else:
+            print(f"{path}: {json.dumps(grid_metadata(path), indent=1)}")
@@ -0,0 +1,346 @@
+from collections import namedtuple, deque
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+import errno, signal, threading, time
+import numpy as np
+from instrument import stage
+
+# Task: shared gridding kernel used by make_grid*.py and make_binaries_*.py
+# specular points are binned into flat cell indices and reduced with np.bincount, so repeated
+# cells inside one file are summed correctly (buffered fancy-index `+=` silently drops them)
+
+FILL_VALUE = -9999
+
+# lat_min is the latitude of the first grid row; clip_lat decides whether out of range latitudes are
+# clipped onto the edge rows (SPIRE, full globe) or dropped (CYGNSS, old files can cover [-90, 90])
+GridSpec = namedtuple('GridSpec', ['lat_min', 'n_rows', 'n_cols', 'resolution', 'clip_lat'])
+
+SPIRE_GRID = GridSpec(lat_min=-90, n_rows=3600, n_cols=7200, resolution=0.05, clip_lat=True)
+CYGNSS_GRID = GridSpec(lat_min=-45, n_rows=1800, n_cols=7200, resolution=0.05, clip_lat=False)
+
+MISSION_GRIDS = {
+    'SPIRE': SPIRE_GRID,
+    'CYGNSS': CYGNSS_GRID,
+}
+
+# resolution pyramid: each level is the number of 0.05 degree base cells it aggregates along each side
+# (10km = 0.1, 25km = 0.25 and 1deg = 1 degree), they divide the 3600/1800 x 7200 grids exactly
+PYRAMID_LEVELS = {
+    '5km': 1,
+    '10km': 2,
+    '25km': 5,
+    '1deg': 20,
+}
+
+def coarsen_spec(spec, factor):
+    return spec._replace(n_rows=spec.n_rows // factor, n_cols=spec.n_cols // factor, resolution=spec.resolution * factor)
+
+# the spec of a pyramid level of a base grid
+def level_spec(spec, level):
+    return coarsen_spec(spec, PYRAMID_LEVELS[level])
+
+# coarsest level whose cells are at most `resolution` degrees, i.e. the cheapest grid that still resolves it
+# levels limits the choice to the ones available (e.g. the levels a run actually wrote)
+def pick_level(spec, resolution, levels=None):
+    levels = PYRAMID_LEVELS if levels is None else levels
+    fine_enough = [level for level in levels if spec.resolution * PYRAMID_LEVELS[level] <= resolution * (1 + 1e-9)]
+    if not fine_enough:
+        return min(levels, key=lambda level: PYRAMID_LEVELS[level])
+    return max(fine_enough, key=lambda level: PYRAMID_LEVELS[level])
+
+# a sparse per-file result: sorted unique flat cell indices with the sum and count of values in each
+Partial = namedtuple('Partial', ['cells', 'sums', 'counts'])
+
+def cell_indices(lat, lon, spec):
+    # samples without a position are NaN here, their garbage indices are masked out by the callers
+    with np.errstate(invalid='ignore'):
+        x = (np.asarray(lon) / spec.resolution).astype(int)
+        y = ((np.asarray(lat) - spec.lat_min) / spec.resolution).astype(int)
+    x = np.clip(x, 0, spec.n_cols - 1)
+
+    if spec.clip_lat:
+        y = np.clip(y, 0, spec.n_rows - 1)
+        in_grid = np.ones(y.shape, dtype=bool)
+    else:
+        in_grid = (y >= 0) & (y < spec.n_rows)
+
+    # a 3600 x 7200 grid has fewer than 2**31 cells, int32 ids halve the memory of the (cell, value) pairs
+    cells = np.where(in_grid, y * spec.n_cols + x, 0).astype(np.int32)
+    return cells, in_grid
+
+# valid readings are unmasked, not NaN and (for CYGNSS) inside the grid's latitude range
+def valid_values(values, in_grid, extra_mask=None):
+    valid = ~np.ma.getmaskarray(values) & ~np.isnan(np.ma.getdata(values)) & in_grid
+    if extra_mask is not None:
+        valid &= extra_mask
+    return valid
+
+def bin_partial(cells, values, valid):
+    cells = cells[valid].ravel()
+    values = np.ma.getdata(values)[valid].ravel().astype(np.float32)
+
+    if cells.size == 0:
+        return Partial(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int32))
+
+    # bincount over the compacted cell ids keeps the work O(samples) instead of O(grid)
+    unique_cells, inverse = np.unique(cells, return_inverse=True)
+    sums = np.bincount(inverse, weights=values, minlength=unique_cells.size)
+    counts = np.bincount(inverse, minlength=unique_cells.size).astype(np.int32)
+
+    return Partial(unique_cells, sums, counts)
+
+# reduces several partials (e.g. the chunks of one granule) into one, None if there is nothing to merge
+def merge_partials(partials):
+    partials = [partial for partial in partials if partial is not None]
+    if not partials:
+        return None
+    if len(partials) == 1:
+        return partials[0]
+
+    cells = np.concatenate([partial.cells for partial in partials])
+    unique_cells, inverse = np.unique(cells, return_inverse=True)
+    sums = np.bincount(inverse, weights=np.concatenate([partial.sums for partial in partials]), minlength=unique_cells.size)
+    counts = np.bincount(inverse, weights=np.concatenate([partial.counts for partial in partials]), minlength=unique_cells.size)
+
+    return Partial(unique_cells, sums, counts.astype(np.int32))
+
+# grids the chunks yielded by granules.read_chunks into one partial per variable
+# variables maps a variable name to an extra mask function of the chunk (or None), variables missing from the
+# granule get a None partial
+# only the compact (cell, value) pairs of the valid readings are kept per chunk and binned once at the end
+# timer (an instrument.StageTimer) gets the mask and bin seconds
+def grid_chunks(chunks, spec, variables, timer=None):
+    cells = {name: [] for name in variables}
+    values = {name: [] for name in variables}
+
+    for chunk, keep in chunks:
+        with stage(timer, 'mask'):
+            chunk_cells, in_grid = cell_indices(chunk['sp_lat'], chunk['sp_lon'], spec)
+            in_grid &= keep
+            for name, extra_mask in variables.items():
+                if name in chunk:
+                    valid = valid_values(chunk[name], in_grid, extra_mask(chunk) if extra_mask else None)
+                    cells[name].append(chunk_cells[valid])
+                    values[name].append(chunk[name][valid].astype(np.float32))
+
+    partials = {}
+    with stage(timer, 'bin'):
+        for name in variables:
+            if not cells[name]:
+                partials[name] = None
+                continue
+            name_cells = np.concatenate(cells[name])
+            partials[name] = bin_partial(name_cells, np.concatenate(values[name]), np.ones(name_cells.shape, dtype=bool))
+
+    return partials
+
+def grid_partial(lat, lon, values, spec, extra_mask=None):
+    cells, in_grid = cell_indices(lat, lon, spec)
+    valid = valid_values(values, in_grid, extra_mask)
+    return bin_partial(cells, values, valid)
+
+# dense variant for callers that want the full sum and count grids of a single set of readings
+def grid_sum_count(lat, lon, values, spec, extra_mask=None):
+    partial = grid_partial(lat, lon, values, spec, extra_mask)
+    accumulator = GridAccumulator(spec)
+    accumulator.add(partial)
+    return accumulator.sum, accumulator.count
+
+class GridAccumulator:
+    # sums stay in float64 so the daily mean matches the old float64 accumulation before the float32 cast
+    def __init__(self, spec):
+        self.spec = spec
+        self.sum = np.zeros((spec.n_rows, spec.n_cols), dtype=np.float64)
+        self.count = np.zeros((spec.n_rows, spec.n_cols), dtype=np.int32)
+
+    # sign=-1 removes a partial added before, e.g. the sparse day dropping out of a rolling window
+    def add(self, partial, sign=1):
+        if partial is None or partial.cells.size == 0:
+            return
+        # cells are unique within a partial, so plain fancy-index addition is safe here
+        self.sum.ravel()[partial.cells] += sign * partial.sums
+        self.count.ravel()[partial.cells] += sign * partial.counts
+        if sign < 0:
+            emptied = partial.cells[self.count.ravel()[partial.cells] == 0]
+            self.sum.ravel()[emptied] = 0
+
+    # adds (sign=1) or removes (sign=-1) an already averaged grid weighted by its counts, e.g. a daily binary
+    # rows are done in blocks to keep the float64 temporaries small
+    def add_grid(self, mean, count, sign=1, block_rows=450):
+        for start in range(0, self.sum.shape[0], block_rows):
+            rows = slice(start, start + block_rows)
+            block_count = np.asarray(count[rows], dtype=np.int32)
+            filled = block_count > 0
+            block_sum = self.sum[rows]
+            block_sum[filled] += sign * (np.asarray(mean[rows])[filled].astype(np.float64) * block_count[filled])
+            self.count[rows] += sign * block_count
+            # cells that drop back to no readings are reset so rolling windows don't accumulate rounding drift
+            block_sum[self.count[rows] == 0] = 0
+
+    # exact sum/count aggregation onto factor x factor blocks, the coarse mean is the mean of all the readings
+    # of the block and not a mean of the fine means
+    def coarsen(self, factor):
+        coarse = GridAccumulator(coarsen_spec(self.spec, factor))
+        if factor == 1:
+            coarse.sum[:], coarse.count[:] = self.sum, self.count
+            return coarse
+
+        shape = (coarse.spec.n_rows, factor, coarse.spec.n_cols, factor)
+        coarse.sum[:] = self.sum.reshape(shape).sum(axis=(1, 3))
+        coarse.count[:] = self.count.reshape(shape).sum(axis=(1, 3))
+        return coarse
+
+    # {level: accumulator} of every requested pyramid level, all derived from this one pass over the readings
+    def pyramid(self, levels=PYRAMID_LEVELS):
+        return {level: self.coarsen(PYRAMID_LEVELS[level]) for level in levels}
+
+    def mean(self):
+        mask = self.count > 0
+        grid = np.full(self.sum.shape, FILL_VALUE, dtype=np.float64)
+        grid[mask] = self.sum[mask] / self.count[mask]
+        return grid.astype(np.float32)
+
+class FilePool:
+    # a ProcessPoolExecutor whose workers can be killed and replaced, the only way to get a worker back from a read
+    # hung inside netCDF/HDF5 C code (a dead NFS mount, a corrupt granule)
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, function, *args):
+        return self.executor.submit(function, *args)
+
+    # kills every worker, stuck or not, and starts a fresh pool; the futures of the old pool end as cancelled or broken
+    def recycle(self):
+        for process in list((self.executor._processes or {}).values()):
+            process.kill()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True)
+
+def file_pool(workers):
+    # one pool for the whole run, so worker start up is paid once and not per date
+    if workers is None or workers <= 1:
+        return nullcontext(None)
+    return FilePool(workers)
+
+class ReadTimeout(Exception):
+    pass
+
+# OSErrors worth another try, e.g. a network filesystem hiccup; the netCDF/HDF errors of a corrupt granule
+# come with negative errnos and are not retried
+TRANSIENT_ERRNOS = {errno.EIO, errno.EAGAIN, errno.EINTR, errno.EBUSY, errno.ESTALE, errno.ETIMEDOUT}
+
+def is_transient(error):
+    return isinstance(error, OSError) and error.errno in TRANSIENT_ERRNOS
+
+def _timed_out(signum, frame):
+    raise ReadTimeout("read timed out")
+
+# runs read_file(file) under a SIGALRM timer, only used for serial reads: the alarm is only delivered between Python
+# bytecodes, so a read stuck inside one C call ends when that call returns (pools enforce the timeout in the parent)
+def _read_with_timeout(read_file, file, timeout):
+    if not timeout or threading.current_thread() is not threading.main_thread():
+        return read_file(file)
+
+    previous = signal.signal(signal.SIGALRM, _timed_out)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return read_file(file)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+# transient errors are retried with exponential backoff, anything else is returned at once
+def _try_read(read_file, file, timeout=None, retries=0, retry_delay=1.0):
+    for attempt in range(retries + 1):
+        try:
+            return _read_with_timeout(read_file, file, timeout), None
+        except Exception as e:
+            if attempt < retries and is_transient(e):
+                time.sleep(retry_delay * 2 ** attempt)
+                continue
+            return None, e
+
+# the longest a worker may spend on one file: every attempt up to the timeout plus the backoff between them
+def read_deadline(timeout, retries=0, retry_delay=1.0):
+    return timeout * (retries + 1) + retry_delay * (2 ** retries - 1)
+
+# the head future's (result, error), ReadTimeout once it has run for longer than deadline seconds; the clock starts
+# when the future is seen running, so time spent queued behind other files doesn't count
+# a worker that died (segfault in a corrupt granule, OOM killer) breaks the pool and comes back as BrokenProcessPool
+def _wait_result(future, deadline, poll=1.0):
+    started = None
+    while True:
+        try:
+            return future.result(timeout=poll if deadline else None)
+        except BrokenProcessPool as e:
+            return None, e
+        except FuturesTimeout:
+            if started is None and future.running():
+                started = time.monotonic()
+            if started is not None and time.monotonic() - started > deadline:
+                return None, ReadTimeout(f"read took longer than {deadline:g}s")
+
+# yields (file, (result, error)) in the same order as files, reading them in the pool's worker processes
+# results are reduced by the caller in file order, so parallel and serial runs produce byte-identical grids
+# at most `window` files are in flight at once, which keeps the parent's buffered partials bounded
+# timeout (seconds) bounds each read and retries is how often a transient I/O error is retried; with a pool the
+# parent gives up on a file that runs past its read_deadline, kills the workers and resubmits the other files in
+# flight to a fresh pool, so a granule stuck in C code costs one deadline and not the run
+# a dead worker breaks every future in flight, so the pool is recycled and the head file is read again on its own:
+# it is only reported (as BrokenProcessPool) if it breaks the fresh pool too, the others are simply resubmitted
+def map_files(read_file, files, executor=None, window=64, timeout=None, retries=0):
+    if executor is None:
+        for file in files:
+            yield file, _try_read(read_file, file, timeout, retries)
+        return
+
+    deadline = read_deadline(timeout, retries) if timeout else None
+    pending = deque()
+
+    def submit(file):
+        try:
+            return executor.submit(_try_read, read_file, file, None, retries)
+        except BrokenProcessPool as e:
+            # the pool broke since the last result, the future fails when it gets to the head
+            future = Future()
+            future.set_exception(e)
+            return future
+
+    def resubmit_unfinished():
+        # finished reads keep their results, the ones the recycle cut short start over
+        for i in range(len(pending)):
+            other, other_future = pending[i]
+            if not other_future.done() or other_future.cancelled() or other_future.exception() is not None:
+                pending[i] = (other, submit(other))
+
+    def next_result():
+        file, future = pending.popleft()
+        result = _wait_result(future, deadline)
+        recycled = False
+        if isinstance(result[1], BrokenProcessPool):
+            # the head is not necessarily the file that killed the worker, it is read again alone on a fresh pool
+            executor.recycle()
+            recycled = True
+            result = _wait_result(submit(file), deadline)
+        if isinstance(result[1], (ReadTimeout, BrokenProcessPool)):
+            executor.recycle()
+            recycled = True
+        if recycled:
+            resubmit_unfinished()
+        return file, result
+
+    for file in files:
+        pending.append((file, submit(file)))
+        if len(pending) >= window:
+            yield next_result()
+
+    while pending:
+        yield next_result()
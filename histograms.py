@@ -0,0 +1,228 @@
+import argparse, hashlib, json, math, os, pickle
+from collections import Counter
+from functools import partial
+import numpy as np
+from manifest import atomic_write, inputs_signature
+from gridding import FILL_VALUE, MISSION_GRIDS, PYRAMID_LEVELS, level_spec, file_pool, map_files
+from daily_binaries import daily_paths
+from grid_io import open_grid, resolve_grid
+from sparse_daily import SparseGrid
+
+# Task: value distributions (histograms and quantiles) of many grids without loading or masking them whole
+# every source is read rows_per_chunk rows at a time, its filled values go into a fixed-edge Histogram and a
+# QuantileSketch, both of which merge, so worker processes each take some sources and the parent adds them up;
+# the merged result is cached per (sources, edges, accuracy), so re-plotting with another scale or title is a pickle load
+#
+#   python histograms.py /data01/lpu/slope_grid.npy --log-range 1e-3 1e6 --output figures/regression/slope_bins.png
+#   python histograms.py /data01/lpu/CYGNSS/reflectivity/2024 --mission CYGNSS --range 0 0.05 0.0005 --workers 8
+
+CACHE_DIR = '/data01/lpu/histogram_cache'
+
+# bins of bin_size centered on the multiples of bin_size in [min_val, max_val], like the old create_bin_figure
+def linear_edges(min_val, max_val, bin_size):
+    offset = bin_size / 2
+    min_val = np.floor(min_val / bin_size) * bin_size
+    max_val = np.ceil(max_val / bin_size) * bin_size
+    return np.arange(min_val - offset, max_val + offset, bin_size)
+
+# for data spanning orders of magnitude, e.g. the regression MSE
+def log_edges(min_val, max_val, bins_per_decade=20):
+    decades = math.log10(max_val) - math.log10(min_val)
+    return np.logspace(math.log10(min_val), math.log10(max_val), int(math.ceil(decades * bins_per_decade)) + 1)
+
+class Histogram:
+    # values below the first or above the last edge are counted in underflow/overflow rather than dropped
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+        self.n = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values):
+        if values.size == 0:
+            return
+        values = values.astype(np.float64, copy=False)
+        # bins are [edge i, edge i+1) except the last one, which includes its right edge like np.histogram
+        index = np.searchsorted(self.edges, values, side='right') - 1
+        index[values == self.edges[-1]] = len(self.counts) - 1
+        inside = (index >= 0) & (index < len(self.counts))
+        self.counts += np.bincount(index[inside], minlength=len(self.counts))
+        self.underflow += int((index < 0).sum())
+        self.overflow += int((index >= len(self.counts)).sum())
+        self.n += values.size
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("histograms with different edges can't be merged")
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+        self.n += other.n
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.sum / self.n if self.n else math.nan
+
+class QuantileSketch:
+    # log-bucketed counts of |value| (the DDSketch idea): any quantile comes back within relative_accuracy of a value
+    # of the data, the sketch merges exactly and its size grows with the log of the value range, not with the data
+    # (about 600 buckets for 1e-5..1 at 1%); |values| below min_value count as zero
+    def __init__(self, relative_accuracy=0.01, min_value=1e-12):
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zeros = 0
+        self.n = 0
+
+    def _add_buckets(self, buckets, magnitudes):
+        keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64), return_counts=True)
+        buckets.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def add(self, values):
+        if values.size == 0:
+            return
+        values = values.astype(np.float64, copy=False)
+        positive = values >= self.min_value
+        negative = values <= -self.min_value
+        self._add_buckets(self.positive, values[positive])
+        self._add_buckets(self.negative, -values[negative])
+        self.zeros += values.size - int(positive.sum()) - int(negative.sum())
+        self.n += values.size
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy or other.min_value != self.min_value:
+            raise ValueError("sketches with different accuracies can't be merged")
+        self.positive.update(other.positive)
+        self.negative.update(other.negative)
+        self.zeros += other.zeros
+        self.n += other.n
+
+    def _value(self, key):
+        # the point of bucket (gamma^(key-1), gamma^key] within relative_accuracy of both ends
+        return 2 * math.exp(key * self.log_gamma) / (1 + math.exp(self.log_gamma))
+
+    def quantile(self, q):
+        if self.n == 0:
+            return math.nan
+        rank = q * (self.n - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._value(key)
+        return self._value(max(self.positive))
+
+    def quantiles(self, qs):
+        return {q: self.quantile(q) for q in qs}
+
+# the filled values of a grid, rows_per_chunk rows at a time
+def filled_chunks(grid, rows_per_chunk=256):
+    for start in range(0, grid.shape[0], rows_per_chunk):
+        if isinstance(grid, SparseGrid):
+            # sparse days only hold their filled cells, no need to densify the rows
+            yield grid[start:start + rows_per_chunk].items()[1]
+            continue
+        chunk = np.asarray(grid[start:start + rows_per_chunk])
+        yield chunk[(chunk != FILL_VALUE) & np.isfinite(chunk)]
+
+# (Histogram, QuantileSketch) of one source, run in a worker
+def source_distribution(path, edges, shape=None, relative_accuracy=0.01, rows_per_chunk=256):
+    histogram, sketch = Histogram(edges), QuantileSketch(relative_accuracy)
+    for values in filled_chunks(open_grid(path, shape), rows_per_chunk):
+        histogram.add(values)
+        sketch.add(values)
+    return histogram, sketch
+
+# cache entries are named by a hash of the sources' (path, mtime, size), the edges and the accuracy
+def cache_path(cache_dir, paths, edges, relative_accuracy):
+    key = json.dumps({'sources': inputs_signature(paths), 'edges': hashlib.sha256(np.asarray(edges, np.float64)).hexdigest(),
+                      'relative_accuracy': relative_accuracy})
+    return os.path.join(cache_dir, f"{hashlib.sha256(key.encode()).hexdigest()}.pkl")
+
+# merged (Histogram, QuantileSketch) of all the sources, from the cache when none of them changed
+def distribution(paths, edges, shape=None, relative_accuracy=0.01, workers=1, cache_dir=CACHE_DIR, rows_per_chunk=256):
+    paths = [resolve_grid(path) for path in paths]
+    cached = None if cache_dir is None else cache_path(cache_dir, paths, edges, relative_accuracy)
+    if cached is not None and os.path.exists(cached):
+        with open(cached, 'rb') as f:
+            return pickle.load(f)
+
+    histogram, sketch = Histogram(edges), QuantileSketch(relative_accuracy)
+    read = partial(source_distribution, edges=edges, shape=shape, relative_accuracy=relative_accuracy,
+                   rows_per_chunk=rows_per_chunk)
+    with file_pool(workers) as executor:
+        for path, (result, error) in map_files(read, paths, executor):
+            if error is not None:
+                raise RuntimeError(f"failed to read {path}") from error
+            histogram.merge(result[0])
+            sketch.merge(result[1])
+
+    if cached is not None:
+        atomic_write(cached, pickle.dumps((histogram, sketch)))
+    return histogram, sketch
+
+# grids (.npy/.pkl) as they are, folders of daily binaries as their dates in [start, end]
+def expand_sources(sources, start=None, end=None):
+    paths = []
+    for source in sources:
+        paths.extend(daily_paths(source, start, end).values() if os.path.isdir(source) else [source])
+    return paths
+
+if __name__ == "__main__":
+    from visualize_bin import plot_histogram
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sources', nargs='+', help="grids (.npy/.pkl) and/or <product>/<year> folders of daily binaries")
+    parser.add_argument('--mission', default=None, choices=MISSION_GRIDS.keys(), help="grid of the daily binaries")
+    parser.add_argument('--level', default='5km', choices=PYRAMID_LEVELS.keys(), help="pyramid level of the daily binaries")
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    edges = parser.add_mutually_exclusive_group(required=True)
+    edges.add_argument('--range', nargs=3, type=float, metavar=('MIN', 'MAX', 'BIN_SIZE'), help="linear bins")
+    edges.add_argument('--log-range', nargs=2, type=float, metavar=('MIN', 'MAX'), help="log-spaced bins")
+    parser.add_argument('--bins-per-decade', type=int, default=20)
+    parser.add_argument('--accuracy', type=float, default=0.01, help="relative accuracy of the quantiles")
+    parser.add_argument('--quantiles', nargs='*', type=float, default=[0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--output', default=None, help="histogram figure to write")
+    parser.add_argument('--title', default='Distribution of Values')
+    parser.add_argument('--log-counts', action='store_true', help="log scale counts")
+    args = parser.parse_args()
+
+    shape = None
+    if args.mission is not None:
+        spec = level_spec(MISSION_GRIDS[args.mission], args.level)
+        shape = (spec.n_rows, spec.n_cols)
+    bins = log_edges(*args.log_range, args.bins_per_decade) if args.log_range else linear_edges(*args.range)
+
+    paths = expand_sources(args.sources, args.start, args.end)
+    histogram, sketch = distribution(paths, bins, shape, args.accuracy, args.workers,
+                                     None if args.no_cache else args.cache_dir)
+
+    print(f"{histogram.n} values from {len(paths)} sources, min {histogram.min:.6g}, max {histogram.max:.6g}, "
+          f"mean {histogram.mean():.6g}, {histogram.underflow} below and {histogram.overflow} above the bins")
+    for q, value in sketch.quantiles(args.quantiles).items():
+        print(f"  q{q:<5g} {value:.6g}")
+
+    if args.output is not None:
+        plot_histogram(histogram, args.title, args.output, args.log_counts, log_x=args.log_range is not None)
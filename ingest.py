@@ -0,0 +1,305 @@
+import argparse, re, time
+from collections import namedtuple
+from contextlib import nullcontext
+from functools import partial
+from pathlib import Path
+from manifest import Manifest
+from quarantine import Quarantine
+from daily_binaries import write_pyramid
+from grid_io import PRODUCT_UNITS, write_grid
+from granules import read_chunks, filename_dates
+from granule_index import GranuleIndex
+from instrument import StageTimer, RunMetrics, peak_rss, profiled
+from gridding import SPIRE_GRID, CYGNSS_GRID, PYRAMID_LEVELS, GridAccumulator, grid_chunks, file_pool, map_files
+
+# Task: one ingestion engine for every mission, driven by a declarative product spec
+# make_grid.py, make_grid_CYGNSS.py, make_binaries_SPIRE.py and make_binaries_CYGNSS.py are thin wrappers around it
+#
+#   python ingest.py CYGNSS daily --workers 16
+#   python ingest.py CYGNSS_QC composite --start 2024-01-25 --end 2024-06-02
+
+# mission:           name used in composite file names (spire_snr_grid.npy, ...)
+# grid:              gridding.GridSpec with the lat origin, shape and resolution
+# products:          output product name -> (NetCDF variable, extra mask function of the chunk or None)
+# quality:           vectorized predicate of the chunk evaluated once per chunk, or None
+# quality_variables: variables the quality predicate needs
+# layout:            how granules are found and dated, see LAYOUTS
+# input_dir:         default root of the raw granules
+# daily_dir:         default root of the daily binaries
+ProductSpec = namedtuple('ProductSpec', ['mission', 'grid', 'products', 'quality', 'quality_variables', 'layout',
+                                         'input_dir', 'daily_dir'])
+
+def cygnss_quality(chunk):
+    quality, quality_2 = chunk['quality_flags'], chunk['quality_flags_2']
+    return ((quality & 1) == 0) | ((quality_2 & 2048) == 0)
+
+# readings with a missing SNR still count, as they did when the masked SNR held its -9999 fill
+def cygnss_low_snr(chunk):
+    return ~(chunk['ddm_snr'] > 2)
+
+# SPIRE granules sit in one folder per date: <input_dir>/YYYYMMDD/*.nc
+def date_folder_granules(input_dir, start=None, end=None):
+    granules = {}
+    for folder in Path(input_dir).iterdir():
+        re_match = re.search(r'(\d{4})(\d{2})(\d{2})', folder.name)
+        if not folder.is_dir() or not re_match:
+            continue
+
+        date = f"{re_match.group(1)}-{re_match.group(2)}-{re_match.group(3)}"
+        # dates outside the window are skipped before listing or opening any granule
+        if (start and date < start) or (end and date > end):
+            continue
+
+        granules[date] = [file for file in folder.iterdir() if file.is_file() and file.suffix == '.nc']
+    return granules
+
+# CYGNSS granules sit in <input_dir>/<year>/<day of year>/*.nc and are dated by the -eYYYYMMDD of their name
+def named_date_granules(input_dir, start=None, end=None):
+    granules = {}
+    for year in Path(input_dir).iterdir():
+        if not year.is_dir():
+            continue
+
+        for folder in year.iterdir():
+            if not folder.is_dir():
+                continue
+
+            for file in folder.iterdir():
+                if not file.is_file() or not file.suffix == '.nc':
+                    continue
+
+                dates = filename_dates(file.name)
+                if dates is None:
+                    continue
+
+                date = dates[1]
+                # granules outside the window are skipped from their name, before they are opened
+                if (start and date < start) or (end and date > end):
+                    continue
+
+                granules.setdefault(date, []).append(file)
+    return granules
+
+LAYOUTS = {
+    'date_folders': date_folder_granules,
+    'named_dates': named_date_granules,
+}
+
+# {date: [files]} from the spec's layout, or from a granule index (granule_index.py) without walking the tree
+# the index also drops the granules whose box misses bbox, so they are never opened
+def find_granules(spec, input_dir, start=None, end=None, bbox=None, index=None):
+    if index is None:
+        return LAYOUTS[spec.layout](input_dir, start, end)
+
+    granule_index = GranuleIndex(index)
+    granules = granule_index.query(spec.mission, start, end, bbox, root=input_dir)
+    granule_index.close()
+    return granules
+
+SPECS = {
+    'SPIRE': ProductSpec(
+        mission='spire', grid=SPIRE_GRID,
+        products={'SNR': ('reflect_snr_at_sp', None), 'reflectivity': ('reflectivity_at_sp', None)},
+        quality=None, quality_variables=[], layout='date_folders',
+        input_dir='/data01/jyin/SPIRE/RAW/2024', daily_dir='/data01/lpu/SPIRE'),
+    # the daily CYGNSS binaries keep every reading; old mss_matchup granules have no reflectivity_peak
+    # and only contribute SNR
+    'CYGNSS': ProductSpec(
+        mission='cygnss', grid=CYGNSS_GRID,
+        products={'SNR': ('ddm_snr', None), 'reflectivity': ('reflectivity_peak', None)},
+        quality=None, quality_variables=[], layout='named_dates',
+        input_dir='/data01/jyin/CYGNSS/data/V3.2', daily_dir='/data01/lpu/CYGNSS'),
+    # quality controlled CYGNSS used for the comparison with SPIRE (formerly make_grid_CYGNSS.py)
+    'CYGNSS_QC': ProductSpec(
+        mission='cygnss', grid=CYGNSS_GRID,
+        products={'SNR': ('ddm_snr', None), 'reflectivity': ('reflectivity_peak', cygnss_low_snr)},
+        quality=cygnss_quality, quality_variables=['quality_flags', 'quality_flags_2'], layout='named_dates',
+        input_dir='/data01/jyin/CYGNSS/data/V3.2', daily_dir='/data01/lpu/CYGNSS_QC'),
+}
+
+# grids one granule into a {product: partial} dict, products missing from the granule are None
+def read_granule(file, spec, bbox=None, timer=None):
+    variables = [variable for variable, _ in spec.products.values()] + list(spec.quality_variables)
+    chunks = read_chunks(file, variables, quality=spec.quality, bbox=bbox, timer=timer)
+    partials = grid_chunks(chunks, spec.grid, {variable: mask for variable, mask in spec.products.values()}, timer)
+    return {product: partials[variable] for product, (variable, _) in spec.products.items()}
+
+# read_granule in a worker, sending back its stage timings and the worker's peak RSS with the partials
+def measured_read_granule(file, spec, bbox=None):
+    timer = StageTimer()
+    partials = read_granule(file, spec, bbox, timer)
+    return partials, timer, peak_rss()
+
+# reads the files (in the executor's processes if any) and reduces their partials in file order
+# a granule that fails to read is reported and skipped; with a quarantine, quarantined granules are not opened,
+# reads are bounded by its timeout (a stuck worker is killed, see gridding.map_files) and retried on transient
+# errors, and failures are recorded in it
+# metrics (an instrument.RunMetrics with a started date) gets the stage timings of every granule
+def grid_files(spec, files, executor=None, bbox=None, accumulators=None, quarantine=None, metrics=None):
+    if accumulators is None:
+        accumulators = {product: GridAccumulator(spec.grid) for product in spec.products}
+
+    timeout, retries = None, 0
+    if quarantine is not None:
+        files = quarantine.filter(files)
+        timeout, retries = quarantine.timeout, quarantine.retries
+
+    read = partial(read_granule if metrics is None else measured_read_granule, spec=spec, bbox=bbox)
+    start = time.perf_counter()
+    for j, (file, (result, error)) in enumerate(map_files(read, files, executor, timeout=timeout, retries=retries)):
+        if (j % 250 == 0):
+            print(f"- Reading file #{j} ({j / max(time.perf_counter() - start, 1e-9):.1f} granules/s)")
+
+        if error is not None:
+            print(f"- Failed to read {Path(file).as_posix()}: {error!r}")
+            if quarantine is not None:
+                quarantine.record(file, error)
+            if metrics is not None:
+                metrics.add_failure()
+            continue
+
+        if quarantine is not None:
+            quarantine.release(file)
+
+        partials = result
+        if metrics is not None:
+            partials, timer, rss = result
+            metrics.add_granule(timer, rss)
+
+        with metrics.stage('reduce') if metrics is not None else nullcontext():
+            for product, product_partial in partials.items():
+                accumulators[product].add(product_partial)
+
+    return accumulators
+
+# what a date's binaries depend on besides its granules, a date built with other daily_params is not up to date
+# the products are compared by variable and mask names and the quality predicate by its name, so are the pyramid
+# levels written next to the 5km base and the dense/sparse format, a rerun that asks for another level or format
+# rebuilds the date
+def daily_params(spec, bbox=None, levels=(), sparse=False):
+    return {
+        'products': {product: [variable, mask and mask.__name__] for product, (variable, mask) in spec.products.items()},
+        'quality': spec.quality and spec.quality.__name__,
+        'bbox': None if bbox is None else [float(value) for value in bbox],
+        'levels': sorted(level for level in set(levels) if PYRAMID_LEVELS[level] > 1),
+        'sparse': bool(sparse),
+    }
+
+# one binary per date and product plus their counts, skipping dates the manifest says are up to date
+# every requested pyramid level is aggregated from the same day's sums and counts in the same pass
+def build_daily(spec, input_dir, output_dir, start=None, end=None, workers=1, bbox=None, manifest_path=None,
+                force=False, verify=False, levels=(), sparse=False, index=None, quarantine=None, metrics=None):
+    granules = find_granules(spec, input_dir, start, end, bbox, index)
+    manifest = Manifest(manifest_path or f"{output_dir}/manifest_{spec.mission.upper()}.json")
+    quarantine = quarantine or Quarantine(f"{output_dir}/quarantine_{spec.mission.upper()}.json")
+    metrics = metrics or RunMetrics(f"{output_dir}/metrics_{spec.mission.upper()}.jsonl", spec.mission)
+    params = daily_params(spec, bbox, levels, sparse)
+
+    try:
+        with file_pool(workers) as executor:
+            for date in sorted(granules):
+                if not force and manifest.is_current(date, granules[date], verify=verify, params=params):
+                    print(f"Skipping date {date} (up to date)")
+                    continue
+
+                print(f"Processing date {date}")
+                unresolved = len(quarantine.unresolved)
+                metrics.start_date(date)
+                accumulators = grid_files(spec, granules[date], executor, bbox, quarantine=quarantine, metrics=metrics)
+
+                # daily means go to <output_dir>/<product>/<year>/<date>.dat and their counts to <product>_count,
+                # pyramid levels to <product>_<level> and <product>_<level>_count; sparse days are one <date>.sdat each
+                outputs = {}
+                with metrics.stage('write'):
+                    for product, accumulator in accumulators.items():
+                        outputs.update(write_pyramid(accumulator, output_dir, product, date, levels, sparse))
+                metrics.add_outputs(outputs)
+                metrics.end_date()
+
+                # a date missing granules to transient errors is written but not recorded, so the next run redoes it
+                if len(quarantine.unresolved) == unresolved:
+                    manifest.record(date, granules[date], outputs, params)
+    finally:
+        manifest.flush()
+    print(quarantine.summary())
+
+# one mean grid per product over every granule in [start, end], written as <mission>_<product>_grid.npy (see grid_io.py)
+# coarser levels go next to it as <mission>_<product>_grid_<level>.npy
+# the metrics get one line per date and a last 'composite' line for the grids
+def build_composite(spec, input_dir, output_dir, start=None, end=None, workers=1, bbox=None, levels=(), index=None,
+                    quarantine=None, metrics=None):
+    granules = find_granules(spec, input_dir, start, end, bbox, index)
+    accumulators = {product: GridAccumulator(spec.grid) for product in spec.products}
+    quarantine = quarantine or Quarantine(f"{output_dir}/quarantine_{spec.mission.upper()}.json")
+    metrics = metrics or RunMetrics(f"{output_dir}/metrics_{spec.mission.upper()}.jsonl", spec.mission)
+
+    with file_pool(workers) as executor:
+        for date in sorted(granules):
+            print(f"Processing date {date}")
+            metrics.start_date(date)
+            grid_files(spec, granules[date], executor, bbox, accumulators, quarantine, metrics)
+            metrics.end_date()
+    print(quarantine.summary())
+
+    metrics.start_date('composite')
+    outputs = {}
+    with metrics.stage('write'):
+        for product, accumulator in accumulators.items():
+            provenance = {'mission': spec.mission, 'product': product, 'variable': spec.products[product][0],
+                          'input_dir': str(input_dir), 'start': start, 'end': end, 'dates': len(granules),
+                          'granules': sum(len(files) for files in granules.values())}
+            grids = {'': accumulator}
+            levels_above = [level for level in levels if PYRAMID_LEVELS[level] > 1]
+            grids.update({f"_{level}": coarse for level, coarse in accumulator.pyramid(levels_above).items()})
+            for suffix, grid in grids.items():
+                outputs[product + suffix] = write_grid(f"{output_dir}/{spec.mission}_{product.lower()}_grid{suffix}.npy",
+                                                       grid.mean(), PRODUCT_UNITS.get(product.lower()),
+                                                       lat_min=spec.grid.lat_min, provenance=provenance)
+    metrics.add_outputs(outputs)
+    metrics.end_date()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spec', choices=SPECS.keys())
+    parser.add_argument('output', choices=['daily', 'composite'])
+    parser.add_argument('--workers', type=int, default=1, help="processes reading files in parallel (1 = serial)")
+    parser.add_argument('--input-dir', default=None, help="defaults to the spec's raw data folder")
+    parser.add_argument('--output-dir', default=None, help="defaults to the spec's daily folder, or /data01/lpu for composites")
+    parser.add_argument('--start', default=None, help="first date (YYYY-MM-DD) to grid")
+    parser.add_argument('--end', default=None, help="last date (YYYY-MM-DD) to grid")
+    parser.add_argument('--bbox', type=float, nargs=4, default=None, metavar=('LATMIN', 'LATMAX', 'LONMIN', 'LONMAX'),
+                        help="only grid readings inside this box")
+    parser.add_argument('--manifest', default=None, help="defaults to <output-dir>/manifest_<MISSION>.json")
+    parser.add_argument('--force', action='store_true', help="rebuild every date even if it is up to date")
+    parser.add_argument('--verify', action='store_true', help="re-hash existing outputs before skipping a date")
+    parser.add_argument('--levels', nargs='*', default=['10km', '25km', '1deg'], choices=PYRAMID_LEVELS.keys(),
+                        help="coarser pyramid levels written next to the 5km grids (none with an empty --levels)")
+    parser.add_argument('--sparse', action='store_true',
+                        help="write daily .sdat files (filled cells only, see sparse_daily.py) instead of dense .dat grids")
+    parser.add_argument('--index', default=None,
+                        help="find granules in this granule_index.py database instead of walking the input folder")
+    parser.add_argument('--quarantine', default=None, help="defaults to <output-dir>/quarantine_<MISSION>.json")
+    parser.add_argument('--timeout', type=float, default=600, help="seconds a granule may take to read (0 = no limit)")
+    parser.add_argument('--retries', type=int, default=2, help="retries of a read failing with a transient I/O error")
+    parser.add_argument('--retry-quarantined', action='store_true', help="open quarantined granules again")
+    parser.add_argument('--metrics', default=None, help="JSON lines of per-date timings and throughput, "
+                                                        "defaults to <output-dir>/metrics_<MISSION>.jsonl")
+    parser.add_argument('--profile', default=None, help="write a cProfile of the run here (use with --workers 1)")
+    args = parser.parse_args(argv)
+
+    spec = SPECS[args.spec]
+    input_dir = args.input_dir or spec.input_dir
+    output_dir = args.output_dir or (spec.daily_dir if args.output == 'daily' else '/data01/lpu')
+    quarantine = Quarantine(args.quarantine or f"{output_dir}/quarantine_{spec.mission.upper()}.json",
+                            args.timeout, args.retries, args.retry_quarantined)
+    metrics = RunMetrics(args.metrics or f"{output_dir}/metrics_{spec.mission.upper()}.jsonl", spec.mission)
+
+    if args.output == 'daily':
+        profiled(args.profile, build_daily, spec, input_dir, output_dir, args.start, args.end, args.workers, args.bbox,
+                 args.manifest, args.force, args.verify, args.levels, args.sparse, args.index, quarantine, metrics)
+    else:
+        profiled(args.profile, build_composite, spec, input_dir, output_dir, args.start, args.end, args.workers,
+                 args.bbox, args.levels, args.index, quarantine, metrics)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import json, os, resource, time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+# Task: tell where a gridding run spends its time (NetCDF decode, masking, binning, reduction or writes)
+# the readers take an optional StageTimer that sums the seconds of each stage and counts samples and bytes; worker
+# processes send theirs back with each granule and RunMetrics folds them into one JSON line per date
+#
+#   decode: netCDF4 hyperslab reads and fill value handling        (workers)
+#   mask:   quality, bbox, cell index and validity masks           (workers)
+#   bin:    np.unique/np.bincount of the compact (cell, value)s    (workers)
+#   reduce: adding the granule partials to the date's accumulators (parent)
+#   write:  daily binaries and pyramid levels                      (parent)
+#
+# worker stage seconds are summed over processes, so with --workers N they can add up to N times the wall time
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = Counter()
+        self.counts = Counter()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - start
+
+    def count(self, name, n):
+        self.counts[name] += int(n)
+
+    def merge(self, other):
+        self.seconds.update(other.seconds)
+        self.counts.update(other.counts)
+
+# `with stage(timer, 'decode'):` for code that runs with or without a timer
+def stage(timer, name):
+    return nullcontext() if timer is None else timer.stage(name)
+
+# peak resident set of this process in bytes (ru_maxrss is in kilobytes on Linux)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class RunMetrics:
+    # path is the JSON lines file records are appended to, None only prints them
+    def __init__(self, path=None, mission=None):
+        self.path = None if path is None else str(path)
+        self.mission = mission
+        self.timer = None
+
+    def start_date(self, date):
+        self.date = date
+        self.timer = StageTimer()
+        self.granules = 0
+        self.failed = 0
+        self.worker_rss = 0
+        self.start = time.perf_counter()
+
+    # a granule's StageTimer from the worker that read it, with the worker's peak RSS
+    def add_granule(self, timer, rss):
+        self.granules += 1
+        self.timer.merge(timer)
+        self.worker_rss = max(self.worker_rss, rss)
+
+    def add_failure(self):
+        self.failed += 1
+
+    def stage(self, name):
+        return self.timer.stage(name)
+
+    # outputs maps a product to (path, sha256) like daily_binaries.write_pyramid returns
+    def add_outputs(self, outputs):
+        self.timer.count('bytes_written', sum(os.path.getsize(path) for path, _ in outputs.values()))
+
+    def end_date(self):
+        wall = time.perf_counter() - self.start
+        counts = self.timer.counts
+        record = {
+            'mission': self.mission,
+            'date': self.date,
+            'granules': self.granules,
+            'failed': self.failed,
+            'samples': counts['samples'],
+            'wall_s': round(wall, 3),
+            'granules_per_s': round(self.granules / wall, 3) if wall > 0 else None,
+            'samples_per_s': round(counts['samples'] / wall, 1) if wall > 0 else None,
+            'file_bytes': counts['file_bytes'],
+            'bytes_decoded': counts['bytes_decoded'],
+            'bytes_written': counts['bytes_written'],
+            'stages_s': {name: round(seconds, 3) for name, seconds in sorted(self.timer.seconds.items())},
+            'peak_rss_bytes': peak_rss(),
+            'worker_peak_rss_bytes': self.worker_rss,
+        }
+
+        print(f"- {record['granules']} granules in {wall:.1f}s ({record['granules_per_s']} granules/s, "
+              f"{record['samples_per_s']} samples/s), stages: "
+              + ', '.join(f"{name} {seconds:.1f}s" for name, seconds in record['stages_s'].items()))
+
+        if self.path is not None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        return record
+
+# runs function(*args) under cProfile and dumps the stats to path (read them with python -m pstats <path>)
+# with worker processes the profile only covers the parent, profile with --workers 1 to see the reads
+def profiled(path, function, *args):
+    if path is None:
+        return function(*args)
+
+    import cProfile
+    profile = cProfile.Profile()
+    try:
+        return profile.runcall(function, *args)
+    finally:
+        profile.dump_stats(path)
+        print(f"Profile written to {path}")
@@ -0,0 +1,100 @@
+import json, os, hashlib, time
+
+# Task: keep track of which daily binaries are up to date so make_binaries_*.py can resume after a crash
+# the manifest maps each date to the signature (path, mtime, size) of its input granules, the parameters of the run
+# that built it (products, bbox, ...) and the sha256 of its outputs
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [str(path), stat.st_mtime_ns, stat.st_size]
+
+def inputs_signature(files):
+    return sorted(file_signature(file) for file in files)
+
+def file_sha256(path, block_size=1 << 24):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# writes into a temp file next to the target and renames it over the target, so a killed job never
+# leaves a half written binary behind; returns the sha256 of what was written
+def atomic_write(path, data):
+    path = str(path)
+    directory, name = os.path.split(path)
+    # opened with open() rather than mkstemp so the binary gets the usual umask permissions
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    os.makedirs(directory or '.', exist_ok=True)
+
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    return hashlib.sha256(data).hexdigest()
+
+# numpy arrays are written with the same raw layout as ndarray.tofile
+def atomic_tofile(grid, path):
+    return atomic_write(path, memoryview(grid).cast('B'))
+
+class Manifest:
+    # rewriting the whole manifest costs dates x granules, so record only saves it every save_interval seconds;
+    # callers flush() when they are done (also on errors), a crash loses at most save_interval seconds of dates
+    def __init__(self, path, save_interval=60):
+        self.path = str(path)
+        self.save_interval = save_interval
+        self.dates = {}
+        self.dirty = False
+        self.last_save = time.monotonic()
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.dates = json.load(f)['dates']
+
+    # a date is current when its granules are unchanged, it was built with the same params (any JSON value) and every
+    # output still exists with the recorded hash; entries recorded without params only match params=None
+    # hashing 100 MB outputs is slow, so by default only their existence and size are checked
+    def is_current(self, date, files, verify=False, params=None):
+        entry = self.dates.get(date)
+        if entry is None or entry['inputs'] != inputs_signature(files):
+            return False
+        if entry.get('params') != json.loads(json.dumps(params)):
+            return False
+
+        for output in entry['outputs'].values():
+            if not os.path.exists(output['path']) or os.path.getsize(output['path']) != output['size']:
+                return False
+            if verify and file_sha256(output['path']) != output['sha256']:
+                return False
+
+        return True
+
+    # outputs maps a product name (SNR, reflectivity, ...) to (path, sha256)
+    def record(self, date, files, outputs, params=None):
+        self.dates[date] = {
+            'inputs': inputs_signature(files),
+            'params': json.loads(json.dumps(params)),
+            'outputs': {
+                name: {'path': str(path), 'size': os.path.getsize(path), 'sha256': sha256}
+                for name, (path, sha256) in outputs.items()
+            },
+        }
+        self.dirty = True
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self.save()
+
+    def save(self):
+        atomic_write(self.path, json.dumps({'dates': self.dates}).encode())
+        self.dirty = False
+        self.last_save = time.monotonic()
+
+    def flush(self):
+        if self.dirty:
+            self.save()
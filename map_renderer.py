@@ -0,0 +1,149 @@
+from collections import OrderedDict
+import numpy as np
+import matplotlib.pyplot as plt
+from mpl_toolkits.basemap import Basemap
+
+# Task: draw grids over an Earth map without meshgrids or a pcolormesh of every cell
+# the grid is drawn as one imshow image placed by its lon/lat extent (the 'cyl' projection is plain lon/lat), cropped
+# to the map and block averaged down to the figure's pixels; the Basemap, coastlines, countries and graticule of an
+# extent are drawn once and reused by every map with that extent, only the image, colorbar, title and text change
+
+FILL_VALUE = -9999
+
+# mean of the valid (non -9999) cells of every factor x factor block, NaN where a block has none
+def downsample(grid, factor):
+    if factor <= 1:
+        return np.where(grid == FILL_VALUE, np.nan, grid).astype(np.float32)
+
+    rows, cols = grid.shape[0] // factor, grid.shape[1] // factor
+    blocks = np.asarray(grid[:rows * factor, :cols * factor]).reshape(rows, factor, cols, factor)
+    valid = blocks != FILL_VALUE
+    sums = np.sum(blocks, axis=(1, 3), where=valid, dtype=np.float64)
+    counts = valid.sum(axis=(1, 3))
+
+    with np.errstate(invalid='ignore'):
+        return (sums / counts).astype(np.float32)
+
+class MapRenderer:
+    # max_cached bounds the number of open figures (one per map extent), the least recently used one is closed
+    def __init__(self, figsize=(12, 8), dpi=300, cmap='viridis', downsample=True, max_cached=4):
+        self.figsize = figsize
+        self.dpi = dpi
+        self.cmap = cmap
+        self.downsample = downsample
+        self.max_cached = max_cached
+        self._bases = OrderedDict()
+
+    # (fig, ax, basemap, colorbar holder) of an extent, drawn on first use
+    def _base(self, extent):
+        if extent in self._bases:
+            self._bases.move_to_end(extent)
+            return self._bases[extent]
+
+        lonmin, lonmax, latmin, latmax = extent
+        fig, ax = plt.subplots(figsize=self.figsize)
+
+        # the Basemap library adds a map of the Earth for easy viewing
+        m = Basemap(projection='cyl', llcrnrlat=latmin, urcrnrlat=latmax,
+                    llcrnrlon=lonmin, urcrnrlon=lonmax, resolution='c', ax=ax)
+
+        m.drawcoastlines(linewidth=0.5)
+        m.drawcountries(linewidth=0.5)
+
+        m.drawparallels(np.arange(-90, 91, 20), labels=[1, 0, 0, 0])  # Latitude lines
+        m.drawmeridians(np.arange(0, 361, 20), labels=[0, 0, 0, 1])   # Longitude lines
+
+        base = {'fig': fig, 'ax': ax, 'map': m, 'colorbar': None}
+        self._bases[extent] = base
+
+        if len(self._bases) > self.max_cached:
+            _, evicted = self._bases.popitem(last=False)
+            plt.close(evicted['fig'])
+
+        return base
+
+    # the rows/cols of the grid inside the map and their extent, so region maps only touch their own cells
+    def _crop(self, grid, grid_extent, extent):
+        g_lonmin, g_lonmax, g_latmin, g_latmax = grid_extent
+        lonmin, lonmax, latmin, latmax = extent
+        lon_res = (g_lonmax - g_lonmin) / grid.shape[1]
+        lat_res = (g_latmax - g_latmin) / grid.shape[0]
+
+        col0 = max(0, int(np.floor((lonmin - g_lonmin) / lon_res)))
+        col1 = min(grid.shape[1], int(np.ceil((lonmax - g_lonmin) / lon_res)))
+        row0 = max(0, int(np.floor((latmin - g_latmin) / lat_res)))
+        row1 = min(grid.shape[0], int(np.ceil((latmax - g_latmin) / lat_res)))
+
+        cropped_extent = (g_lonmin + col0 * lon_res, g_lonmin + col1 * lon_res,
+                          g_latmin + row0 * lat_res, g_latmin + row1 * lat_res)
+        return grid[row0:row1, col0:col1], cropped_extent
+
+    # factor so that the image keeps at least one cell per pixel of the axes
+    # the map keeps equal lon/lat scales, so it is limited by whichever side of the axes box it fills
+    def _factor(self, ax, image_shape):
+        bbox = ax.get_window_extent()
+        width, height = bbox.width * self.dpi / ax.figure.dpi, bbox.height * self.dpi / ax.figure.dpi
+        return max(1, int(max(image_shape[1] / max(width, 1), image_shape[0] / max(height, 1))))
+
+    # grid rows go from south (row 0) to north, grid_extent is its (lonmin, lonmax, latmin, latmax) and extent the map's
+    # grid may also be a function returning the grid, so batches only hold one grid in memory at a time
+    def render(self, grid, title, label, file_name, vmin, vmax, extent, grid_extent=None, stats=None):
+        if callable(grid):
+            grid = grid()
+
+        base = self._base(tuple(extent))
+        fig, ax, m = base['fig'], base['ax'], base['map']
+
+        image, image_extent = self._crop(grid, grid_extent or extent, extent)
+        factor = self._factor(ax, image.shape) if self.downsample else 1
+        if factor > 1:
+            # downsample drops the partial blocks of the last rows and columns, the image only spans the whole ones
+            lonmin, lonmax, latmin, latmax = image_extent
+            rows, cols = image.shape
+            image_extent = (lonmin, lonmin + (lonmax - lonmin) * (cols // factor * factor) / cols,
+                            latmin, latmin + (latmax - latmin) * (rows // factor * factor) / rows)
+        image = np.ma.masked_invalid(downsample(image, factor))
+
+        # extent is (left, right, bottom, top) and origin='lower' puts row 0 at the bottom, i.e. the south
+        cs = ax.imshow(image, extent=image_extent, origin='lower', interpolation='nearest',
+                       cmap=self.cmap, vmin=vmin, vmax=vmax)
+        ax.set_xlim(extent[0], extent[1])
+        ax.set_ylim(extent[2], extent[3])
+
+        # the colorbar axes is made once per extent and pointed at the new image afterwards
+        if base['colorbar'] is None:
+            base['colorbar'] = m.colorbar(cs, location='right', pad="5%")
+        else:
+            base['colorbar'].update_normal(cs)
+        base['colorbar'].set_label(label)
+
+        ax.set_title(title)
+
+        text = None
+        if stats:
+            bias, rmsd, corr = stats
+            textstr = '\n'.join((
+                f"Bias: {bias:.4f}",
+                f"RMSD: {rmsd:.4f}",
+                f"Correlation: {corr:.4f}"
+            ))
+            props = dict(boxstyle='round', facecolor='white', alpha=0.7)
+            text = ax.text(0.05, 0.05, textstr, transform=ax.transAxes, fontsize=10,
+                           verticalalignment='bottom', bbox=props)
+
+        fig.savefig(file_name, dpi=self.dpi, bbox_inches='tight')
+
+        # only this map's artists go, the base stays for the next map with the same extent
+        cs.remove()
+        if text is not None:
+            text.remove()
+
+    # renders a list of render() keyword dicts, grouped by extent so every base is drawn once
+    def render_batch(self, maps):
+        for kwargs in sorted(maps, key=lambda kwargs: tuple(kwargs['extent'])):
+            self.render(**kwargs)
+
+    def close(self):
+        for base in self._bases.values():
+            plt.close(base['fig'])
+        self._bases.clear()
@@ -0,0 +1,80 @@
+import json, os
+from collections import Counter
+from pathlib import Path
+from manifest import atomic_write, file_signature
+from gridding import ReadTimeout, is_transient
+
+# Task: keep one bad granule from costing a long ingestion run
+# granules that fail to read for a reason that will not go away (corrupt file) are written to a quarantine list
+# with the signature (path, mtime, size) they had, and later runs skip them without opening them;
+# a quarantined granule is tried again once it is replaced (its signature changes) or with --retry-quarantined
+# transient I/O errors and timeouts (a slow mount) are not quarantined, their dates are left out of the manifest so
+# the next run redoes them
+
+# the file's signature, None once it is gone (deleted or moved while the run was going)
+def current_signature(file):
+    try:
+        return file_signature(file)
+    except FileNotFoundError:
+        return None
+
+class Quarantine:
+    def __init__(self, path, timeout=None, retries=2, retry_quarantined=False):
+        self.path = str(path)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_quarantined = retry_quarantined
+        self.files = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.files = json.load(f)['files']
+
+        # this run's error types, quarantined and skipped granules and granules to read again next run
+        self.errors = Counter()
+        self.added = []
+        self.skipped = []
+        self.unresolved = []
+
+    def is_quarantined(self, file):
+        entry = self.files.get(str(file))
+        return entry is not None and not self.retry_quarantined and entry['signature'] == current_signature(file)
+
+    # the files worth opening, quarantined ones are counted and left out
+    def filter(self, files):
+        kept = []
+        for file in files:
+            if self.is_quarantined(file):
+                self.skipped.append(str(file))
+            else:
+                kept.append(file)
+        return kept
+
+    # a granule that vanished mid-run has no signature to quarantine, it is left for the next run like a transient error
+    def record(self, file, error):
+        self.errors[type(error).__name__] += 1
+        signature = current_signature(file)
+        if is_transient(error) or isinstance(error, ReadTimeout) or signature is None:
+            self.unresolved.append(str(file))
+            return
+
+        self.files[str(file)] = {'signature': signature, 'error': repr(error), 'type': type(error).__name__}
+        self.added.append(str(file))
+        self.save()
+
+    # a quarantined granule that now reads fine (after --retry-quarantined) leaves the list
+    def release(self, file):
+        if self.files.pop(str(file), None) is not None:
+            self.save()
+
+    def save(self):
+        atomic_write(self.path, json.dumps({'files': self.files}, indent=1).encode())
+
+    def summary(self):
+        lines = [f"Read errors: {sum(self.errors.values())}"]
+        lines += [f"- {name}: {count}" for name, count in self.errors.most_common()]
+        lines.append(f"Quarantined this run: {len(self.added)}, skipped as quarantined: {len(self.skipped)}, "
+                     f"left for the next run (transient errors and timeouts): {len(self.unresolved)}")
+        lines += [f"- quarantined {Path(file).as_posix()}: {self.files[file]['error']}" for file in self.added]
+        lines.append(f"Quarantine list: {self.path} ({len(self.files)} granules)")
+        return '\n'.join(lines)
@@ -1,75 +1,169 @@
-import pickle
+import math, argparse
 import numpy as np
 from tqdm import tqdm
-from pathlib import Path
-from sklearn.linear_model import LinearRegression
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error, r2_score
+from gridding import CYGNSS_GRID, pick_level
+from daily_binaries import SPIRE_SHAPE, CYGNSS_SHAPE, SPIRE_CYGNSS_ROWS, pair_dates, open_stack, rows_for_memory, iter_tiles, \
+    level_shape, level_rows, level_directory
+from grid_io import write_grid
 
 SPIRE_BINARIES = '/data01/lpu/SPIRE/reflectivity/2024'
 CYGNSS_BINARIES = '/data01/lpu/CYGNSS/reflectivity/2024'
 start_date, end_date = '2024-01-25', '2024-06-02'
 
-def grab_data():
-    spire_data, cygnss_data = [], []
+REGRESSION_GRIDS = ['slope', 'intercept', 'mse', 'rmse', 'r2']
 
-    for i, file in tqdm(enumerate(Path(SPIRE_BINARIES).iterdir()), desc="Grabbing data"):
-        spire_grid = np.fromfile(file.as_posix(), dtype=np.float32)
-        spire_grid = spire_grid.reshape((3600, 7200))[900:2700, :]
-        spire_data.append(spire_grid)
+# rough bytes fit_tile needs per (date, pixel): the two float32 tiles, their float64 copies and the temporaries
+FIT_BYTES_PER_VALUE = 64
 
-        path = f"{CYGNSS_BINARIES}/{file.name}"
-        cygnss_grid = np.fromfile(path, dtype=np.float32)
-        cygnss_grid = cygnss_grid.reshape((1800, 7200))
-        cygnss_data.append(cygnss_grid)
+# (SPIRE, CYGNSS) binary paths of the dates both missions have, the ones missing from either are reported and left out
+# level picks the pyramid level binaries next to the given 5km folders (e.g. reflectivity_25km/2024)
+def paired_paths(spire_dir=SPIRE_BINARIES, cygnss_dir=CYGNSS_BINARIES, start=start_date, end=end_date, level='5km'):
+    spire_dir, cygnss_dir = level_directory(spire_dir, level), level_directory(cygnss_dir, level)
+    dates, pairs, missing_spire, missing_cygnss = pair_dates(spire_dir, cygnss_dir, start, end)
 
-    spire_data = np.array(spire_data)
-    cygnss_data = np.array(cygnss_data)
+    if missing_spire:
+        print(f"Dates missing from SPIRE ({len(missing_spire)}): {', '.join(missing_spire)}")
+    if missing_cygnss:
+        print(f"Dates missing from CYGNSS ({len(missing_cygnss)}): {', '.join(missing_cygnss)}")
 
-    print("SPIRE Shape: ", spire_data.shape)
-    print("CYGNSS Shape: ", cygnss_data.shape)
+    return dates, pairs
+
+# memory maps every daily binary instead of reading them, SPIRE is cropped to the CYGNSS latitudes as a view
+def grab_data(spire_dir=SPIRE_BINARIES, cygnss_dir=CYGNSS_BINARIES, start=start_date, end=end_date, level='5km'):
+    dates, pairs = paired_paths(spire_dir, cygnss_dir, start, end, level)
+
+    spire_data = open_stack([spire for spire, _ in pairs], level_shape(SPIRE_SHAPE, level), level_rows(SPIRE_CYGNSS_ROWS, level))
+    cygnss_data = open_stack([cygnss for _, cygnss in pairs], level_shape(CYGNSS_SHAPE, level))
+
+    print(f"Paired dates: {len(dates)}")
 
     return spire_data, cygnss_data
 
+# train_test_split(test_size=0.2, random_state=42) reseeds its RandomState for every pixel, so which of a pixel's
+# valid samples end up in the test set only depends on how many valid samples it has
+# row n of the tables marks the training / test positions (in time order) for a pixel with n valid samples
+def holdout_tables(n_max, test_size=0.2, random_state=42):
+    train_table = np.zeros((n_max + 1, max(n_max, 1)), dtype=bool)
+    test_table = np.zeros((n_max + 1, max(n_max, 1)), dtype=bool)
+
+    for n in range(2, n_max + 1):
+        # same sizes and permutation as sklearn's ShuffleSplit
+        n_test = math.ceil(test_size * n)
+        n_train = math.floor((1 - test_size) * n)
+        permutation = np.random.RandomState(random_state).permutation(n)
+        test_table[n, permutation[:n_test]] = True
+        train_table[n, permutation[n_test:n_test + n_train]] = True
+
+    return train_table, test_table
+
+# closed form OLS of CYGNSS on SPIRE for every pixel of a (time, rows, cols) tile at once
+# fits use masked sums over the training samples and the scores use the held out samples, like the old sklearn loop
+def fit_tile(spire_tile, cygnss_tile, train_table, test_table):
+    valid = (spire_tile != -9999) & (cygnss_tile != -9999)
+    n_valid = valid.sum(axis=0)
+    rank = np.cumsum(valid, axis=0, dtype=np.int32) - 1
+
+    train = valid & train_table[n_valid[None], rank]
+    test = valid & test_table[n_valid[None], rank]
+
+    x = spire_tile.astype(np.float64)
+    y = cygnss_tile.astype(np.float64)
+
+    n = train.sum(axis=0)
+    sum_x = np.sum(x, axis=0, where=train)
+    sum_y = np.sum(y, axis=0, where=train)
+    sum_xy = np.sum(x * y, axis=0, where=train)
+    sum_xx = np.sum(x * x, axis=0, where=train)
+
+    fitted = n_valid >= 2
+    n_safe = np.maximum(n, 1)
+
+    # a pixel whose training x values are all equal has no slope, sklearn's lstsq returns 0 for it
+    sxx = sum_xx - sum_x * sum_x / n_safe
+    sxy = sum_xy - sum_x * sum_y / n_safe
+    degenerate = sxx <= 1e-12 * np.maximum(sum_xx, np.finfo(np.float64).tiny)
+    slope = np.where(degenerate, 0.0, sxy / np.where(degenerate, 1.0, sxx))
+    intercept = (sum_y - slope * sum_x) / n_safe
+
+    n_test = test.sum(axis=0)
+    n_test_safe = np.maximum(n_test, 1)
+    residual = y - (intercept + slope * x)
+    mse = np.sum(residual * residual, axis=0, where=test) / n_test_safe
+
+    # r2_score of the test set: undefined below 2 samples, and 1 or 0 when the test targets are constant
+    mean_y_test = np.sum(y, axis=0, where=test) / n_test_safe
+    ss_tot = np.sum((y - mean_y_test) ** 2, axis=0, where=test)
+    ss_res = mse * n_test
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.where(ss_res == 0, 1.0, 0.0))
+
+    grids = {
+        'slope': slope,
+        'intercept': intercept,
+        'mse': mse,
+        'rmse': np.sqrt(mse),
+        'r2': r2,
+    }
+    for name, grid in grids.items():
+        missing = ~fitted if name != 'r2' else ~fitted | (n_test < 2)
+        grids[name] = np.where(missing, -9999, grid).astype(np.float32)
+    grids['count'] = np.where(fitted, n_valid, 0).astype(np.int32)
+
+    return grids
+
+# fits every pixel of the stacks (lists of per-date grids or (time, lat, lon) arrays), streaming chunk_rows
+# latitude rows at a time so only one tile of every date is in memory
+def fit_stack(spire_data, cygnss_data, chunk_rows=16):
+    n_time = len(spire_data)
+    n_rows, n_cols = spire_data[0].shape
+    train_table, test_table = holdout_tables(n_time)
+
+    grids = {name: np.full((n_rows, n_cols), -9999, dtype=np.float32) for name in REGRESSION_GRIDS}
+    grids['count'] = np.zeros((n_rows, n_cols), dtype=np.int32)
+
+    tiles = iter_tiles([spire_data, cygnss_data], chunk_rows)
+    for rows, (spire_tile, cygnss_tile) in tqdm(tiles, total=math.ceil(n_rows / chunk_rows), desc="Fitting data"):
+        tile_grids = fit_tile(spire_tile, cygnss_tile, train_table, test_table)
+        for name, grid in tile_grids.items():
+            grids[name][rows] = grid
+
+    return grids
+
 if __name__ == "__main__":
-    spire_data, cygnss_data = grab_data()
-
-    slope_grid = np.full((1800, 7200), -9999)
-    intercept_grid = np.full((1800, 7200), -9999)
-    mse_grid = np.full((1800, 7200), -9999)
-    rmse_grid = np.full((1800, 7200), -9999)
-
-    for r in tqdm(range(1800), desc="Fitting data"):
-        for c in tqdm(range(7200), desc="Fitting data", leave=False):
-            spire_pixel = spire_data[:, r, c]
-            cygnss_pixel = cygnss_data[:, r, c]
-
-            valid_mask = (spire_pixel != -9999) & (cygnss_pixel != -9999)
-
-            if np.sum(valid_mask) < 2:
-                continue
-
-            X = spire_pixel[valid_mask].reshape(-1, 1)
-            Y = cygnss_pixel[valid_mask]
-
-            X_train, X_test, Y_train, Y_test = train_test_split(X, Y, test_size=0.2, random_state=42)
-
-            model = LinearRegression().fit(X_train, Y_train)
-            slope_grid[r, c] = model.coef_[0]
-            intercept_grid[r, c] = model.intercept_
-
-            # getting model MSE and RMSE for test set
-            predictions = model.predict(X_test)
-            mse_grid[r, c] =  mean_squared_error(Y_test, predictions)
-            rmse_grid[r, c] = np.sqrt(mse_grid[r, c])
-
-    with open('/data01/lpu/slope_grid.pkl', 'wb') as f:
-        pickle.dump(slope_grid, f)
-    with open('/data01/lpu/intercept_grid.pkl', 'wb') as f:
-        pickle.dump(intercept_grid, f)
-    with open('/data01/lpu/r2_grid.pkl', 'wb') as f:
-        pickle.dump(r2_grid, f)
-    with open('/data01/lpu/mse_grid.pkl', 'wb') as f:
-        pickle.dump(mse_grid, f)
-    with open('/data01/lpu/rmse_grid.pkl', 'wb') as f:
-        pickle.dump(rmse_grid, f)
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spire-dir', default=SPIRE_BINARIES)
+    parser.add_argument('--cygnss-dir', default=CYGNSS_BINARIES)
+    parser.add_argument('--start', default=start_date)
+    parser.add_argument('--end', default=end_date)
+    parser.add_argument('--memory-limit', type=float, default=4096,
+                        help="MB used by one tile of the stacks (with --backend dask, by the tiles of all workers)")
+    parser.add_argument('--output-dir', default='/data01/lpu')
+    parser.add_argument('--resolution', type=float, default=0.05,
+                        help="degrees the fit has to resolve, the coarsest pyramid level that does is used")
+    parser.add_argument('--backend', default='numpy', choices=['numpy', 'dask'], help="dask fits the tiles in parallel")
+    parser.add_argument('--scheduler', default='threads', choices=['threads', 'processes'], help="dask scheduler")
+    parser.add_argument('--workers', type=int, default=None, help="dask workers (default every core)")
+    args = parser.parse_args()
+
+    # a 1 degree fit reads 400x fewer values than the 5km one
+    level = pick_level(CYGNSS_GRID, args.resolution)
+    print(f"Fitting the {level} level")
+    if args.backend == 'dask':
+        from dask_backend import fit_stack as dask_fit_stack
+        dates, pairs = paired_paths(args.spire_dir, args.cygnss_dir, args.start, args.end, level)
+        n_dates = len(pairs)
+        grids = dask_fit_stack(pairs, level, args.scheduler, args.workers, args.memory_limit * 2**20)
+    else:
+        spire_data, cygnss_data = grab_data(args.spire_dir, args.cygnss_dir, args.start, args.end, level)
+        n_dates = len(spire_data)
+        chunk_rows = rows_for_memory(n_dates, level_shape(CYGNSS_SHAPE, level)[1], args.memory_limit * 2**20, FIT_BYTES_PER_VALUE)
+        grids = fit_stack(spire_data, cygnss_data, chunk_rows)
+
+    # writes slope_grid.npy, intercept_grid.npy, mse_grid.npy, rmse_grid.npy, r2_grid.npy and count_grid.npy with their
+    # .json sidecars (see grid_io.py), with a _<level> suffix below 5km, e.g. slope_grid_1deg.npy
+    suffix = '' if level == '5km' else f'_{level}'
+    provenance = {'spire_dir': args.spire_dir, 'cygnss_dir': args.cygnss_dir, 'start': args.start, 'end': args.end,
+                  'level': level, 'dates': n_dates}
+    for name, grid in grids.items():
+        write_grid(f'{args.output_dir}/{name}_grid{suffix}.npy', grid, fill_value=0 if name == 'count' else -9999,
+                   lat_min=CYGNSS_GRID.lat_min, provenance=provenance)
@@ -1,31 +1,193 @@
-import torch, glob, os
+import torch, glob, os, json, hashlib
+from pathlib import Path
 from torch.utils.data import Dataset, DataLoader
 import numpy as np
+from daily_binaries import CYGNSS_SHAPE, SPIRE_SHAPE, SPIRE_CYGNSS_ROWS
+from sparse_daily import SparseGrid
+
+# {date: path} of the YYYY-MM-DD.dat binaries of the given years in a folder laid out as <dir>/<year>/<date>.dat
+# sparse <date>.sdat days are picked over dense ones of the same date
+def dated_paths(directory, years):
+    paths = {}
+    for year in years:
+        for pattern in ("*.dat", "*.sdat"):
+            for path in sorted(glob.glob(os.path.join(directory, f"{year}", pattern))):
+                paths[Path(path).stem] = path
+    return paths
 
 class SoilMoistureRetrievalDataset(Dataset):
-    def __init__(self, cygnss_dir, years, smap_paths=None):
-        self.cygnss_paths = []
+    # patch_size=None serves full 1800 x 7200 grids, otherwise patch_size x patch_size patches
+    # patches are taken every `stride` pixels, or at random offsets (patches_per_day per day) if random_patches
+    # patches with less than min_valid_fraction of non -9999 pixels are left out
+    #
+    # with smap_paths (a <year>/<date>.dat folder or a list of daily binaries on the CYGNSS 1800 x 7200 grid) the
+    # dataset serves (inputs, target) samples: inputs stacks CYGNSS reflectivity, CYGNSS SNR and SPIRE reflectivity
+    # (cropped to the CYGNSS latitudes) and target is SMAP, for the dates all four have and the tiles where every
+    # source has enough valid pixels. That index is cached in index_cache so epochs don't re-scan every grid.
+    def __init__(self, cygnss_dir, years, smap_paths=None, patch_size=None, stride=None, random_patches=False,
+                 patches_per_day=32, min_valid_fraction=0.0, seed=None, cygnss_snr_dir=None, spire_dir=None,
+                 index_cache=None):
+        self.patch_size = patch_size
+        self.stride = stride or patch_size
+        self.random_patches = random_patches
+        self.patches_per_day = patches_per_day
+        self.min_valid_fraction = min_valid_fraction
+        self.rng = np.random.default_rng(seed)
+
+        # (name, shape, rows) of every source, sources[name] lists one path per entry of self.dates
+        self.layouts = [('cygnss_reflectivity', CYGNSS_SHAPE, None)]
+        sources = {'cygnss_reflectivity': dated_paths(cygnss_dir, years)}
+
+        self.paired = smap_paths is not None
+        if self.paired:
+            if patch_size is None or random_patches:
+                raise ValueError("paired CYGNSS/SPIRE/SMAP samples need a patch_size and strided patches")
+
+            if isinstance(smap_paths, (str, os.PathLike)):
+                sources['smap'] = dated_paths(smap_paths, years)
+            else:
+                sources['smap'] = {Path(path).stem: str(path) for path in smap_paths}
+            sources['cygnss_snr'] = dated_paths(cygnss_snr_dir or os.path.join(os.path.dirname(os.path.normpath(cygnss_dir)), 'SNR'), years)
+            sources['spire_reflectivity'] = dated_paths(spire_dir or '/data01/lpu/SPIRE/reflectivity', years)
+
+            self.layouts += [
+                ('cygnss_snr', CYGNSS_SHAPE, None),
+                ('spire_reflectivity', SPIRE_SHAPE, SPIRE_CYGNSS_ROWS),
+                ('smap', CYGNSS_SHAPE, None),
+            ]
+
+        # only dates every source has
+        self.dates = sorted(set.intersection(*(set(paths) for paths in sources.values())))
+        self.sources = {name: [paths[date] for date in self.dates] for name, paths in sources.items()}
+        self.cygnss_paths = self.sources['cygnss_reflectivity']
+
+        # memmaps are opened lazily, so every DataLoader worker maps each day once in its own process
+        self._grids = {}
+
+        self.patches = None
+        if patch_size is not None and not random_patches:
+            self.patches = self._load_index(index_cache)
+
+    def _grid(self, name, idx):
+        key = (name, idx)
+        if key not in self._grids:
+            shape, rows = next((shape, rows) for layout, shape, rows in self.layouts if layout == name)
+            path = self.sources[name][idx]
+            if path.endswith('.sdat'):
+                # sparse days stay sparse, patches densify only their own rows
+                grid = SparseGrid(path)
+            else:
+                # copy-on-write keeps the array writable for torch.from_numpy without copying the file
+                grid = np.memmap(path, dtype=np.float32, mode='c', shape=shape)
+            self._grids[key] = grid if rows is None else grid[rows]
+        return self._grids[key]
+
+    def _valid_fraction(self, patch):
+        return np.count_nonzero(patch != -9999) / patch.size
+
+    # the index depends on the parameters and on the exact input files, anything else changing invalidates the cache
+    def _index_signature(self):
+        signature = {
+            'patch_size': self.patch_size,
+            'stride': self.stride,
+            'min_valid_fraction': self.min_valid_fraction,
+            'sources': {name: [[path, os.path.getmtime(path), os.path.getsize(path)] for path in paths]
+                        for name, paths in self.sources.items()},
+        }
+        return hashlib.sha256(json.dumps(signature, sort_keys=True).encode()).hexdigest()
+
+    def _load_index(self, index_cache):
+        if index_cache is None:
+            return self._strided_patches()
+
+        signature = self._index_signature()
+        if os.path.exists(index_cache):
+            cached = np.load(index_cache)
+            if str(cached['signature']) == signature:
+                return [tuple(patch) for patch in cached['patches'].tolist()]
+
+        patches = self._strided_patches()
+        np.savez(index_cache, signature=signature, patches=np.array(patches, dtype=np.int32).reshape(-1, 3))
+        return patches
+
+    # valid pixel fraction of every strided patch of a day and source at once, through a summed area table
+    def _patch_fractions(self, grid):
+        valid = np.zeros((grid.shape[0] + 1, grid.shape[1] + 1), dtype=np.int32)
+        valid[1:, 1:] = np.cumsum(np.cumsum(np.asarray(grid) != -9999, axis=0, dtype=np.int32), axis=1, dtype=np.int32)
+
+        p = self.patch_size
+        rows = np.arange(0, grid.shape[0] - p + 1, self.stride)[:, None]
+        cols = np.arange(0, grid.shape[1] - p + 1, self.stride)[None, :]
+        counts = valid[rows + p, cols + p] - valid[rows, cols + p] - valid[rows + p, cols] + valid[rows, cols]
+
+        return counts / (p * p)
+
+    def _strided_patches(self):
+        patches = []
+        for idx in range(len(self.dates)):
+            keep = None
+            for name, _, _ in self.layouts:
+                enough = self._patch_fractions(self._grid(name, idx)) >= self.min_valid_fraction
+                keep = enough if keep is None else keep & enough
+
+            # the day's memmaps are dropped again so the scan doesn't keep every file mapped
+            self._grids.clear()
+
+            for row, col in zip(*np.nonzero(keep)):
+                patches.append((idx, int(row) * self.stride, int(col) * self.stride))
+        return patches
+
+    def _random_patch(self, idx):
+        grid = self._grid('cygnss_reflectivity', idx)
+        # a few tries to find a patch with enough valid pixels, otherwise the last one drawn is used
+        for _ in range(10):
+            row = self.rng.integers(0, grid.shape[0] - self.patch_size + 1)
+            col = self.rng.integers(0, grid.shape[1] - self.patch_size + 1)
+            patch = grid[row:row + self.patch_size, col:col + self.patch_size]
+            if self._valid_fraction(patch) >= self.min_valid_fraction:
+                break
+        return patch
 
-        for year in years:
-            year_files = glob.glob(os.path.join(cygnss_dir, f"{year}", "*.dat"))
-            self.cygnss_paths.extend(year_files)
-        
     def __len__(self):
-        return len(self.cygnss_paths)
+        if self.patches is not None:
+            return len(self.patches)
+        if self.random_patches:
+            return len(self.dates) * self.patches_per_day
+        return len(self.dates)
 
     def __getitem__(self, idx):
-        cygnss_path = self.cygnss_paths[idx]
-        cygnss_data = np.fromfile(cygnss_path, dtype=np.float32).reshape(1800, 7200)
+        if self.paired:
+            day, row, col = self.patches[idx]
+            tiles = {name: self._grid(name, day)[row:row + self.patch_size, col:col + self.patch_size]
+                     for name, _, _ in self.layouts}
+            inputs = np.stack([tiles['cygnss_reflectivity'], tiles['cygnss_snr'], tiles['spire_reflectivity']])
+            return torch.from_numpy(inputs), torch.from_numpy(tiles['smap'])
 
-        cygnss_data = torch.tensor(cygnss_data)
+        if self.patches is not None:
+            day, row, col = self.patches[idx]
+            cygnss_data = self._grid('cygnss_reflectivity', day)[row:row + self.patch_size, col:col + self.patch_size]
+        elif self.random_patches:
+            cygnss_data = self._random_patch(idx // self.patches_per_day)
+        else:
+            # a sparse day is densified here, a dense one stays the memmap
+            cygnss_data = np.asarray(self._grid('cygnss_reflectivity', idx))
+
+        # shares memory with the memmap, no copy of the grid is made here
+        cygnss_data = torch.from_numpy(cygnss_data)
 
         return cygnss_data
 
-base_dir = "/data01/lpu/CYGNSS/reflectivity"
-years = ["2018"] 
+# gives every DataLoader worker its own random patch offsets
+def seed_worker(worker_id):
+    dataset = torch.utils.data.get_worker_info().dataset
+    dataset.rng = np.random.default_rng(torch.initial_seed() % 2**32)
+
+if __name__ == "__main__":
+    base_dir = "/data01/lpu/CYGNSS/reflectivity"
+    years = ["2018"]
 
-dataset = SoilMoistureRetrievalDataset(base_dir, years)
-dataloader = DataLoader(dataset, batch_size=4, shuffle=True, num_workers=4)
+    dataset = SoilMoistureRetrievalDataset(base_dir, years, patch_size=256, random_patches=True, min_valid_fraction=0.1)
+    dataloader = DataLoader(dataset, batch_size=32, shuffle=True, num_workers=4, worker_init_fn=seed_worker)
 
-for batch in dataloader:
-    pass
\ No newline at end of file
+    for batch in dataloader:
+        pass
@@ -0,0 +1,135 @@
+import struct
+import numpy as np
+from manifest import atomic_write
+from gridding import FILL_VALUE, Partial
+
+# Task: sparse daily binaries (.sdat) for days that only fill a small fraction of the grid
+# a .sdat file is a 40 byte header followed by four arrays over the filled cells only, in flat cell order:
+#   magic b'SPGRID02', n_rows uint32, n_cols uint32, n_cells uint64, lat_min float64, resolution float64
+#   sums float64[n_cells], cells int32 (sorted flat y * n_cols + x), counts int32, means float32
+# the sums are float64 like GridAccumulator's, so composites of sparse days add up exactly like dense ones; they come
+# first to stay 8 byte aligned. SPGRID01 files (float32 sums after the cells) are still read
+# SparseGrid reads them lazily: slicing rows stays sparse, and only the rows actually used are densified
+
+SPARSE_MAGIC = b'SPGRID02'
+SPARSE_HEADER = struct.Struct('<8sIIQdd')
+SPARSE_FIELDS = [('sums', np.float64), ('cells', np.int32), ('counts', np.int32), ('means', np.float32)]
+SPARSE_FORMATS = {
+    SPARSE_MAGIC: SPARSE_FIELDS,
+    b'SPGRID01': [('cells', np.int32), ('sums', np.float32), ('counts', np.int32), ('means', np.float32)],
+}
+
+# the sparse form of a GridAccumulator, returns the sha256 of what was written
+def write_sparse(accumulator, path):
+    spec = accumulator.spec
+    cells = np.flatnonzero(accumulator.count).astype(np.int32)
+    counts = accumulator.count.ravel()[cells]
+    sums = accumulator.sum.ravel()[cells]
+
+    header = SPARSE_HEADER.pack(SPARSE_MAGIC, spec.n_rows, spec.n_cols, cells.size, spec.lat_min, spec.resolution)
+    # means come from the float64 sums, like GridAccumulator.mean, so they match the dense .dat exactly
+    arrays = {'sums': sums, 'cells': cells, 'counts': counts, 'means': sums / counts}
+    return atomic_write(path, header + b''.join(arrays[name].astype(dtype).tobytes() for name, dtype in SPARSE_FIELDS))
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        magic, n_rows, n_cols, n_cells, lat_min, resolution = SPARSE_HEADER.unpack(f.read(SPARSE_HEADER.size))
+    if magic not in SPARSE_FORMATS:
+        raise ValueError(f"{path} is not a sparse daily binary")
+    return (n_rows, n_cols), n_cells, lat_min, resolution, SPARSE_FORMATS[magic]
+
+# memmaps of the cells, sums, counts and means arrays of a .sdat file
+def open_sparse(path):
+    shape, n_cells, _, _, fields = read_header(path)
+    arrays, offset = {}, SPARSE_HEADER.size
+    for name, dtype in fields:
+        arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(n_cells,)) if n_cells else np.empty(0, dtype)
+        offset += n_cells * np.dtype(dtype).itemsize
+    return shape, arrays
+
+class SparseGrid:
+    # behaves like the (rows, cols) memmap of a dense daily binary for the ways the pipeline reads them:
+    # grid[a:b] is another lazy SparseGrid over those rows, grid[a:b, c:d], grid[i] and np.asarray(grid) are dense
+    # field is 'means' (the daily mean, -9999 where empty), 'counts' (0 where empty) or 'sums'
+    def __init__(self, path, field='means', rows=None, arrays=None, shape=None):
+        self.path = path
+        self.field = field
+        if arrays is None:
+            shape, arrays = open_sparse(path)
+        self._arrays = arrays
+        self._full_shape = shape
+        self.rows = rows if rows is not None else (0, shape[0])
+        self.dtype = self._arrays[field].dtype
+        self.fill = FILL_VALUE if field == 'means' else 0
+
+    @property
+    def shape(self):
+        return (self.rows[1] - self.rows[0], self._full_shape[1])
+
+    @property
+    def ndim(self):
+        return 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def n_cells(self):
+        lo, hi = self.cell_range()
+        return hi - lo
+
+    # [lo, hi) positions in the cell arrays of the filled cells within this view's rows
+    def cell_range(self, start=0, stop=None):
+        stop = self.shape[0] if stop is None else stop
+        n_cols = self._full_shape[1]
+        cells = self._arrays['cells']
+        lo = np.searchsorted(cells, (self.rows[0] + start) * n_cols)
+        hi = np.searchsorted(cells, (self.rows[0] + stop) * n_cols)
+        return int(lo), int(hi)
+
+    # (flat cells relative to this view, values) of the filled cells, for callers working on the sparse form directly
+    def items(self):
+        lo, hi = self.cell_range()
+        return (np.asarray(self._arrays['cells'][lo:hi]) - self.rows[0] * self._full_shape[1],
+                np.asarray(self._arrays[self.field][lo:hi]))
+
+    def view(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(self.shape[0])
+        stop = max(start, stop)
+        return SparseGrid(self.path, self.field, (self.rows[0] + start, self.rows[0] + stop), self._arrays, self._full_shape)
+
+    def dense(self, start=0, stop=None):
+        stop = self.shape[0] if stop is None else stop
+        n_cols = self._full_shape[1]
+        block = np.full((stop - start) * n_cols, self.fill, dtype=self.dtype)
+        lo, hi = self.cell_range(start, stop)
+        block[np.asarray(self._arrays['cells'][lo:hi]) - (self.rows[0] + start) * n_cols] = self._arrays[self.field][lo:hi]
+        return block.reshape(stop - start, n_cols)
+
+    def __array__(self, dtype=None, copy=None):
+        grid = self.dense()
+        return grid if dtype is None else grid.astype(dtype)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and key.step in (None, 1):
+            return self.view(key.start, key.stop)
+
+        if isinstance(key, tuple) and key and isinstance(key[0], slice) and key[0].step in (None, 1):
+            start, stop, _ = key[0].indices(self.shape[0])
+            return self.dense(start, max(start, stop))[(slice(None),) + key[1:]]
+
+        # anything else (single rows, index arrays) densifies the rows it spans
+        rows = np.asarray(key[0] if isinstance(key, tuple) else key)
+        if rows.size == 0:
+            return self.dense(0, 0)[key]
+        rows = np.where(rows < 0, rows + self.shape[0], rows)
+        start, stop = int(rows.min()), int(rows.max()) + 1
+        block = self.dense(start, stop)
+        return block[(rows - start,) + tuple(key[1:]) if isinstance(key, tuple) else rows - start]
+
+    # the view's readings as a gridding.Partial, so accumulators can add a sparse day without densifying it
+    def to_partial(self):
+        lo, hi = self.cell_range()
+        cells = np.asarray(self._arrays['cells'][lo:hi]) - self.rows[0] * self._full_shape[1]
+        return Partial(cells.astype(np.int32), np.asarray(self._arrays['sums'][lo:hi], dtype=np.float64),
+                       np.asarray(self._arrays['counts'][lo:hi]))
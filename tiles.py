@@ -0,0 +1,312 @@
+import argparse, json, os, struct, zlib, hashlib
+from functools import partial
+from pathlib import Path
+import numpy as np
+from gridding import FILL_VALUE, MISSION_GRIDS, PYRAMID_LEVELS, level_spec, file_pool, map_files
+from daily_binaries import daily_paths
+from manifest import atomic_write, file_signature
+from map_renderer import downsample
+from sparse_daily import SparseGrid
+from grid_io import open_grid
+
+# Task: turn daily binaries and composite grids into XYZ (web mercator) PNG tile pyramids for a static viewer
+# tiles are sampled straight from the lat/lon grid (memmapped, or block averaged for zooms coarser than the grid),
+# colormapped through a lookup table and encoded with zlib, so no matplotlib figure is involved
+# every layer keeps a tiles.json with the hash of each tile's pixels, reruns only rewrite tiles whose pixels changed
+#
+#   python tiles.py CYGNSS /data01/lpu/CYGNSS/reflectivity/2024 --start 2024-02-01 --end 2024-02-29 --vmax 0.015
+#   python tiles.py SPIRE /data01/lpu/spire_snr_grid.npy --vmax 2 --workers 16
+# then open <output>/index.html
+
+TILE_SIZE = 256
+
+# 256 x RGBA lookup table of a matplotlib colormap, only needed once per run
+def colormap_lut(cmap='viridis'):
+    from matplotlib import colormaps
+    return (colormaps[cmap](np.linspace(0, 1, 256)) * 255).round().astype(np.uint8)
+
+# minimal 8 bit RGBA PNG writer, one zlib stream of filter-0 rows
+def encode_png(rgba):
+    height, width, _ = rgba.shape
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)], axis=1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+# lon of every pixel column and lat of every pixel row of tile (z, x, y), at the pixel centers
+def tile_lonlat(z, x, y):
+    n_pixels = (2 ** z) * TILE_SIZE
+    px = (x * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / n_pixels
+    py = (y * TILE_SIZE + np.arange(TILE_SIZE) + 0.5) / n_pixels
+    return px * 360 - 180, np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * py))))
+
+# tile rows y of zoom z that overlap [lat_min, lat_max]
+def tile_rows(z, lat_min, lat_max):
+    def row(lat):
+        lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+        return int((1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / np.pi) / 2 * 2 ** z)
+    return range(max(0, row(lat_max)), min(2 ** z - 1, row(lat_min)) + 1)
+
+# nearest cell of the (rows from lat_min northwards, cols from lon 0 eastwards) grid for every pixel, NaN outside
+def tile_values(grid, lat_min, resolution, z, x, y):
+    lon, lat = tile_lonlat(z, x, y)
+    cols = np.minimum((np.mod(lon, 360) / resolution).astype(int), grid.shape[1] - 1)
+    rows = np.floor((lat - lat_min) / resolution).astype(int)
+    inside = (rows >= 0) & (rows < grid.shape[0])
+
+    values = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+    if inside.any():
+        values[inside] = np.asarray(grid[rows[inside]])[:, cols]
+    values[values == FILL_VALUE] = np.nan
+    return values
+
+def colorize(values, lut, vmin, vmax):
+    index = np.clip((values - vmin) / (vmax - vmin) * 255, 0, 255)
+    rgba = lut[np.nan_to_num(index).astype(np.uint8)]
+    rgba[np.isnan(values), 3] = 0
+    return rgba
+
+# grid of a source for one zoom: the full grid (a memmap for .dat/.npy) once a tile pixel is finer than a cell,
+# otherwise the grid block averaged down to about one cell per pixel
+def zoom_grid(source, resolution, z):
+    factor = int(360 / ((2 ** z) * TILE_SIZE) / resolution)
+    return (source, resolution) if factor <= 1 else (downsample(source, factor), resolution * factor)
+
+# renders one tile row (z, y) of a layer, runs in the worker processes
+# grid is either an array, a (path, shape, offset) memmap source or the path of a sparse .sdat day, known maps "z/x/y" to the hash of the tile on disk
+# returns {"z/x/y": hash} of the row's non empty tiles and the number of tiles written or removed
+def render_row(task, layer_dir, lat_min, lut, vmin, vmax, known):
+    z, y, grid, resolution = task
+    if isinstance(grid, tuple):
+        path, shape, offset = grid
+        grid = np.memmap(path, dtype=np.float32, mode='r', shape=shape, offset=offset)
+    elif isinstance(grid, str):
+        grid = SparseGrid(grid)
+
+    hashes, touched = {}, 0
+    for x in range(2 ** z):
+        key = f"{z}/{x}/{y}"
+        path = f"{layer_dir}/{key}.png"
+        rgba = colorize(tile_values(grid, lat_min, resolution, z, x, y), lut, vmin, vmax)
+
+        # fully transparent tiles aren't stored, the viewer just shows nothing there
+        if not rgba[..., 3].any():
+            if os.path.exists(path):
+                os.unlink(path)
+                touched += 1
+            continue
+
+        digest = hashlib.sha256(rgba.tobytes()).hexdigest()
+        hashes[key] = digest
+        if known.get(key) == digest and os.path.exists(path):
+            continue
+
+        atomic_write(path, encode_png(rgba))
+        touched += 1
+
+    return hashes, touched
+
+# the grid of a .dat (any pyramid level of the mission's grid), .sdat, .npy or legacy .pkl source and its resolution
+def open_source(path, mission):
+    path = str(path)
+    spec = MISSION_GRIDS[mission]
+    if path.endswith('.sdat'):
+        grid = SparseGrid(path)
+    elif path.endswith(('.pkl', '.npy')):
+        grid = open_grid(path)
+    else:
+        size = os.path.getsize(path) // 4
+        shapes = [(level_spec(spec, level).n_rows, level_spec(spec, level).n_cols) for level in PYRAMID_LEVELS]
+        grid = np.memmap(path, dtype=np.float32, mode='r', shape=next(shape for shape in shapes if shape[0] * shape[1] == size))
+    return grid, 360 / grid.shape[1]
+
+# writes the tiles of one grid into <output>/<name>/z/x/y.png, skipping the whole layer when neither the source
+# file nor the rendering parameters changed since the last run and every unchanged tile otherwise
+def export_layer(source_path, name, mission, output, zooms, vmin, vmax, cmap='viridis', executor=None, force=False):
+    layer_dir = f"{output}/{name}"
+    index_path = f"{layer_dir}/tiles.json"
+    params = {'mission': mission, 'zooms': list(zooms), 'vmin': vmin, 'vmax': vmax, 'cmap': cmap}
+    signature = file_signature(source_path)
+
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if not force and index.get('source') == signature and index.get('params') == params:
+            print(f"Layer {name} is up to date")
+            return index
+
+    grid, resolution = open_source(source_path, mission)
+    lat_min = MISSION_GRIDS[mission].lat_min
+    lat_max = lat_min + grid.shape[0] * resolution
+
+    # full grids go to the workers as (path, shape, offset) so every process maps the file instead of receiving a
+    # copy with every tile row, legacy pickled grids are spilled to a temporary raw file for that
+    source, spilled = grid, None
+    if executor is not None and isinstance(grid, SparseGrid):
+        source = grid.path
+    elif executor is not None:
+        if not isinstance(grid, np.memmap):
+            spilled = f"{output}/.{name.replace('/', '_')}.{os.getpid()}.dat"
+            os.makedirs(output, exist_ok=True)
+            np.asarray(grid, dtype=np.float32).tofile(spilled)
+            grid = np.memmap(spilled, dtype=np.float32, mode='r', shape=grid.shape)
+        source = (str(grid.filename), grid.shape, grid.offset)
+
+    tasks = []
+    for z in range(zooms[0], zooms[1] + 1):
+        z_grid, z_resolution = zoom_grid(grid, resolution, z)
+        z_source = source if z_grid is grid else z_grid
+        tasks += [(z, y, z_source, z_resolution) for y in tile_rows(z, lat_min, lat_max)]
+
+    known = index.get('tiles', {}) if not force else {}
+    render = partial(render_row, layer_dir=layer_dir, lat_min=lat_min, lut=colormap_lut(cmap), vmin=vmin, vmax=vmax,
+                     known=known)
+
+    tiles, touched = {}, 0
+    try:
+        for task, (result, error) in map_files(render, tasks, executor):
+            if error is not None:
+                raise error
+            tiles.update(result[0])
+            touched += result[1]
+    finally:
+        if spilled is not None:
+            os.unlink(spilled)
+
+    # tiles of rows or zooms that are no longer rendered are removed too
+    for key in known.keys() - tiles.keys():
+        if os.path.exists(f"{layer_dir}/{key}.png"):
+            os.unlink(f"{layer_dir}/{key}.png")
+            touched += 1
+
+    print(f"Layer {name}: {len(tiles)} tiles, {touched} written or removed")
+    index = {'source': signature, 'params': params, 'tiles': tiles}
+    atomic_write(index_path, json.dumps(index, separators=(',', ':')).encode())
+    return index
+
+VIEWER = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>CubeSat soil moisture tiles</title>
+<style>
+  html, body { margin: 0; height: 100%; font-family: sans-serif; }
+  #map { position: absolute; top: 40px; bottom: 0; left: 0; right: 0; overflow: hidden; background: #ddd; cursor: grab; }
+  #map img { position: absolute; width: 256px; height: 256px; image-rendering: pixelated; }
+  #bar { height: 40px; display: flex; align-items: center; gap: 12px; padding: 0 12px; }
+</style>
+</head>
+<body>
+<div id="bar">
+  <select id="layer"></select>
+  <input id="step" type="range" min="0" value="0">
+  <span id="info"></span>
+</div>
+<div id="map"></div>
+<!-- layers.js defines LAYERS, so the viewer also works from file:// without a server -->
+<script src="layers.js"></script>
+<script>
+var map = document.getElementById('map'), select = document.getElementById('layer');
+var step = document.getElementById('step'), info = document.getElementById('info');
+var view = {z: 1, x: 256, y: 256};  // zoom and the world pixel at the top left corner
+var layer = LAYERS[0];
+
+LAYERS.forEach(function (l, i) { var o = document.createElement('option'); o.value = i; o.text = l.name; select.add(o); });
+step.max = LAYERS.length - 1;
+select.onchange = function () { step.value = select.value; pick(+select.value); };
+step.oninput = function () { select.value = step.value; pick(+step.value); };
+
+function pick(i) { layer = LAYERS[i]; draw(); }
+
+function draw() {
+  var z = Math.max(layer.minzoom, Math.min(layer.maxzoom, view.z)), n = 1 << z;
+  var w = map.clientWidth, h = map.clientHeight;
+  map.innerHTML = '';
+  for (var ty = Math.floor(view.y / 256); ty * 256 < view.y + h; ty++) {
+    if (ty < 0 || ty >= n) continue;
+    for (var tx = Math.floor(view.x / 256); tx * 256 < view.x + w; tx++) {
+      var img = document.createElement('img');
+      img.src = layer.name + '/' + z + '/' + (((tx % n) + n) % n) + '/' + ty + '.png';
+      img.onerror = function () { this.remove(); };
+      img.style.left = (tx * 256 - view.x) + 'px';
+      img.style.top = (ty * 256 - view.y) + 'px';
+      map.appendChild(img);
+    }
+  }
+  info.textContent = layer.name + '  z' + z + '  [' + layer.vmin + ', ' + layer.vmax + '] ' + layer.cmap;
+}
+
+map.onwheel = function (e) {
+  e.preventDefault();
+  var dz = e.deltaY < 0 ? 1 : -1, z = view.z + dz;
+  if (z < layer.minzoom || z > layer.maxzoom) return;
+  var f = dz > 0 ? 2 : 0.5;
+  view.x = (view.x + e.offsetX) * f - e.offsetX;
+  view.y = (view.y + e.offsetY) * f - e.offsetY;
+  view.z = z;
+  draw();
+};
+
+var drag = null;
+map.onmousedown = function (e) { drag = {x: e.clientX, y: e.clientY}; };
+window.onmouseup = function () { drag = null; };
+window.onmousemove = function (e) {
+  if (!drag) return;
+  view.x -= e.clientX - drag.x; view.y -= e.clientY - drag.y;
+  drag = {x: e.clientX, y: e.clientY};
+  draw();
+};
+window.onresize = draw;
+pick(0);
+</script>
+</body>
+</html>
+"""
+
+# index.html plus layers.js listing every layer with a tiles.json under output
+def write_viewer(output):
+    layers = []
+    for index_path in sorted(Path(output).glob('**/tiles.json')):
+        with open(index_path, 'r') as f:
+            params = json.load(f)['params']
+        layers.append({'name': index_path.parent.relative_to(output).as_posix(), 'minzoom': params['zooms'][0],
+                       'maxzoom': params['zooms'][1], 'vmin': params['vmin'], 'vmax': params['vmax'], 'cmap': params['cmap']})
+
+    atomic_write(f"{output}/layers.js", f"var LAYERS = {json.dumps(layers, indent=1)};\n".encode())
+    atomic_write(f"{output}/index.html", VIEWER.encode())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('mission', choices=MISSION_GRIDS.keys())
+    parser.add_argument('source', help="a folder of YYYY-MM-DD.dat daily binaries (one layer per date) or one .dat/.npy/.pkl grid")
+    parser.add_argument('--name', default=None, help="layer name, defaults to <product>/<date> or the grid's file name")
+    parser.add_argument('--start', default=None)
+    parser.add_argument('--end', default=None)
+    parser.add_argument('--vmin', type=float, default=0)
+    parser.add_argument('--vmax', type=float, required=True)
+    parser.add_argument('--cmap', default='viridis')
+    parser.add_argument('--zooms', type=int, nargs=2, default=[0, 6], metavar=('MIN', 'MAX'),
+                        help="zoom 5 is about one 5km cell per pixel at the equator")
+    parser.add_argument('--output', default='/data01/lpu/tiles')
+    parser.add_argument('--workers', type=int, default=1, help="processes rendering tile rows in parallel (1 = serial)")
+    parser.add_argument('--force', action='store_true', help="re-render every tile")
+    args = parser.parse_args()
+
+    source = Path(args.source)
+    if source.is_dir():
+        # /data01/lpu/CYGNSS/reflectivity/2024 -> layers CYGNSS_reflectivity/2024-02-01, ...
+        prefix = args.name or f"{args.mission}_{source.parent.name}"
+        layers = [(path, f"{prefix}/{date}") for date, path in daily_paths(source, args.start, args.end).items()]
+    else:
+        layers = [(source, args.name or source.stem)]
+
+    with file_pool(args.workers) as executor:
+        for path, name in layers:
+            export_layer(path, name, args.mission, args.output, args.zooms, args.vmin, args.vmax, args.cmap, executor,
+                         args.force)
+
+    write_viewer(args.output)
@@ -1,40 +1,38 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import pickle
+from histograms import Histogram, linear_edges, log_edges, filled_chunks, distribution
 
-def create_bin_figure(grid, title, file_name, min_val, max_val, bin_size, log_scale=False):
-    # filter out default data
-    filtered_grid = grid[grid != -9999]
-
-    # create bins of 5
-    offset = bin_size / 2
-    min_val = np.floor(min_val / bin_size) * bin_size
-    max_val = np.ceil(max_val / bin_size) * bin_size
-    bins = np.arange(min_val-offset, max_val+offset, bin_size)
-
-    # create a histogram from the bins 
-    counts, edges = np.histogram(filtered_grid, bins=bins)
+# draws a Histogram (see histograms.py), e.g. a cached one, so changing the scale or title never rescans the data
+def plot_histogram(histogram, title, file_name, log_scale=False, log_x=False):
+    edges = histogram.edges
 
     # plotting stuff
-    plt.bar(edges[:-1], counts, width=bin_size, edgecolor="black", align="edge")
+    plt.bar(edges[:-1], histogram.counts, width=np.diff(edges), edgecolor="black", align="edge")
     plt.xlabel('Value Range')
     plt.ylabel('Count')
     plt.title(title)
-    
+
     if log_scale:
         plt.yscale('log')
+    if log_x:
+        plt.xscale('log')
 
     plt.savefig(file_name, dpi=300, bbox_inches='tight')
     plt.close()
 
-if __name__ == "__main__":
-    with open('/data01/lpu/slope_grid.pkl', 'rb') as f:
-        slope_grid = pickle.load(f)
-    with open('/data01/lpu/mse_grid.pkl', 'rb') as f:
-        mse_grid = pickle.load(f)
+def create_bin_figure(grid, title, file_name, min_val, max_val, bin_size, log_scale=False):
+    # bins of bin_size centered on the multiples of bin_size, -9999 (default data) left out chunk by chunk
+    histogram = Histogram(linear_edges(min_val, max_val, bin_size))
+    for values in filled_chunks(grid):
+        histogram.add(values)
 
-    print(np.max(slope_grid[slope_grid != -9999]))
-    print(np.max(mse_grid[mse_grid != -9999]))
+    plot_histogram(histogram, title, file_name, log_scale)
+
+if __name__ == "__main__":
+    # the regression grids span many orders of magnitude, so they get log-spaced bins; the histograms are cached in
+    # histograms.CACHE_DIR, rerunning with another title or scale only reads the cache
+    for name, title in [('slope', "Distribution of Values in LR Slope"), ('mse', "Distribution of Values in LR MSE")]:
+        histogram, sketch = distribution([f'/data01/lpu/{name}_grid.npy'], log_edges(1e-6, 1e6, 20))
+        print(f"{name}: max {histogram.max}, median {sketch.quantile(0.5):.6g}, 99th percentile {sketch.quantile(0.99):.6g}")
 
-    create_bin_figure(slope_grid, "Distribution of Values in LR Slope", "figures/regression/slope_bins.png", 0, 1000000, 1000, True)
-    create_bin_figure(mse_grid, "Distribution of Values in LR MSE", "figures/regression/mse_bins.png", 0, 1000000, 1000, True)
\ No newline at end of file
+        plot_histogram(histogram, title, f"figures/regression/{name}_bins.png", log_scale=True, log_x=True)
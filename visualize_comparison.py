@@ -1,76 +1,33 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
-import pickle
+from grid_io import open_grid
+from map_renderer import MapRenderer
+from comparison_stats import REGIONS, accumulate
 
+# bias, RMSD and correlation of grid1 - grid2 over the cells both have, streamed over row chunks (see
+# comparison_stats.py), with the float32 |grid1 - grid2| grid for the map
 def calculate_statistics(grid1, grid2):
     if grid1.shape != grid2.shape:
         return None
 
-    diff = np.full(grid1.shape, -9999.00)
-    mask = ~(grid1 == -9999.00) & ~(grid2 == -9999.00)
-    diff[mask] = grid1[mask] - grid2[mask]
-    valid_diff = diff[mask]
-
-    bias = np.mean(valid_diff)
-    rmsd = np.sqrt(np.mean(np.square(valid_diff)))
-    corr_coeff = np.corrcoef(grid1[mask], grid2[mask])[0, 1]
-
-    stats = (bias, rmsd, corr_coeff)
-    diff_grid = np.full(grid1.shape, -9999.00)
-    diff_grid[mask] = np.abs(grid1[mask] - grid2[mask])
+    diff_grid = np.empty(grid1.shape, dtype=np.float32)
+    moments = accumulate(grid1, grid2, {'global': REGIONS['global']}, diff_grid=diff_grid)['global'].stats()
+    stats = (moments['bias'], moments['rmsd'], moments['r'])
 
     return diff_grid, stats
 
-def create_figure(grid, title, label, file_name, isomin, isomax, lonmin, lonmax, latmin, latmax, stats=None):
-    fig, ax = plt.subplots(figsize=(12, 8))
-
-    m = Basemap(projection='cyl', llcrnrlat=latmin, urcrnrlat=latmax,
-                llcrnrlon=lonmin, urcrnrlon=lonmax, resolution='c', ax=ax)
-
-    lon_vals = np.linspace(0, 360, grid.shape[1])
-    lat_vals = np.linspace(-45, 45, grid.shape[0])
-    lon_grid, lat_grid = np.meshgrid(lon_vals, lat_vals)
-
-    masked_grid = np.ma.masked_where(grid == -9999, grid)
-
-    cs = m.pcolormesh(lon_grid, lat_grid, masked_grid, shading='auto', 
-                      cmap='viridis', vmin=isomin, vmax=isomax)
+# one renderer for the whole run, the Basemap and coastlines of every extent are drawn once, see map_renderer.py
+renderer = MapRenderer()
 
-    m.drawcoastlines(linewidth=0.5)
-    m.drawcountries(linewidth=0.5)
-
-    m.drawparallels(np.arange(-90, 91, 20), labels=[1, 0, 0, 0])  
-    m.drawmeridians(np.arange(0, 361, 20), labels=[0, 0, 0, 1])  
-
-    cbar = m.colorbar(cs, location='right', pad="5%")
-    cbar.set_label(label)
-
-    ax.set_title(title)
-
-    if stats:
-        bias, rmsd, corr = stats
-        textstr = '\n'.join((
-            f"Bias: {bias:.4f}",
-            f"RMSD: {rmsd:.4f}",
-            f"Correlation: {corr:.4f}"
-        ))
-        props = dict(boxstyle='round', facecolor='white', alpha=0.7)
-        ax.text(0.05, 0.05, textstr, transform=ax.transAxes, fontsize=10,
-                verticalalignment='bottom', bbox=props)
-
-    plt.savefig(file_name, dpi=300, bbox_inches='tight')
-    plt.close()
+# the comparison grids all cover the CYGNSS latitudes, lonmin/lonmax/latmin/latmax is the part of them the map shows
+def create_figure(grid, title, label, file_name, isomin, isomax, lonmin, lonmax, latmin, latmax, stats=None):
+    renderer.render(grid, title, label, file_name, isomin, isomax, extent=(lonmin, lonmax, latmin, latmax),
+                    grid_extent=(0, 360, -45, 45), stats=stats)
 
 def visualize_SPIRE_vs_CYGNSS():
-    with open('/data01/lpu/spire_reflectivity_grid.pkl', 'rb') as f:
-        spire_refl_grid = pickle.load(f)
-    with open('/data01/lpu/cygnss_reflectivity_grid.pkl', 'rb') as f:
-        cygnss_refl_grid = pickle.load(f)
-    with open('/data01/lpu/spire_snr_grid.pkl', 'rb') as f:
-        spire_snr_grid = pickle.load(f)
-    with open('/data01/lpu/cygnss_snr_grid.pkl', 'rb') as f:
-        cygnss_snr_grid = pickle.load(f)
+    spire_refl_grid = open_grid('/data01/lpu/spire_reflectivity_grid.npy')
+    cygnss_refl_grid = open_grid('/data01/lpu/cygnss_reflectivity_grid.npy')
+    spire_snr_grid = open_grid('/data01/lpu/spire_snr_grid.npy')
+    cygnss_snr_grid = open_grid('/data01/lpu/cygnss_snr_grid.npy')
 
     spire_refl_grid = spire_refl_grid[900:2700, :]
     refl_grid, stats = calculate_statistics(spire_refl_grid, cygnss_refl_grid)
@@ -82,24 +39,27 @@ def visualize_SPIRE_vs_CYGNSS():
 
 
 def visualize_SPIRE_vs_CGYNSS_area():
-    with open('/data01/lpu/spire_reflectivity_grid.pkl', 'rb') as f:
-        spire_refl_grid = pickle.load(f)
-    with open('/data01/lpu/cygnss_reflectivity_grid.pkl', 'rb') as f:
-        cygnss_refl_grid = pickle.load(f)
+    spire_refl_grid = open_grid('/data01/lpu/spire_reflectivity_grid.npy')
+    cygnss_refl_grid = open_grid('/data01/lpu/cygnss_reflectivity_grid.npy')
 
     spire_refl_grid = spire_refl_grid[900:2700, :]
     refl_grid, _ = calculate_statistics(spire_refl_grid, cygnss_refl_grid)
-    
-    create_figure(refl_grid, "SPIRE vs CYGNSS Reflectivity, Australia (01-06/2024)", "Abs. Diff. in Reflectivity (dBZ)", "figures/comp_reflectivity_australia_map.png", 0, 0.06, 100, 160, -45, -10) 
-    create_figure(refl_grid, "SPIRE vs CYGNSS Reflectivity, North/Central America (01-06/2024)", "Abs. Diff. in Reflectivity (dBZ)", "figures/comp_reflectivity_america_map.png", 0, 0.06, 220, 300, 10, 45)
+
+    # both regions come from the same difference grid in one batch, each map only crops and draws its own cells
+    label = "Abs. Diff. in Reflectivity (dBZ)"
+    renderer.render_batch([
+        dict(grid=refl_grid, title="SPIRE vs CYGNSS Reflectivity, Australia (01-06/2024)", label=label,
+             file_name="figures/comp_reflectivity_australia_map.png", vmin=0, vmax=0.06,
+             extent=(100, 160, -45, -10), grid_extent=(0, 360, -45, 45)),
+        dict(grid=refl_grid, title="SPIRE vs CYGNSS Reflectivity, North/Central America (01-06/2024)", label=label,
+             file_name="figures/comp_reflectivity_america_map.png", vmin=0, vmax=0.06,
+             extent=(220, 300, 10, 45), grid_extent=(0, 360, -45, 45)),
+    ])
 
 def visualize_linear_regression():
-    # with open('/data01/lpu/slope_grid.pkl', 'rb') as f:
-    #     slope_grid = pickle.load(f)
-    # with open('/data01/lpu/intercept_grid.pkl', 'rb') as f:
-    #     intercept_grid = pickle.load(f)
-    with open('/data01/lpu/mse_grid.pkl', 'rb') as f:
-        mse_grid = pickle.load(f)
+    # slope_grid = open_grid('/data01/lpu/slope_grid.npy')
+    # intercept_grid = open_grid('/data01/lpu/intercept_grid.npy')
+    mse_grid = open_grid('/data01/lpu/mse_grid.npy')
 
     # create_figure(slope_grid, "Linear Regression Slope (012024-062024)", "Slope Value", "figures/regression/slope_map.png", -0.5, 0.5, 0, 360, -45, 45)
     # create_figure(intercept_grid, "Linear Regression Intercept (012024-062024)", "Intercept Value", "figures/regression/intercept_map.png", -10, 10, 0, 360, -45, 45)
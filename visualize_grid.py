@@ -1,69 +1,73 @@
-import numpy as np
 import matplotlib.pyplot as plt
-from mpl_toolkits.basemap import Basemap
-import pickle
+import os
+from gridding import PYRAMID_LEVELS
+from daily_binaries import SPIRE_SHAPE, CYGNSS_SHAPE
+from grid_io import open_grid, grid_exists
+from map_renderer import MapRenderer
 
-# creates a matplotlib figure for a given grid over an Earth map
-def create_figure(grid, title, label, file_name, isomin, isomax, latmin, latmax):
-    fig, ax = plt.subplots(figsize=(12, 8))
-
-    # the Basemap library adds a map of the Earth for easy viewing
-    m = Basemap(projection='cyl', llcrnrlat=latmin, urcrnrlat=latmax,
-                llcrnrlon=0, urcrnrlon=360, resolution='c', ax=ax)
+FIGSIZE = (12, 8)
+DPI = 300
 
-    # creates a meshgrid from [0, 360] and [-90, 90] used to translate argument grid to lon and lat values 
-    lon_vals = np.linspace(0, 360, grid.shape[1])
-    lat_vals = np.linspace(latmin, latmax, grid.shape[0])
-    lon_grid, lat_grid = np.meshgrid(lon_vals, lat_vals)
+# {level: grid} of a composite and the coarser levels ingest.py wrote next to it (<name>_<level>.npy), all memory-mapped
+# so only the level that gets drawn is read (old .pkl composites still load, see grid_io.open_grid)
+def load_pyramid(path):
+    root, ext = os.path.splitext(path)
+    pyramid = {}
+    for level, factor in PYRAMID_LEVELS.items():
+        level_path = path if factor == 1 else f"{root}_{level}{ext}"
+        if grid_exists(level_path):
+            pyramid[level] = open_grid(level_path)
+    return pyramid
 
-    # remove values that are equal to -9999 (the default value in make_grid.py)
-    masked_grid = np.ma.masked_where(grid == -9999, grid)
+# coarsest level of a {level: grid} pyramid that still has at least one cell per pixel of the map
+# (360 degrees over ~77% of a 12 inch figure at 300 dpi is ~0.13 degree per pixel, so the 10km level)
+def pick_figure_level(pyramid):
+    axes_fraction = plt.rcParams['figure.subplot.right'] - plt.rcParams['figure.subplot.left']
+    degrees_per_pixel = 360 / (FIGSIZE[0] * DPI * axes_fraction)
+    resolution = {level: 360 / grid.shape[1] for level, grid in pyramid.items()}
+    fine_enough = [level for level in pyramid if resolution[level] <= degrees_per_pixel]
+    if not fine_enough:
+        return min(pyramid, key=resolution.get)
+    return max(fine_enough, key=resolution.get)
 
-    cs = m.pcolormesh(lon_grid, lat_grid, masked_grid, shading='auto', 
-                    cmap='viridis', vmin=isomin, vmax=isomax)
+# one renderer for the whole run, so each map extent's Basemap and coastlines are drawn once
+renderer = MapRenderer(figsize=FIGSIZE, dpi=DPI)
 
-    # customization stuff
-    m.drawcoastlines(linewidth=0.5)
-    m.drawcountries(linewidth=0.5)
-
-    m.drawparallels(np.arange(-90, 91, 20), labels=[1, 0, 0, 0])  # Latitude lines
-    m.drawmeridians(np.arange(0, 361, 20), labels=[0, 0, 0, 1])   # Longitude lines
+# creates a matplotlib figure for a given grid over an Earth map
+# grid can also be a {level: grid} pyramid (see load_pyramid), then only the coarsest level the figure can show is drawn
+def create_figure(grid, title, label, file_name, isomin, isomax, latmin, latmax):
+    if isinstance(grid, dict):
+        grid = grid[pick_figure_level(grid)]
 
-    cbar = m.colorbar(cs, location='right', pad="5%")
-    cbar.set_label(label)
+    # -9999 cells (the default value in make_grid.py) are left blank
+    renderer.render(grid, title, label, file_name, isomin, isomax, extent=(0, 360, latmin, latmax))
 
-    ax.set_title(title)
+# (grid, title, label, figure, isomin, isomax, latmin, latmax) of every composite map
+COMPOSITE_MAPS = [
+    ('/data01/lpu/spire_snr_grid.npy', "SPIRE SNR (01/25/2024-06/02/2024)", "SNR (dB)", "figures/spire_snr_map.png", 0, 2, -90, 90),
+    ('/data01/lpu/spire_reflectivity_grid.npy', "SPIRE Reflectivity (01/25/2024-06/02/2024)", "Reflectivity (dBZ)", "figures/spire_reflectivity_map.png", 0, 0.015, -90, 90),
+    ('/data01/lpu/cygnss_snr_grid.npy', "CYGNSS SNR (01/25/2024-06/02/2024)", "SNR (dB)", "figures/cygnss_snr_map.png", 0, 2, -45, 45),
+    ('/data01/lpu/cygnss_reflectivity_grid.npy', "CYGNSS Reflectivity (01/25/2024-06/02/2024)", "Reflectivity (dBZ)", "figures/cygnss_reflectivity_map.png", 0, 0.015, -45, 45),
+]
 
-    plt.savefig(file_name, dpi=300, bbox_inches='tight')
-    plt.close()
+# renders a batch of COMPOSITE_MAPS entries in one process, loading one pyramid at a time
+def visualize_composites(maps=COMPOSITE_MAPS):
+    for path, title, label, file_name, isomin, isomax, latmin, latmax in maps:
+        create_figure(load_pyramid(path), title, label, file_name, isomin, isomax, latmin, latmax)
 
 def visualize_SPIRE():
-    with open('/data01/lpu/spire_snr_grid.pkl', 'rb') as f:
-        spire_snr_grid = pickle.load(f)
-        create_figure(spire_snr_grid, "SPIRE SNR (01/25/2024-06/02/2024)", "SNR (dB)", "figures/spire_snr_map.png", 0, 2, -90, 90)
-    with open('/data01/lpu/spire_reflectivity_grid.pkl', 'rb') as f:
-        spire_refl_grid = pickle.load(f)
-        create_figure(spire_refl_grid, "SPIRE Reflectivity (01/25/2024-06/02/2024)", "Reflectivity (dBZ)", "figures/spire_reflectivity_map.png", 0, 0.015, -90, 90)
+    visualize_composites([entry for entry in COMPOSITE_MAPS if 'spire' in entry[0]])
 
 def visualize_CYGNSS():
-    with open('/data01/lpu/cygnss_snr_grid.pkl', 'rb') as f:
-        cygnss_snr_grid = pickle.load(f)
-        create_figure(cygnss_snr_grid, "CYGNSS SNR (01/25/2024-06/02/2024)", "SNR (dB)", "figures/cygnss_snr_map.png", 0, 2, -45, 45)
-    with open('/data01/lpu/cygnss_reflectivity_grid.pkl', 'rb') as f:
-        cygnss_refl_grid = pickle.load(f)
-        create_figure(cygnss_refl_grid, "CYGNSS Reflectivity (01/25/2024-06/02/2024)", "Reflectivity (dBZ)", "figures/cygnss_reflectivity_map.png", 0, 0.015, -45, 45)
+    visualize_composites([entry for entry in COMPOSITE_MAPS if 'cygnss' in entry[0]])
 
 def visualize_binary_examples():
-    with open('/data01/lpu/CYGNSS/reflectivity/2023/2023-02-01.pkl', 'rb') as f:
-        cygnss_refl_grid = pickle.load(f)
-        create_figure(cygnss_refl_grid, "CYGNSS Reflectivity 02-01-2023", "Reflectivity (dBZ)", "figures/cygnss_refl_binary_map.png",  0, 0.015, -45, 45)
-    with open('/data01/lpu/SPIRE/reflectivity/2024/20240125.pkl', 'rb') as f:
-        spire_snr_grid = pickle.load(f)
-        create_figure(spire_snr_grid, "SPIRE Reflectivity 01-25-2024", "SNR (dB)", "figures/spire_snr_binary_map.png",  0, 2, -90, 90) 
+    cygnss_refl_grid = open_grid('/data01/lpu/CYGNSS/reflectivity/2023/2023-02-01.dat', CYGNSS_SHAPE)
+    create_figure(cygnss_refl_grid, "CYGNSS Reflectivity 02-01-2023", "Reflectivity (dBZ)", "figures/cygnss_refl_binary_map.png",  0, 0.015, -45, 45)
+    spire_snr_grid = open_grid('/data01/lpu/SPIRE/reflectivity/2024/2024-01-25.dat', SPIRE_SHAPE)
+    create_figure(spire_snr_grid, "SPIRE Reflectivity 01-25-2024", "SNR (dB)", "figures/spire_snr_binary_map.png",  0, 2, -90, 90) 
 
 if __name__ == "__main__":
-    # i've ran into memory issues with this file, seemingly from caching too much
-    # closing the terminal and reopening seems to fix this for mes
-    visualize_SPIRE()
-    visualize_CYGNSS()    
+    # maps used to be full 26M cell pcolormeshes with a new Basemap each, see map_renderer.py
+    visualize_composites()
     # visualize_binary_examples()
\ No newline at end of file